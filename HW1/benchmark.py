@@ -0,0 +1,306 @@
+"""
+Benchmarks for the HW1 chat server.
+
+    python benchmark.py codec      # wire protocol encode/decode throughput
+    python benchmark.py server     # threaded vs asyncio server: idle connections and load
+    python benchmark.py storage    # read_messages latency as the messages table grows
+"""
+import contextlib
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from argparse import ArgumentParser
+from protocol import CustomProtocol, JSONProtocol
+from storage import Storage, migrate
+
+
+class LoopbackSocket:
+    """In-memory socket: whatever is sent can be received back."""
+    def __init__(self):
+        self.data = bytearray()
+        self.offset = 0
+
+    def sendall(self, data):
+        self.data += data
+
+    def recv_into(self, buffer, nbytes=0):
+        chunk = self.data[self.offset:self.offset + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.offset += len(chunk)
+        return len(chunk)
+
+
+SAMPLE_MESSAGES = [
+    (1, {"username": "alice", "password": "correct horse battery staple"}),
+    (3, {"recipient": "bob", "message": "hello bob, how are you doing today?"}),
+    (5, {"recipient": "bob", "message_id": 123456}),
+    (7, {"status": "success", "message": "Message stored for later delivery."}),
+]
+
+
+def load_protocol(revision):
+    """
+    protocol.py as of git `revision`, imported as a separate module, with its one-line
+    debug prints removed so that only the codec itself is timed.
+    """
+    source = subprocess.run(["git", "show", f"{revision}:./protocol.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    source = "\n".join(line for line in source.splitlines() if not line.strip().startswith("print("))
+    module = types.ModuleType(f"protocol@{revision}")
+    exec(compile(source, f"protocol.py@{revision}", "exec"), module.__dict__)
+    return module
+
+
+def time_codec(send, receive, iterations):
+    """Seconds to send the sample messages `iterations` times, and to receive them all back."""
+    sock = LoopbackSocket()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for action_type, fields in SAMPLE_MESSAGES:
+            send(sock, action_type, fields)
+    encoded = time.perf_counter()
+    for _ in range(iterations * len(SAMPLE_MESSAGES)):
+        receive(sock)
+    decoded = time.perf_counter()
+    return encoded - start, decoded - encoded
+
+
+def bench_codec(iterations, baseline=None, rounds=5):
+    """
+    Encode and decode the sample messages `iterations` times with each protocol, and with
+    the CustomProtocol of git revision `baseline` if one is given.
+    The protocols take turns for `rounds` rounds and each keeps its best time, so that
+    noise from other processes doesn't favour whichever ran first.
+    """
+    codecs = {
+        "custom": (lambda sock, action_type, fields: CustomProtocol.send(sock, action_type, **fields), CustomProtocol.receive),
+        "json": (lambda sock, action_type, fields: JSONProtocol.send(sock, {"action": action_type, **fields}), JSONProtocol.receive),
+    }
+    if baseline:
+        old = load_protocol(baseline).CustomProtocol
+        codecs[f"custom@{baseline}"] = (lambda sock, action_type, fields: old.send(sock, action_type, **fields), old.receive)
+    results = {name: (float("inf"), float("inf")) for name in codecs}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(rounds):
+            for name, (send, receive) in codecs.items():
+                encode_time, decode_time = time_codec(send, receive, iterations)
+                results[name] = (min(results[name][0], encode_time), min(results[name][1], decode_time))
+
+    count = iterations * len(SAMPLE_MESSAGES)
+    width = max(10, max(len(name) for name in results) + 2)
+    print(f"{'protocol':<{width}}{'encode msg/s':>16}{'decode msg/s':>16}")
+    for name, (encode_time, decode_time) in results.items():
+        print(f"{name:<{width}}{count / encode_time:>16,.0f}{count / decode_time:>16,.0f}")
+    if baseline:
+        encode_time, decode_time = results[f"custom@{baseline}"]
+        print(f"custom vs {baseline}: encode {encode_time / results['custom'][0]:.2f}x, decode {decode_time / results['custom'][1]:.2f}x")
+    return results
+
+
+def process_status(pid):
+    """Resident memory (KB) and thread count of a process, from /proc."""
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.split()[0] if value.split() else ""
+    return int(status["VmRSS"]), int(status["Threads"])
+
+
+def raise_fd_limit(wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+def run_client(port, use_json, username, requests, latencies, ready):
+    sock = socket.create_connection(("127.0.0.1", port))
+    try:
+        protocol_send, protocol_receive = (
+            (lambda data: JSONProtocol.send(sock, data), lambda: JSONProtocol.receive(sock)) if use_json else
+            (lambda data: CustomProtocol.send(sock, data.pop("action_type"), **data), lambda: CustomProtocol.receive(sock))
+        )
+        protocol_send({"action": "login", "action_type": 1, "username": username, "password": "password"})
+        protocol_receive()
+        # logins hash passwords with bcrypt, so keep them out of the measured window
+        ready.wait()
+        for _ in range(requests):
+            start = time.perf_counter()
+            protocol_send({"action": "list_accounts", "action_type": 2, "page_num": 1})
+            protocol_receive()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        sock.close()
+
+
+def bench_server(mode, port, idle, clients, requests, use_json):
+    """
+    Start a server in `mode` ("threaded" or "async"), hold `idle` idle connections open and
+    report its memory and thread count, then measure list_accounts latency from `clients`
+    concurrent clients.
+    """
+    limit = raise_fd_limit(idle + clients + 64)
+    if idle + clients + 64 > limit:
+        print(f"warning: file descriptor limit is {limit}, raise it with `ulimit -n`")
+        idle = max(0, limit - clients - 64)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        command = [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), "--db", os.path.join(tmp, "bench.db")]
+        if mode == "async":
+            command.append("--async")
+        if use_json:
+            command.append("--json")
+        server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+        idle_sockets = []
+        try:
+            wait_for_port(port)
+            base_rss, _ = process_status(server.pid)
+            for _ in range(idle):
+                idle_sockets.append(socket.create_connection(("127.0.0.1", port)))
+            time.sleep(1)
+            rss, threads = process_status(server.pid)
+
+            latencies = []
+            ready = threading.Barrier(clients + 1)
+            workers = [threading.Thread(target=run_client, args=(port, use_json, f"bench{i}", requests, latencies, ready)) for i in range(clients)]
+            for worker in workers:
+                worker.start()
+            ready.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            for sock in idle_sockets:
+                sock.close()
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    result = {
+        "idle": idle,
+        "rss_kb": rss,
+        "kb_per_connection": (rss - base_rss) / idle if idle else 0,
+        "threads": threads,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+    print(f"{mode:<10}{idle:>8}{rss / 1024:>10.1f}{result['kb_per_connection']:>10.1f}{threads:>9}"
+          f"{result['throughput']:>12,.0f}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}")
+    return result
+
+
+def fill_messages(storage, first_id, count, users):
+    """Insert `count` messages between `users` random users, about a tenth of them unread."""
+    rows = []
+    with storage.pool.connection() as conn:
+        for message_id in range(first_id, first_id + count):
+            sender, recipient = random.sample(range(users), 2)
+            status = "unread" if random.random() < 0.1 else "read"
+            rows.append((message_id, f"user{sender}", f"user{recipient}", "benchmark message", status))
+            if len(rows) == 100000:
+                with conn:
+                    conn.executemany("INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)", rows)
+                rows.clear()
+        with conn:
+            conn.executemany("INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def time_reads(storage, reads, users):
+    latencies = []
+    for _ in range(reads):
+        username = f"user{random.randrange(users)}"
+        start = time.perf_counter()
+        storage.read_messages(username, limit=10)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+def drop_indexes(conn):
+    """Take the schema back to migration 1, which has only the tables and their primary keys."""
+    with conn:
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall():
+            conn.execute(f"DROP INDEX {name}")
+        conn.execute("PRAGMA user_version = 1")
+
+
+def bench_storage(sizes, reads, users):
+    """
+    Grow the messages table through `sizes` rows and time read_messages at each size,
+    with the indexes from the migrations and without them.
+    """
+    print(f"{'rows':>10}{'indexed p50 ms':>16}{'p99 ms':>9}{'no index p50 ms':>17}{'p99 ms':>9}")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "bench.db"), pool_size=1)
+        rows = 0
+        for size in sizes:
+            fill_messages(storage, rows, size - rows, users)
+            rows = size
+            indexed = time_reads(storage, reads, users)
+            with storage.pool.connection() as conn:
+                drop_indexes(conn)
+            unindexed = time_reads(storage, max(1, reads // 10), users)
+            with storage.pool.connection() as conn:
+                # put the indexes back for the next size
+                migrate(conn)
+            results.append((size, indexed, unindexed))
+            print(f"{size:>10,}{indexed[0]:>16.3f}{indexed[1]:>9.3f}{unindexed[0]:>17.3f}{unindexed[1]:>9.3f}")
+        storage.close()
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    codec = subparsers.add_parser("codec", help="Protocol encode/decode throughput")
+    codec.add_argument("--iterations", type=int, default=20000)
+    codec.add_argument("--baseline", help="Also time the CustomProtocol of this git revision, e.g. 563df4b^")
+    codec.add_argument("--rounds", type=int, default=5, help="Keep each protocol's best time over this many rounds")
+    server = subparsers.add_parser("server", help="Threaded vs asyncio server under idle connections and load")
+    server.add_argument("--mode", choices=["threaded", "async", "both"], default="both")
+    server.add_argument("--port", type=int, default=65440)
+    server.add_argument("--idle", type=int, default=1000, help="Idle connections held open")
+    server.add_argument("--clients", type=int, default=20, help="Concurrent active clients")
+    server.add_argument("--requests", type=int, default=200, help="Requests per active client")
+    server.add_argument("--json", action="store_true", help="Use the JSON protocol")
+    storage = subparsers.add_parser("storage", help="read_messages latency as the messages table grows")
+    storage.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Table sizes to measure at")
+    storage.add_argument("--reads", type=int, default=1000, help="read_messages calls per size")
+    storage.add_argument("--users", type=int, default=1000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark == "codec":
+        bench_codec(args.iterations, args.baseline, args.rounds)
+    elif args.benchmark == "server":
+        print(f"{'mode':<10}{'idle':>8}{'RSS MB':>10}{'KB/conn':>10}{'threads':>9}{'req/s':>12}{'p50 ms':>9}{'p99 ms':>9}")
+        modes = ["threaded", "async"] if args.mode == "both" else [args.mode]
+        for i, mode in enumerate(modes):
+            bench_server(mode, args.port + i, args.idle, args.clients, args.requests, args.json)
+    elif args.benchmark == "storage":
+        bench_storage(args.sizes, args.reads, args.users)
@@ -6,7 +6,8 @@ from protocol import JSONProtocol, CustomProtocol
 from argparse import ArgumentParser
 import threading
 import queue
-import time
+import itertools
+import ast
 
 LOGIN = 1
 LIST_ACCOUNTS = 2
@@ -14,6 +15,8 @@ SEND_MESSAGE = 3
 READ_MESSAGES = 4
 DELETE_MESSAGE = 5
 DELETE_ACCOUNT = 6
+SEARCH_ACCOUNTS = 8
+READ_HISTORY = 9
 action_map = {
     1: "login",
     2: "list_accounts",
@@ -21,7 +24,12 @@ action_map = {
     4: "read_messages",
     5: "delete_message",
     6: "delete_account",
+    8: "search_accounts",
+    9: "read_history",
 }
+# seconds to wait for the response to a request
+RESPONSE_TIMEOUT = 5
+ACCOUNTS_PAGE_SIZE = 5
 
 def parse_args():
     parser = ArgumentParser()
@@ -40,6 +48,11 @@ class ChatClient:
         self.client.connect((args.host, args.port))
         self.username = None
         self.message_queue = queue.Queue()
+        # request id -> queue the listener thread puts the matching response into
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        # continuation token for the next page of accounts, empty after the last page
+        self.accounts_cursor = ""
         
         self.create_login_screen()
         
@@ -96,8 +109,11 @@ class ChatClient:
         self.message_limit.pack(side=tk.LEFT, padx=5)
         
         tk.Button(self.master, text="List Accounts", command=self.list_accounts).pack()
+        tk.Button(self.master, text="More Accounts", command=self.more_accounts).pack()
+        tk.Button(self.master, text="Search Accounts", command=self.search_accounts).pack()
         tk.Button(self.master, text="Send Message", command=self.send_message).pack()
         tk.Button(self.master, text="Read Messages", command=self.read_messages).pack()
+        tk.Button(self.master, text="Message History", command=self.read_history).pack()
         tk.Button(self.master, text="Delete Message", command=self.delete_message).pack()
         tk.Button(self.master, text="Delete Account", command=self.delete_account).pack()
     
@@ -106,13 +122,36 @@ class ChatClient:
         self.chat_log.insert(tk.END, message + "\n")
         self.chat_log.config(state=tk.DISABLED)
     
-    def list_accounts(self):
-        request = {'action_type': LIST_ACCOUNTS, 'page_num': 1}
-        self.send_request(request)
-        response = self.check_incoming_message()
+    def list_accounts(self, cursor=""):
+        request = {'action_type': LIST_ACCOUNTS, 'page_num': 1, 'page_size': ACCOUNTS_PAGE_SIZE, 'cursor': cursor}
+        request_id = self.send_request(request, wait=True)
+        response = self.check_incoming_message(request_id)
         if response["status"] == "success":
-            self.update_chat_log("Accounts: " + ", ".join(response["message"]))
+            accounts = response["message"]
+            # the custom protocol sends the list as its repr
+            if isinstance(accounts, str):
+                accounts = ast.literal_eval(accounts)
+            self.accounts_cursor = response.get("next_cursor", "")
+            self.update_chat_log("Accounts: " + ", ".join(accounts))
+
+    def more_accounts(self):
+        if not self.accounts_cursor:
+            self.update_chat_log("[System] No more accounts")
+            return
+        self.list_accounts(self.accounts_cursor)
     
+    def search_accounts(self):
+        query = simple_input("Username contains:")
+        if query:
+            request = {'action_type': SEARCH_ACCOUNTS, 'query': query, 'limit': 20, 'substring': 1}
+            request_id = self.send_request(request, wait=True)
+            response = self.check_incoming_message(request_id)
+            if response and response["status"] == "success":
+                accounts = response["message"]
+                if isinstance(accounts, str):
+                    accounts = ast.literal_eval(accounts)
+                self.update_chat_log("Matching accounts: " + (", ".join(accounts) or "none"))
+
     def send_message(self):
         recipient = simple_input("Enter recipient username:")
         message = simple_input("Enter message:")
@@ -134,6 +173,25 @@ class ChatClient:
         self.send_request(request)
         self.update_chat_log(f"[System] Reading up to {limit} unread messages from other users...")
 
+    def read_history(self):
+        """Show every message sent to this user, oldest first, a page at a time."""
+        cursor = ""
+        self.update_chat_log("--- History ---")
+        while True:
+            request = {"action_type": READ_HISTORY, "limit": 500, "cursor": cursor}
+            request_id = self.send_request(request, wait=True)
+            response = self.check_incoming_message(request_id)
+            if not response or response.get("status") != "success":
+                break
+            messages = response["message"]
+            if isinstance(messages, str):
+                messages = ast.literal_eval(messages)
+            for msg in messages:
+                self.update_chat_log(f"[{msg['id']}] From {msg['sender']}: {msg['message']}")
+            cursor = response.get("next_cursor", "")
+            if not cursor:
+                break
+
     def delete_message(self):
         message_id = simple_input("Enter message ID to delete:")
         if message_id:
@@ -144,30 +202,42 @@ class ChatClient:
         password = simple_input("Enter your password to delete account:")
         if password:
             request = {"action_type": DELETE_ACCOUNT, "password": password}
-            self.send_request(request)
+            request_id = self.send_request(request, wait=True)
             
-            response = JSONProtocol.receive(self.client) if self.args.json else CustomProtocol.receive(self.client)
+            response = self.check_incoming_message(request_id)
             
             if response and response.get("status") == "success":
                 self.client.close()
                 self.master.quit()
     
-    def send_request(self, request):
+    def send_request(self, request, wait=False):
+        """
+        Send a request tagged with a fresh request id and return the id.
+        Requests don't wait for each other, so several can be in flight on the connection.
+        With `wait`, the response is routed to check_incoming_message instead of the chat log.
+        """
+        request_id = next(self.request_ids)
+        if wait:
+            self.pending[request_id] = queue.Queue(maxsize=1)
         if self.args.json:
             action = request.pop('action_type', None)
             action = action_map[action]
-            request = {"action": action, **request}
+            request = {"action": action, "request_id": request_id, **request}
             JSONProtocol.send(self.client, request)
         else:
             action_type = request.pop('action_type', None)
-            CustomProtocol.send(self.client, action_type, **request)
+            CustomProtocol.send(self.client, action_type, request_id=request_id, **request)
+        return request_id
 
     def listen_for_messages(self):
         while True:
             try:
                 response = JSONProtocol.receive(self.client) if self.args.json else CustomProtocol.receive(self.client)
                 if response:
-                    if response.get("action") == "response":
+                    waiter = self.pending.get(response.get("request_id"))
+                    if waiter is not None:
+                        waiter.put(response)
+                    elif response.get("action") == "response":
                         status = response.get("status")
                         message = response.get("message")
                         
@@ -178,7 +248,6 @@ class ChatClient:
                                 pass
                             elif isinstance(message, str) and message.startswith('['):
                                 try:
-                                    import ast
                                     messages = ast.literal_eval(message)
                                     for msg in messages:
                                         self.update_chat_log(f"From {msg['sender']}: {msg['message']}")
@@ -197,11 +266,15 @@ class ChatClient:
                 self.update_chat_log(f"[Error]: Disconnected from server. {str(e)}")
                 break
     
-    def check_incoming_message(self):
-        time.sleep(1)
-        while not self.message_queue.empty():
-            return self.message_queue.get()
-        return {"status": "error", "message": "No response"}
+    def check_incoming_message(self, request_id=None, timeout=RESPONSE_TIMEOUT):
+        """Wait for the response to `request_id` (or the next queued message if no id is given)."""
+        waiter = self.pending.get(request_id, self.message_queue)
+        try:
+            return waiter.get(timeout=timeout)
+        except queue.Empty:
+            return {"status": "error", "message": "No response"}
+        finally:
+            self.pending.pop(request_id, None)
 
 def simple_input(prompt):
     return simpledialog.askstring("Input", prompt)
@@ -0,0 +1,119 @@
+"""
+Per-connection outbound frame queue for the threaded server.
+"""
+import collections
+import socket
+import threading
+
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded frames for one client, drained by a single writer thread,
+    so the threaded server runs two threads per client: this one and the reader.
+    Every frame for the connection goes through it, so frames written from different
+    threads never interleave, and the frames queued while a write is in progress are
+    sent together in the next `sendall`.
+
+    Once more than `high_watermark` bytes are queued the connection counts as slow:
+    `offer` refuses new frames and `sendall` blocks, until the writer has drained the
+    queue below `low_watermark`.
+
+    Frames offered with a `tag` that are still queued, or were being written, when the
+    connection dies are passed to `on_dropped` as a list of their tags, from the writer
+    thread, so the caller can tell which pushes never reached the client.
+    """
+    def __init__(self, socket, high_watermark=256 * 1024, low_watermark=64 * 1024, max_batch=64 * 1024, on_dropped=None):
+        self.socket = socket
+        self.on_dropped = on_dropped
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_batch = max_batch
+        self.frames = collections.deque()
+        self.buffered = 0
+        self.paused = False
+        self.closed = False
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def offer(self, data, tag=None):
+        """Queue `data` unless the connection is slow or closed. Never blocks."""
+        with self.condition:
+            if self.paused or self.closed:
+                self.dropped += 1
+                return False
+            self._append(data, tag)
+            return True
+
+    def sendall(self, data):
+        """Queue `data`, waiting while the connection is over its high watermark."""
+        with self.condition:
+            while self.paused and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                raise ConnectionError("connection closed")
+            self._append(data)
+
+    def _append(self, data, tag=None):
+        self.frames.append((data, tag))
+        self.buffered += len(data)
+        if self.buffered >= self.high_watermark:
+            self.paused = True
+        self.condition.notify_all()
+
+    def _run(self):
+        batch = []
+        try:
+            while True:
+                with self.condition:
+                    while not self.frames and not self.closed:
+                        self.condition.wait()
+                    if not self.frames:
+                        break
+                    batch = [self.frames.popleft()]
+                    size = len(batch[0][0])
+                    while self.frames and size + len(self.frames[0][0]) <= self.max_batch:
+                        frame = self.frames.popleft()
+                        batch.append(frame)
+                        size += len(frame[0])
+
+                self.socket.sendall(batch[0][0] if len(batch) == 1 else b"".join(data for data, _ in batch))
+                batch = []
+
+                with self.condition:
+                    self.buffered -= size
+                    if self.paused and self.buffered <= self.low_watermark:
+                        self.paused = False
+                        self.condition.notify_all()
+        except OSError:
+            pass
+        finally:
+            with self.condition:
+                self.closed = True
+                tags = [tag for _, tag in batch + list(self.frames) if tag is not None]
+                self.frames.clear()
+                self.buffered = 0
+                self.condition.notify_all()
+            self.socket.close()
+            if tags and self.on_dropped is not None:
+                self.on_dropped(tags)
+
+    def close(self, timeout=1.0):
+        """Stop accepting frames, give the writer `timeout` seconds to flush, then close the socket."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # the client isn't reading; unblock the writer's sendall
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def getpeername(self):
+        return self.socket.getpeername()
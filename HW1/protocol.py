@@ -1,24 +1,132 @@
 import json
 import struct 
+import threading
+import weakref
+from wire_trace import metrics, tracer
+
+
+class FrameReader:
+    """
+    Per-connection reader for 4-byte length-prefixed frames.
+    Bytes are pulled from the socket in large chunks into a reusable buffer, so
+    several frames can be served by one recv syscall. Each frame is returned as a
+    memoryview into that buffer and is only valid until the next read_frame call.
+
+    Readers made by for_socket hold their socket weakly, so the registry entry goes away
+    with the socket; a server releases it as soon as the connection ends.
+    """
+    _readers = weakref.WeakKeyDictionary()
+    _readers_lock = threading.Lock()
+
+    def __init__(self, socket, buffer_size=65536):
+        self.socket = socket
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # unread bytes live in buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    @classmethod
+    def for_socket(cls, socket):
+        """Return the reader bound to this socket, creating it on first use."""
+        reader = cls._readers.get(socket)
+        if reader is None:
+            with cls._readers_lock:
+                # a strong reference back to the socket would keep the weak key alive forever
+                reader = cls._readers.setdefault(socket, cls(weakref.proxy(socket)))
+        return reader
+
+    @classmethod
+    def release(cls, socket):
+        """Drop the reader bound to this socket, and its buffer, if there is one."""
+        with cls._readers_lock:
+            cls._readers.pop(socket, None)
+
+    def read_frame(self):
+        """
+        Return the payload of the next frame, or None if the peer closed the connection.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+
+        if not self._fill(4):
+            return None
+        length = struct.unpack_from(">I", self.buffer, self.start)[0]
+        if not self._fill(4 + length):
+            return None
+
+        begin = self.start + 4
+        self.start = begin + length
+        return self.view[begin:self.start]
+
+    def _fill(self, needed):
+        """Buffer at least `needed` unread bytes. Returns False on EOF."""
+        while self.end - self.start < needed:
+            if self.start + needed > len(self.buffer):
+                self._make_room(needed)
+            received = self.socket.recv_into(self.view[self.end:])
+            if not received:
+                return False
+            self.end += received
+        return True
+
+    def _make_room(self, needed):
+        """Move the unread bytes to the front of the buffer, growing it if a frame doesn't fit."""
+        pending = self.end - self.start
+        if needed > len(self.buffer):
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        else:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+
+def record_frame(direction, protocol, socket, nbytes, message):
+    """
+    Count a frame and trace it if tracing is on for this socket. The protocols' own send
+    and receive only call it while tracing is on, and otherwise just count the frame.
+    """
+    if direction == "send":
+        metrics.record_send(nbytes)
+    else:
+        metrics.record_receive(nbytes)
+    if tracer.active and tracer.wants(socket):
+        tracer.record(direction, protocol, socket, nbytes, message)
+
 
 class JSONProtocol:
     @staticmethod
-    def send(socket, data):
+    def encode(data):
         message = json.dumps(data).encode('utf-8')
-        message_length = len(message).to_bytes(4, byteorder='big')
-        total_size = len(message) + 4
-        print(f"[JSONProtocol] Sending {total_size} bytes: {message}")
-        socket.sendall(message_length + message)
+        return len(message).to_bytes(4, byteorder='big') + message
+
+    @staticmethod
+    def decode(frame):
+        return json.loads(str(frame, 'utf-8'))
+
+    @staticmethod
+    def send(socket, data):
+        message = JSONProtocol.encode(data)
+        if tracer.active:
+            record_frame("send", "json", socket, len(message), data)
+        else:
+            metrics.record_send(len(message))
+        socket.sendall(message)
 
     @staticmethod
     def receive(socket):
-        data_length_bytes = socket.recv(4)
-        if not data_length_bytes:
+        frame = FrameReader.for_socket(socket).read_frame()
+        if frame is None:
             return None
-        data_length = int.from_bytes(data_length_bytes, byteorder='big')
-        data = socket.recv(data_length).decode('utf-8')
-        print(f"[JSONProtocol] Received {data_length + 4} bytes: {data}")
-        return json.loads(data)
+        data = JSONProtocol.decode(frame)
+        if tracer.active:
+            record_frame("receive", "json", socket, len(frame) + 4, data)
+        else:
+            metrics.record_receive(len(frame) + 4)
+        return data
 
 
 class CustomProtocol:
@@ -28,15 +136,15 @@ class CustomProtocol:
         The CustomProtocol provides a binary-encoded wire protocol for communication. 
         It encodes a string field with a length prefix.
         - If the length is < 255, encode as a single-byte length
-        - If the length is >= 255, prefix with `0x00` and use a 4-byte big-endian length.
+        - If the length is >= 255 (or 0), prefix with `0x00` and use a 4-byte big-endian length.
         """
         value_bytes = value.encode("utf-8")
         length = len(value_bytes)
 
-        # if length < 255, use single-byte length
-        if length < 255:
+        # if 0 < length < 255, use single-byte length
+        if 0 < length < 255:
             return struct.pack(">B", length) + value_bytes
-        # if length >= 255 we use 0-byte followed by 4-byte length
+        # otherwise we use 0-byte followed by 4-byte length
         else:
             return struct.pack(">BI", 0, length) + value_bytes
 
@@ -60,49 +168,49 @@ class CustomProtocol:
         return socket.recv(length).decode("utf-8")
 
     @staticmethod
-    def send(socket, action_type, **kwargs):
+    def encode(action_type, request_id=0, **kwargs):
         """
-        Send a binary-encoded message over the socket.
-        Each messages consists of:
+        Encode a message into a complete frame, using the schema registered for the action type.
+        Each frame consists of:
+        - 4 bytes: Message length
         - 1 byte: Action type (e.g. 1=login)
         - 1 byte: Field count
-        - Variable-length fields (each with a length prefix)
-        """
-        fields = []
-
-        # login 
-        if action_type == 1:
-            fields.append(CustomProtocol.encode_length_prefixed_field(kwargs["username"]))
-            fields.append(CustomProtocol.encode_length_prefixed_field(kwargs["password"]))
-        # list account
-        elif action_type == 2:
-            fields.append(struct.pack(">B", kwargs["page_num"]))
-        # send message
-        elif action_type == 3: 
-            fields.append(CustomProtocol.encode_length_prefixed_field(kwargs["recipient"]))
-            fields.append(CustomProtocol.encode_length_prefixed_field(kwargs["message"]))
-        # read message
-        elif action_type == 4:
-            fields.append(struct.pack(">B", kwargs["limit"]))
-        # delete message
-        elif action_type == 5:
-            fields.append(CustomProtocol.encode_length_prefixed_field(kwargs["recipient"]))
-            fields.append(struct.pack(">I", kwargs["message_id"]))
-        # delete account 
-        elif action_type == 6:
-            fields.append(CustomProtocol.encode_length_prefixed_field(kwargs["password"]))
-        elif action_type == 7:
-            for key, value in kwargs.items():
-                fields.append(CustomProtocol.encode_length_prefixed_field(str(value)))
-
-        field_count = len(fields)
-        print(f"[DEBUG] kwargs: {kwargs.items()}")
-        print(f"[DEBUG] Fields: {fields}")
-        message = struct.pack(">BB", action_type, field_count) + b"".join(fields)
-        message_length = struct.pack(">I", len(message))  # 4-byte message length prefix
-
-        print(f"[CustomProtocol] Sending {len(message) + 4} bytes")
-        socket.sendall(message_length + message)
+        - 4 bytes: Request id (0 for server-initiated messages)
+        - Fields in the order given by the action's schema
+        """
+        return _encode_frame(action_type, request_id, kwargs)
+
+    @staticmethod
+    def decode(data):
+        """
+        Decode a frame payload (without the 4-byte length prefix) into a dict.
+        """
+        action_type, field_count, request_id = _ACTION_HEADER.unpack_from(data, 0)
+        schema = ACTIONS.get(action_type)
+        if schema is None:
+            message = {"action": "unknown"}
+        else:
+            message = schema.decode(data, _ACTION_HEADER.size, field_count)
+        if request_id:
+            message["request_id"] = request_id
+        return message
+
+    @staticmethod
+    def send(socket, action_type, request_id=0, **kwargs):
+        """
+        Send a binary-encoded message over the socket.
+        `request_id` lets the peer match the response to this request.
+        """
+        schema = ACTIONS.get(action_type)
+        if schema is None:
+            message = _encode_frame(action_type, request_id, kwargs)
+        else:
+            message = schema.encode(kwargs, request_id)
+        if tracer.active:
+            record_frame("send", "custom", socket, len(message), {"action_type": action_type, "request_id": request_id, **kwargs})
+        else:
+            metrics.record_send(len(message))
+        socket.sendall(message)
 
     @staticmethod
     def receive(socket):
@@ -112,96 +220,202 @@ class CustomProtocol:
         - 4-byte for overall message length
         - 1-byte action type
         - 1-byte field count
+        - 4-byte request id
         - variable-length fields (including 1-byte individual field message length)
         """
-        data_length_bytes = socket.recv(4)
-        if not data_length_bytes:
-            return None
-
-        data_length = struct.unpack(">I", data_length_bytes)[0]
-        data = socket.recv(data_length)
-        print(f"[DEBUG] Raw Data Received: {data.hex()}")
-
+        data = FrameReader.for_socket(socket).read_frame()
         if not data:
             return None
-        # Read action type and field count
-        action_type, field_count = struct.unpack(">BB", data[:2])
-        offset = 2
-
-        action_map = {
-            1: "login",
-            2: "list_accounts",
-            3: "send_message",
-            4: "read_messages",
-            5: "delete_message",
-            6: "delete_account",
-            7: "response"
-        }
-
-        action = action_map.get(action_type, "unknown")
-        data_dict = {"action": action}
-
-        for i in range(field_count):
-            if action == "login":
-                print(field_count)
-                key = "username" if i == 0 else "password"
-                field_value, field_size = CustomProtocol._extract_field(data, offset)
-                data_dict[key] = field_value
-                offset += field_size
-
-            elif action == "list_accounts":
-                data_dict['page_num'] = struct.unpack(">B", data[offset:offset + 1])[0]
-                offset += 1
-
-            elif action == "send_message":
-                key = "recipient" if i == 0 else "message"
-                field_value, field_size = CustomProtocol._extract_field(data, offset)
-                data_dict[key] = field_value
-                offset += field_size
-
-            elif action == "read_messages":
-                data_dict["limit"] = struct.unpack(">B", data[offset:offset + 1])[0]
-                offset += 1 
-
-            elif action == "delete_message":
-                if i == 0:
-                    field_value, field_size = CustomProtocol._extract_field(data, offset)
-                    data_dict["recipient"] = field_value
-                    offset += field_size
-                else:
-                    data_dict["message_id"] = struct.unpack(">I", data[offset:offset + 4])[0]
-                    offset += 4
-
-            elif action == "delete_account":
-                key = "password"
-                field_value, field_size = CustomProtocol._extract_field(data, offset)
-                data_dict[key] = field_value
-                offset += field_size
-
-            elif action == "response":
-                key = 'status' if i == 0 else 'message'
-                value, field_size = CustomProtocol._extract_field(data, offset)
-                offset += field_size
-                data_dict[key] = value
-            
-        print(f"[CustomProtocol] Received {data_length + 4} bytes: {data_dict}")
+
+        data_dict = CustomProtocol.decode(data)
+        if tracer.active:
+            record_frame("receive", "custom", socket, len(data) + 4, data_dict)
+        else:
+            metrics.record_receive(len(data) + 4)
         return data_dict
     
     @staticmethod
     def _extract_field(data, offset, encrypted=False):
         """
-        Extract a length-prefixed field from binary data.
+        Extract a length-prefixed field from binary data (bytes or memoryview).
         Returns the extracted value and the number of bytes read.
         """
         # Read 1-byte length
-        length = struct.unpack(">B", data[offset:offset + 1])[0]
+        length = struct.unpack_from(">B", data, offset)[0]
+        prefix_size = 1
         if length == 0:
             # Read 4-byte length if prefix is 0
-            length = struct.unpack(">I", data[offset + 1:offset + 5])[0] 
-            # Move past the 4-byte length field
-            offset += 4
+            length = struct.unpack_from(">I", data, offset + 1)[0]
+            prefix_size = 5
+
+        raw = memoryview(data)[offset + prefix_size:offset + prefix_size + length]
+        value = str(raw, "utf-8") if not encrypted else bytes(raw)
+        return value, prefix_size + length
+
+
+# Frame header: message length, action type, field count, request id
+_HEADER = struct.Struct(">IBBI")
+_ACTION_HEADER = struct.Struct(">BBI")
+_LONG_PREFIX = struct.Struct(">BI")
+
+# Field kinds: length-prefixed UTF-8 strings or fixed-width big-endian integers
+STRING = "string"
+UINT8 = struct.Struct(">B")
+UINT32 = struct.Struct(">I")
+UINT64 = struct.Struct(">Q")
+
+
+# single-byte length prefixes, indexed by length
+_SHORT_PREFIX = [bytes((length,)) for length in range(256)]
+
+
+def _fixed_groups(kinds):
+    """Split field kinds into runs: ("string", [index]) or (Struct for the run, [indexes])."""
+    groups = []
+    for i, kind in enumerate(kinds):
+        if kind == STRING:
+            groups.append((STRING, [i]))
+        elif groups and groups[-1][0] != STRING:
+            groups[-1][1].append(i)
+        else:
+            groups.append((None, [i]))
+    return [(STRING, indexes) if kind == STRING else
+            (struct.Struct(">" + "".join(kinds[i].format.lstrip(">") for i in indexes)), indexes)
+            for kind, indexes in groups]
+
+
+def _encoder_body(kinds, count, action_type, namespace, indent, convert):
+    """
+    Source lines that encode locals f0..f{count - 1} into a complete frame and return it.
+    Runs of fixed-width fields are packed with one Struct each, placed in `namespace`.
+    """
+    lines, pieces, sizes = [], [], [str(_ACTION_HEADER.size)]
+    for kind, indexes in _fixed_groups(kinds[:count]):
+        if kind == STRING:
+            i = indexes[0]
+            lines += [f"b{i} = {convert % f'f{i}'}.encode()",
+                      f"n{i} = len(b{i})",
+                      f"p{i} = _SHORT_PREFIX[n{i}] if 0 < n{i} < 255 else _LONG_PREFIX.pack(0, n{i})"]
+            pieces += [f"p{i}", f"b{i}"]
+            sizes += [f"len(p{i})", f"n{i}"]
+        else:
+            packer = f"_PACK{indexes[0]}_{indexes[-1]}"
+            namespace[packer] = kind.pack
+            pieces.append(f"{packer}({', '.join(f'f{i}' for i in indexes)})")
+            sizes.append(str(kind.size))
+    header = f"_HEADER.pack({' + '.join(sizes)}, {action_type}, {count}, request_id)"
+    lines.append(f"return b''.join(({', '.join([header] + pieces)},))")
+    return [indent + line for line in lines]
+
+
+def _decoder_body(names, kinds, namespace, indent):
+    """
+    Source lines that decode fields into `message`, returning once `field_count` are read.
+    A run of fixed-width fields that is present in full is unpacked with one Struct.
+    """
+    lines = []
+    for kind, indexes in _fixed_groups(kinds):
+        if kind == STRING:
+            i = indexes[0]
+            lines += [f"if field_count < {i + 1}: return message",
+                      "n = data[offset]",
+                      "if n:",
+                      "    offset += 1",
+                      "else:",
+                      "    n = _UINT32_UNPACK(data, offset + 1)[0]",
+                      "    offset += 5",
+                      f"message[{names[i]!r}] = str(data[offset:offset + n], 'utf-8')",
+                      "offset += n"]
+            continue
+        unpacker = f"_UNPACK{indexes[0]}_{indexes[-1]}"
+        namespace[unpacker] = kind.unpack_from
+        targets = ", ".join(f"message[{names[i]!r}]" for i in indexes)
+        lines += [f"if field_count >= {indexes[-1] + 1}:",
+                  f"    {targets}, = {unpacker}(data, offset)",
+                  f"    offset += {kind.size}",
+                  "else:"]
+        for i in indexes:
+            namespace[f"_UNPACK{i}"] = kinds[i].unpack_from
+            lines += [f"    if field_count < {i + 1}: return message",
+                      f"    message[{names[i]!r}] = _UNPACK{i}(data, offset)[0]",
+                      f"    offset += {kinds[i].size}"]
+        lines.append("    return message")
+    lines.append("return message")
+    return [indent + line for line in lines]
+
+
+class ActionSchema:
+    """
+    Wire layout of one action type: the ordered fields of its message.
+    When the schema is registered, an encoder and a decoder are generated for it as Python
+    source, with every field's handling inlined and each run of fixed-width fields packed
+    by one precompiled Struct, so no per-message work depends on the schema.
+    Positional schemas (responses) encode the keyword arguments in the order they were given.
+    Trailing fields may be left out, and decode to a message without them, so a field added
+    to the end of a schema can still be omitted by senders that don't set it.
+    """
+    def __init__(self, action_type, name, fields, positional=False):
+        self.action_type = action_type
+        self.name = name
+        self.positional = positional
+        self.names = tuple(field_name for field_name, _ in fields)
+        self.kinds = tuple(kind for _, kind in fields)
+        namespace = {"_HEADER": _HEADER, "_LONG_PREFIX": _LONG_PREFIX, "_SHORT_PREFIX": _SHORT_PREFIX,
+                     "_UINT32_UNPACK": UINT32.unpack_from, "_NAME": name}
+
+        # encode(kwargs, request_id): a frame with every leading field that is present
+        lines = ["def encode(kwargs, request_id=0):"]
+        if positional:
+            lines += [f"    values = kwargs.values() if len(kwargs) <= {len(self.names)} else tuple(kwargs.values())[:{len(self.names)}]",
+                      "    given = len(values)"]
+        for count in range(len(self.names), -1, -1):
+            indent = "        " if count else "    "
+            if positional and count:
+                lines += [f"    if given == {count}:",
+                          f"        {', '.join(f'f{i}' for i in range(count))}, = values"]
+            elif count == len(self.names):
+                # the common case, every field given, needs one lookup per field
+                lines.append("    try:")
+                lines += [f"        f{i} = kwargs[{name!r}]" for i, name in enumerate(self.names)]
+                lines += ["    except KeyError:", "        pass", "    else:"]
+            elif count:
+                lines.append(f"    if {' and '.join(f'{name!r} in kwargs' for name in self.names[:count])}:")
+                lines += [f"        f{i} = kwargs[{name!r}]" for i, name in enumerate(self.names[:count])]
+            lines += _encoder_body(self.kinds, count, action_type, namespace, indent, "str(%s)" if positional else "%s")
+
+        # decode(data, offset, field_count): the message dict
+        lines += ["def decode(data, offset, field_count):",
+                  "    message = {'action': _NAME}"]
+        lines += _decoder_body(self.names, self.kinds, namespace, "    ")
+
+        exec(compile("\n".join(lines), f"<schema {name}>", "exec"), namespace)
+        self.encode = namespace["encode"]
+        self.decode = namespace["decode"]
+
+
+# Registry of all action types understood by CustomProtocol
+ACTIONS = {}
+
+
+def register_action(action_type, name, *fields, positional=False):
+    """Add an action type to the wire protocol. This is the only place new actions need to be declared."""
+    ACTIONS[action_type] = ActionSchema(action_type, name, fields, positional)
+
 
-        value = data[offset + 1:offset + 1 + length].decode("utf-8") if not encrypted else data[offset + 1:offset + 1 + length]
-        return value, (1 + length if length < 255 else 5 + length)
+def _encode_frame(action_type, request_id, kwargs):
+    schema = ACTIONS.get(action_type)
+    if schema is None:
+        return _HEADER.pack(_ACTION_HEADER.size, action_type, 0, request_id)
+    return schema.encode(kwargs, request_id)
 
 
+register_action(1, "login", ("username", STRING), ("password", STRING))
+register_action(2, "list_accounts", ("page_num", UINT32), ("page_size", UINT8), ("cursor", STRING))
+register_action(3, "send_message", ("recipient", STRING), ("message", STRING))
+register_action(4, "read_messages", ("limit", UINT8))
+register_action(5, "delete_message", ("recipient", STRING), ("message_id", UINT64))
+register_action(6, "delete_account", ("password", STRING))
+register_action(7, "response", ("status", STRING), ("message", STRING), ("next_cursor", STRING), positional=True)
+register_action(8, "search_accounts", ("query", STRING), ("limit", UINT8), ("substring", UINT8))
+register_action(9, "read_history", ("limit", UINT32), ("cursor", STRING), ("after_id", UINT64), ("before_id", UINT64),
+                ("since_ms", UINT64), ("until_ms", UINT64))
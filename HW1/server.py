@@ -1,16 +1,33 @@
+import collections
 import socket
 import threading
+import asyncio
 import json
 import struct
+import logging
 from storage import Storage
-from protocol import CustomProtocol, JSONProtocol
+from protocol import CustomProtocol, FrameReader, JSONProtocol, record_frame
+from sessions import SessionRegistry
+from outbox import OutboundQueue
+from wire_trace import tracer, logger as wire_logger
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument("--host", default='0.0.0.0', help="Host address")
-    parser.add_argument("--port", default=65432, help="Port number")
+    parser.add_argument("--port", type=int, default=65432, help="Port number")
     parser.add_argument("--json", action="store_true", help="Use JSON protocol")
+    parser.add_argument("--db", default="data.db", help="SQLite database file")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Serve all connections from one asyncio event loop")
+    parser.add_argument("--workers", type=int, default=8, help="Request handler threads in --async mode")
+    parser.add_argument("--pool-size", type=int, default=8, help="SQLite connections shared by all clients")
+    parser.add_argument("--backlog", type=int, default=socket.SOMAXCONN, help="Listen backlog")
+    parser.add_argument("--high-watermark", type=int, default=256 * 1024, help="Bytes queued for a client before it counts as slow")
+    parser.add_argument("--low-watermark", type=int, default=64 * 1024, help="Bytes queued for a slow client before it is sent messages again")
+    parser.add_argument("--trace", action="store_true", help="Log every frame sent and received")
+    parser.add_argument("--trace-user", action="append", default=[], help="Log frames of this user's connections only")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="Fraction of traced frames to log")
     return parser.parse_args()
 
 class ChatServer:
@@ -18,19 +35,44 @@ class ChatServer:
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.host = args.host
         self.port = args.port
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server.bind((self.host, self.port))
-        self.server.listen(5)
+        self.server.listen(getattr(args, "backlog", socket.SOMAXCONN))
+        self.db_name = getattr(args, "db", "data.db")
+        # one Storage, with a pool of SQLite connections, serves every client; opened on first use
+        self.pool_size = getattr(args, "pool_size", 8)
+        self.storage = None
+        self.storage_lock = threading.Lock()
+
+        # asyncio mode: request handlers run on a small executor
+        self.workers = getattr(args, "workers", 8)
+        self.read_limit = 64 * 1024
+
+        # outbound queue limits per connection; messages for clients over the high
+        # watermark are left in storage instead of being pushed
+        self.high_watermark = getattr(args, "high_watermark", 256 * 1024)
+        self.low_watermark = getattr(args, "low_watermark", 64 * 1024)
         
         self.use_json = args.json
-        # map the ip address and port of the client to the username
-        self.login_users = {}
-        # map the ip address and port of the client to the client socket
-        self.clients_sockets = {}
+        # wire tracing stays off unless requested for all connections or for some users
+        self.trace_users = set(getattr(args, "trace_user", []))
+        if getattr(args, "trace", False) or self.trace_users:
+            logging.basicConfig(format="%(message)s")
+            wire_logger.setLevel(logging.DEBUG)
+            tracer.logger = wire_logger
+            tracer.sample_rate = args.trace_sample
+        if getattr(args, "trace", False):
+            tracer.enable(sample_rate=args.trace_sample)
+        # connections ("ip:port") with their sockets and logged-in users
+        self.sessions = SessionRegistry()
 
 
     def handle_client(self, client_socket):
-        storage = Storage("data.db")  # SQLite database for user accounts and messages
+        storage = self.get_storage()  # SQLite database for user accounts and messages
         addr = f'{client_socket.getpeername()[0]}:{client_socket.getpeername()[1]}'  # IP address and port of the client
+        # all writes to the client, responses and pushed messages, go through its outbound queue
+        outbox = OutboundQueue(client_socket, self.high_watermark, self.low_watermark, on_dropped=self.mark_unread).start()
+        self.sessions.connect(addr, outbox)
         try:
             while True:
                 if self.use_json:
@@ -41,56 +83,11 @@ class ChatServer:
                 if not data:
                     break
 
+                # echoed back so the client can match the response to its request
+                request_id = data.pop("request_id", 0)
                 action = data.get("action")
-                if action == "login":
-                    response = storage.login_register_user(data["username"], data["password"])
-                    # record the login status
-                    if response["status"] == "success":
-                        # get ip address and port of the client
-                        ip = client_socket.getpeername()[0]
-                        port = client_socket.getpeername()[1]
-                        print(f"User {data['username']} logged in from {addr}")
-                        self.login_users[addr] = data["username"]
-
-                elif action == "list_accounts":
-                    response = storage.list_accounts(data['page_num'])
-                elif action == "send_message":
-                    sender = self.login_users.get(addr)
-                    # check if the recipient logged in
-                    # if logged in, directly send the message
-                    if data["recipient"] in self.login_users.values():
-                        response = {"status": "New message", 'message': f"{sender}: {data['message']}"}
-                        # find the target client socket
-                        addr = list(self.login_users.keys())[list(self.login_users.values()).index(data["recipient"])]
-                        recipient_socket = self.clients_sockets[addr]
-                        if self.use_json:
-                            JSONProtocol.send(recipient_socket, response)
-                        else:
-                            CustomProtocol.send(recipient_socket, 7, **response)
-                        # if not logged in, store the message
-                    response = storage.send_message(sender, data["recipient"], data["message"])
-                elif action == "read_messages":
-                    user = self.login_users.get(addr)
-                    response = storage.read_messages(user, data.get("limit", 10))
-                elif action == "delete_message":
-                    user = self.login_users.get(addr)
-                    response = storage.delete_message(user, data['recipient'], data["message_id"])
-                elif action == "delete_account":
-                    user = self.login_users.get(addr)
-                    response = storage.delete_account(user, data["password"])
-                    # remove the user from the login_users
-                    if response["status"] == "success":
-                        self.login_users.pop(addr)
-                
-                else:
-                    response = {"status": "error", "message": "Unknown action"}
-                
-                if self.use_json:
-                    JSONProtocol.send(client_socket, response)
-                else:
-                    if not response or "status" not in response:
-                        response = {"status": "error", "message": "Invalid response from server"}
-                    CustomProtocol.send(client_socket, 7, **response)
+                response = self.handle_request(data, addr, storage)
+                self.send_response(outbox, response, request_id)
 
                 if action == "delete_account" and response["status"] == "success":
                     break
@@ -98,19 +95,247 @@ class ChatServer:
         except Exception as e:
             print(f"Error: {e}")
         finally:
-            client_socket.close()
+            self.sessions.disconnect(addr)
+            FrameReader.release(client_socket)
+            outbox.close()
+
+    def get_storage(self):
+        if self.storage is None:
+            with self.storage_lock:
+                if self.storage is None:
+                    self.storage = Storage(self.db_name, pool_size=self.pool_size)
+        return self.storage
+
+    def handle_request(self, data, addr, storage):
+        """
+        Run one decoded request from the client at `addr` and return the response.
+        Shared by the threaded and the asyncio server modes.
+        """
+        action = data.get("action")
+        if action == "login":
+            response = storage.login_register_user(data["username"], data["password"])
+            # record the login status
+            if response["status"] == "success":
+                print(f"User {data['username']} logged in from {addr}")
+                self.sessions.login(addr, data["username"])
+                client_socket = self.sessions.socket(addr)
+                if data["username"] in self.trace_users and client_socket is not None:
+                    tracer.enable(client_socket, sample_rate=tracer.sample_rate)
+                    # in threaded mode frames are sent through the outbound queue but received from its socket
+                    if isinstance(client_socket, OutboundQueue):
+                        tracer.enable(client_socket.socket, sample_rate=tracer.sample_rate)
+
+        elif action == "list_accounts":
+            # page_size and cursor are missing from older clients' requests
+            response = storage.list_accounts(data.get('page_num', 1), data.get('page_size'), data.get('cursor'))
+        elif action == "search_accounts":
+            response = storage.search_accounts(data["query"], data.get("limit"), bool(data.get("substring")))
+        elif action == "send_message":
+            sender = self.sessions.username(addr)
+            # the message is stored either way, as read if the recipient is logged in and it is pushed to them
+            online = self.sessions.is_online(data["recipient"])
+            message_id = storage.ids.next_id()
+            response = storage.send_message(sender, data["recipient"], data["message"], status="read" if online else "unread", message_id=message_id)
+            if online and response["status"] == "success":
+                # if no connection took it, it goes back to unread for read_messages
+                if not self.push(data["recipient"], {"status": "New message", 'message': f"{sender}: {data['message']}"}, message_id):
+                    storage.mark_unread([message_id])
+        elif action == "read_messages":
+            user = self.sessions.username(addr)
+            response = storage.read_messages(user, data.get("limit", 10))
+        elif action == "read_history":
+            user = self.sessions.username(addr)
+            response = storage.read_history(user, data.get("limit"), data.get("cursor"), data.get("after_id", 0),
+                                            data.get("before_id", 0), data.get("since_ms", 0), data.get("until_ms", 0))
+        elif action == "delete_message":
+            user = self.sessions.username(addr)
+            response = storage.delete_message(user, data['recipient'], data["message_id"])
+        elif action == "delete_account":
+            user = self.sessions.username(addr)
+            response = storage.delete_account(user, data["password"])
+            # the account is gone, so log it out everywhere
+            if response["status"] == "success":
+                self.sessions.logout_user(user)
+        else:
+            response = {"status": "error", "message": "Unknown action"}
+
+        if not response or "status" not in response:
+            response = {"status": "error", "message": "Invalid response from server"}
+        return response
+
+    def push(self, username, message, message_id=None):
+        """
+        Offer a server-initiated message to each connection `username` is logged in on.
+        Never blocks on a slow client. Returns whether any connection accepted it.
+        A connection that dies before writing it hands `message_id` to mark_unread.
+        """
+        recipient_sockets = self.sessions.sockets_for(username)
+        if not recipient_sockets:
+            return False
+        frame = JSONProtocol.encode(message) if self.use_json else CustomProtocol.encode(7, **message)
+        protocol = "json" if self.use_json else "custom"
+        delivered = False
+        for recipient_socket in recipient_sockets:
+            if recipient_socket.offer(frame, message_id):
+                record_frame("send", protocol, recipient_socket, len(frame), message)
+                delivered = True
+        return delivered
+
+    def mark_unread(self, message_ids):
+        self.get_storage().mark_unread(message_ids)
+
+    def mark_unread_later(self, message_ids):
+        """mark_unread from the event loop, run on the executor so SQLite doesn't block the loop."""
+        self.loop.run_in_executor(self.executor, self.mark_unread, message_ids)
+
+    def send_response(self, client_socket, response, request_id=0):
+        if self.use_json:
+            if request_id:
+                response["request_id"] = request_id
+            JSONProtocol.send(client_socket, response)
+        else:
+            CustomProtocol.send(client_socket, 7, request_id=request_id, **response)
 
     def start(self):
         print(f"Server running on {self.host}:{self.port}")
         while True:
             client_socket, addr = self.server.accept()
             print(f"New connection from {addr}")
-            addr = f'{addr[0]}:{addr[1]}'
-            self.clients_sockets[addr] = client_socket
+            # handle_client registers the connection once its outbound queue exists
             client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
             client_thread.start()
 
+    def start_async(self):
+        """
+        Serve every connection from one asyncio event loop instead of one thread per client.
+        Requests are still handled by handle_request, on a small executor so that bcrypt and
+        SQLite calls don't block the loop.
+        """
+        print(f"Server running on {self.host}:{self.port} (asyncio)")
+        asyncio.run(self._serve_async())
+
+    async def _serve_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="handler")
+        self.server.setblocking(False)
+        server = await asyncio.start_server(self.handle_client_async, sock=self.server, limit=self.read_limit)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client_async(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        addr = f'{peer[0]}:{peer[1]}'
+        client_socket = StreamSocket(writer, self.loop, self.high_watermark, self.low_watermark, on_dropped=self.mark_unread_later)
+        self.sessions.connect(addr, client_socket)
+        protocol = "json" if self.use_json else "custom"
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(4)
+                    frame = await reader.readexactly(int.from_bytes(header, byteorder='big'))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                data = JSONProtocol.decode(frame) if self.use_json else CustomProtocol.decode(frame)
+                record_frame("receive", protocol, client_socket, len(frame) + 4, data)
+                request_id = data.pop("request_id", 0)
+                response = await self.loop.run_in_executor(self.executor, self.handle_request, data, addr, self.get_storage())
+                self.send_response(client_socket, response, request_id)
+                await writer.drain()
+
+                if data.get("action") == "delete_account" and response["status"] == "success":
+                    break
+        except Exception as e:
+            print(f"Error: {e}")
+        finally:
+            self.sessions.disconnect(addr)
+            client_socket.close()
+
+
+class StreamSocket:
+    """
+    Socket-like wrapper around an asyncio StreamWriter, so handlers running on executor
+    threads can push frames to a client through the same protocol send functions.
+    The transport buffers and coalesces the writes; its buffer limits are the watermarks.
+
+    Like OutboundQueue, it passes the tags of offered frames that the transport hadn't
+    sent when the connection closed to `on_dropped`, from the loop thread.
+    """
+    def __init__(self, writer, loop, high_watermark=256 * 1024, low_watermark=64 * 1024, on_dropped=None):
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.high_watermark = high_watermark
+        self.on_dropped = on_dropped
+        writer.transport.set_write_buffer_limits(high=high_watermark, low=low_watermark)
+        # bytes sent from other threads that the loop hasn't handed to the transport yet
+        self.pending = 0
+        self.lock = threading.RLock()
+        # bytes handed to the transport so far, and (end offset, tag) of tagged frames
+        # that may still be in its buffer; both only touched on the loop thread
+        self.written = 0
+        self.unsent = collections.deque()
+
+    def offer(self, data, tag=None):
+        """Queue `data` unless the client's write buffer is over the high watermark."""
+        with self.lock:
+            if self.writer.is_closing() or self.writer.transport.get_write_buffer_size() + self.pending >= self.high_watermark:
+                return False
+            self._send(data, tag)
+            return True
+
+    def sendall(self, data):
+        self._send(data)
+
+    def _send(self, data, tag=None):
+        if threading.get_ident() == self.loop_thread:
+            self._write(data, tag)
+        else:
+            with self.lock:
+                self.pending += len(data)
+            self.loop.call_soon_threadsafe(self._write_pending, bytes(data), tag)
+
+    def _write_pending(self, data, tag):
+        try:
+            self._write(data, tag)
+        finally:
+            with self.lock:
+                self.pending -= len(data)
+
+    def _write(self, data, tag=None):
+        if self.writer.is_closing():
+            if tag is not None:
+                self._dropped([tag])
+            return
+        self.writer.write(data)
+        self.written += len(data)
+        if tag is not None:
+            self.unsent.append((self.written, tag))
+        sent = self.written - self.writer.transport.get_write_buffer_size()
+        while self.unsent and self.unsent[0][0] <= sent:
+            self.unsent.popleft()
+
+    def close(self):
+        """Close the connection, reporting the tagged frames still in the transport's buffer."""
+        sent = self.written - self.writer.transport.get_write_buffer_size()
+        tags = [tag for end, tag in self.unsent if end > sent]
+        self.unsent.clear()
+        self.writer.close()
+        if tags:
+            self._dropped(tags)
+
+    def _dropped(self, tags):
+        if self.on_dropped is not None:
+            self.on_dropped(tags)
+
+    def getpeername(self):
+        return self.writer.get_extra_info("peername")
+
+
 if __name__ == "__main__":
     args = parse_args()
     server = ChatServer(args)
-    server.start()
+    if args.use_async:
+        server.start_async()
+    else:
+        server.start()
@@ -0,0 +1,85 @@
+"""
+Registry of the server's connections and the users logged in on them.
+"""
+import threading
+
+
+class SessionRegistry:
+    """
+    Thread-safe two-way index between connection addresses, their sockets and the
+    username logged in on each. A user can be logged in from several connections at
+    once; every lookup is a dict access, so its cost doesn't grow with the number of
+    connected users.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # addr -> socket, for every open connection
+        self.connections = {}
+        # addr -> username, for connections with a logged-in user
+        self.users = {}
+        # username -> {addr: socket}, in login order
+        self.sessions = {}
+
+    def connect(self, addr, socket):
+        with self.lock:
+            self.connections[addr] = socket
+            username = self.users.get(addr)
+            if username is not None:
+                self.sessions[username][addr] = socket
+
+    def login(self, addr, username):
+        """Log `username` in on the connection at `addr`, replacing whoever was logged in there."""
+        with self.lock:
+            self._logout(addr)
+            self.users[addr] = username
+            self.sessions.setdefault(username, {})[addr] = self.connections.get(addr)
+
+    def logout(self, addr):
+        """Log out the user on `addr` but keep the connection. Returns the username, if any."""
+        with self.lock:
+            return self._logout(addr)
+
+    def logout_user(self, username):
+        """Log `username` out of every connection. Returns the addresses it was logged in on."""
+        with self.lock:
+            addrs = list(self.sessions.get(username, ()))
+            for addr in addrs:
+                self._logout(addr)
+            return addrs
+
+    def disconnect(self, addr):
+        """Forget the connection at `addr` and its session. Returns the username, if any."""
+        with self.lock:
+            self.connections.pop(addr, None)
+            return self._logout(addr)
+
+    def _logout(self, addr):
+        username = self.users.pop(addr, None)
+        if username is not None:
+            addrs = self.sessions[username]
+            del addrs[addr]
+            if not addrs:
+                del self.sessions[username]
+        return username
+
+    def username(self, addr):
+        return self.users.get(addr)
+
+    def socket(self, addr):
+        return self.connections.get(addr)
+
+    def is_online(self, username):
+        return username in self.sessions
+
+    def sockets_for(self, username):
+        """Sockets of every connection `username` is logged in on."""
+        with self.lock:
+            addrs = self.sessions.get(username)
+            return [socket for socket in addrs.values() if socket is not None] if addrs else []
+
+    def online_users(self):
+        with self.lock:
+            return list(self.sessions)
+
+    def __len__(self):
+        return len(self.connections)
@@ -1,77 +1,250 @@
+import base64
+import contextlib
+import itertools
+import queue
 import sqlite3
+import threading
 import bcrypt
-import time
+from idgen import IdGenerator, first_id
+from accounts import AccountIndex
+
+
+# Numbered schema migrations; PRAGMA user_version records how many have been applied.
+# Append new ones to the end, never edit or reorder the existing ones.
+MIGRATIONS = [
+    # 1: initial schema
+    (
+        "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password_hash TEXT)",
+        "CREATE TABLE IF NOT EXISTS messages (id INT PRIMARY KEY, sender TEXT, recipient TEXT, message TEXT, status TEXT)",
+    ),
+    # 2: indexes for reading unread messages, and for deleting by sender or recipient
+    (
+        "CREATE INDEX IF NOT EXISTS messages_recipient_status ON messages (recipient, status, id)",
+        "CREATE INDEX IF NOT EXISTS messages_sender_recipient ON messages (sender, recipient, id)",
+    ),
+    # 3: index for walking a user's message history in id order, whatever the status
+    (
+        "CREATE INDEX IF NOT EXISTS messages_recipient_id ON messages (recipient, id)",
+    ),
+]
+
+
+# page size used when a request doesn't give one, and the largest page a request may ask for
+DEFAULT_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 100
+DEFAULT_SEARCH_LIMIT = 20
+
+
+def encode_cursor(username):
+    """Opaque continuation token for the accounts after `username`."""
+    return base64.urlsafe_b64encode(username.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """The username a cursor continues after. Raises ValueError for a malformed cursor."""
+    return base64.urlsafe_b64decode(cursor.encode()).decode()
+
+
+# messages per history batch when a request doesn't say, and the most one batch may hold
+DEFAULT_HISTORY_BATCH = 500
+MAX_HISTORY_BATCH = 5000
+# larger than any message id
+MAX_MESSAGE_ID = (1 << 63) - 1
+
+
+def history_bounds(after_id=0, before_id=0, since_ms=0, until_ms=0, cursor=None):
+    """
+    Exclusive (after, before) message id bounds for a history request. Ids start with their
+    timestamp, so a time range is just another id range. A cursor from an earlier page or
+    chunk resumes after the last message it covered. 0 means unbounded throughout.
+    Raises ValueError for a malformed cursor.
+    """
+    after = max(after_id, first_id(since_ms) - 1 if since_ms else 0)
+    before = min(before_id or MAX_MESSAGE_ID, first_id(until_ms) if until_ms else MAX_MESSAGE_ID)
+    if cursor:
+        after = max(after, int(decode_cursor(cursor)))
+    return after, before
+
+
+def migrate(conn):
+    """Apply the pending migrations, each in its own transaction. Returns the schema version."""
+    while True:
+        with conn:
+            # the write lock makes concurrent servers on one database take turns
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return version
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections shared by all server threads.
+    Connections are opened on demand, up to `size`, and kept for the life of the pool,
+    so their pragmas and statement caches are set up once.
+    """
+    def __init__(self, db_name, size=8, cache_size_kb=8192, cached_statements=128):
+        self.db_name = db_name
+        # every connection to ":memory:" would open a separate, empty database
+        self.size = 1 if db_name == ":memory:" else size
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=self.cached_statements)
+        # WAL lets readers run alongside the writer; NORMAL only syncs at checkpoints, which is safe in WAL mode
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self.connections.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one to be returned if all are in use."""
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                conn = self._open() if self.opened < self.size else None
+                if conn is not None:
+                    self.opened += 1
+            if conn is None:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+
 
 class Storage:
-    def __init__(self, db_name):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password_hash TEXT)")
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS messages (id INT PRIMARY KEY, sender TEXT, recipient TEXT, message TEXT, status TEXT)")
-        self.conn.commit()
+    # the newest `limit` unread messages sent to a user by someone else
+    UNREAD_MESSAGES = """
+        FROM messages
+        WHERE recipient=?
+        AND status='unread'
+        AND sender != ?
+        ORDER BY id DESC LIMIT ?
+    """
+
+    def __init__(self, db_name, pool_size=8, ids=None):
+        self.pool = ConnectionPool(db_name, pool_size)
+        # message ids come from memory, not from the database
+        self.ids = ids if ids is not None else IdGenerator()
+        with self.pool.connection() as conn:
+            migrate(conn)
+            # kept in step with the users table by register and delete_account
+            self.accounts = AccountIndex(row[0] for row in conn.execute("SELECT username FROM users"))
+
+    def close(self):
+        self.pool.close()
 
     def login_register_user(self, username, password):
-        
+
         # change it to bytes type
         # find if the username exists
-        self.cursor.execute("SELECT password_hash FROM users WHERE username=?", (username,))
-        user = self.cursor.fetchone()
+        # the connection goes back to the pool before bcrypt runs
+        with self.pool.connection() as conn:
+            user = conn.execute("SELECT password_hash FROM users WHERE username=?", (username,)).fetchone()
         if user:
             # do the login process
             if bcrypt.checkpw(password.encode(), user[0]):
                 return {"status": "success"}
-            
+
             return {"status": "error", "message": "Invalid credentials"}
         else:
             # do the register process
             password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-            self.cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
-            self.conn.commit()
+            with self.pool.connection() as conn, conn:
+                inserted = conn.execute("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash)).rowcount
+            if not inserted:
+                # registered by another connection in the meantime, so this is a login
+                return self.login_register_user(username, password)
+            self.accounts.add(username)
             return {"status": "success"}
-    
-    def list_accounts(self, page_num):
-        num_per_page = 5
-        
-        offset = (page_num - 1) * num_per_page
 
-        self.cursor.execute("SELECT username FROM users ORDER BY username LIMIT ? OFFSET ?", (num_per_page, offset))
+    def list_accounts(self, page_num=1, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        One page of usernames in order. With a `cursor` from the previous page, the page is
+        found by seeking the username index, so every page costs the same however deep it is.
+        Without one, `page_num` is used, which has to skip over all of the earlier pages.
+        """
+        page_size = min(max(page_size or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except ValueError:
+                return {"status": "error", "message": "Invalid cursor"}
+            query, params = "SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?", (after, page_size)
+        else:
+            offset = (max(page_num, 1) - 1) * page_size
+            query, params = "SELECT username FROM users ORDER BY username LIMIT ? OFFSET ?", (page_size, offset)
+
+        with self.pool.connection() as conn:
+            usernames = [row[0] for row in conn.execute(query, params)]
         response = {
             'status': 'success',
-            'message': [row[0] for row in self.cursor.fetchall()]
+            'message': usernames,
+            # empty once the last page has been returned
+            'next_cursor': encode_cursor(usernames[-1]) if len(usernames) == page_size else ""
         }
         return response
-    
-    def send_message(self, sender, recipient, message):
-
-        # check if recipient exist
-        self.cursor.execute("SELECT username FROM users WHERE username=?", (recipient,))
-        if not self.cursor.fetchone():
-            return {"status": "error", "message": "Recipient does not exist"}
-        
-        id = int(time.time())
-        
-        self.cursor.execute("INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, 'unread')", (id, sender, recipient, message))
-        self.conn.commit()
+
+    def search_accounts(self, query, limit=DEFAULT_SEARCH_LIMIT, substring=False):
+        """
+        Usernames starting with `query`, or containing it with `substring`, in order.
+        Answered from the in-memory index without touching the database.
+        """
+        limit = min(max(limit or DEFAULT_SEARCH_LIMIT, 1), MAX_PAGE_SIZE)
+        matches = self.accounts.substring(query, limit) if substring else self.accounts.prefix(query, limit)
+        return {
+            'status': 'success',
+            'message': matches
+        }
+
+    def send_message(self, sender, recipient, message, status="unread", message_id=None):
+
+        with self.pool.connection() as conn, conn:
+            # check if recipient exist
+            if not conn.execute("SELECT username FROM users WHERE username=?", (recipient,)).fetchone():
+                return {"status": "error", "message": "Recipient does not exist"}
+
+            id = message_id if message_id is not None else self.ids.next_id()
+
+            conn.execute("INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)", (id, sender, recipient, message, status))
         return {"status": "success"}
 
+    def mark_unread(self, message_ids):
+        """Returns pushed messages that never reached the recipient to their unread queue."""
+        with self.pool.connection() as conn, conn:
+            conn.executemany("UPDATE messages SET status='unread' WHERE id=?", [(message_id,) for message_id in message_ids])
+
     def read_messages(self, username, limit=10):
-        # read undelivered messages from other senders only
-        self.cursor.execute("""
-            SELECT id, sender, recipient, message 
-            FROM messages 
-            WHERE recipient=? 
-            AND status='unread' 
-            AND sender != ? 
-            ORDER BY id DESC LIMIT ?
-        """, (username, username, limit))
-        
-        messages = [{"id": row[0], "sender": row[1], "message": row[3]} for row in self.cursor.fetchall()]
-        
-        # mark messages as read
-        for message in messages:
-            self.cursor.execute("UPDATE messages SET status='read' WHERE id=?", (message["id"],))
-
-        self.conn.commit()
+        with self.pool.connection() as conn, conn:
+            # take the write lock first, so two concurrent readers can't both get the same messages
+            conn.execute("BEGIN IMMEDIATE")
+            # read undelivered messages from other senders only
+            rows = conn.execute("SELECT id, sender, recipient, message " + self.UNREAD_MESSAGES, (username, username, limit)).fetchall()
+
+            messages = [{"id": row[0], "sender": row[1], "message": row[3]} for row in rows]
+
+            # mark them all as read in one statement, in the same transaction
+            if messages:
+                conn.execute("UPDATE messages SET status='read' WHERE id IN (SELECT id " + self.UNREAD_MESSAGES + ")", (username, username, limit))
 
         # if no undelivered messages, return a response
         if messages:
@@ -86,25 +259,59 @@ class Storage:
             }
 
         return response
-        
+
+    def iter_history(self, username, after_id=0, before_id=MAX_MESSAGE_ID, batch_size=DEFAULT_HISTORY_BATCH):
+        """
+        Yields the messages sent to `username` with after_id < id < before_id, oldest first,
+        whatever their status. Rows are fetched `batch_size` at a time, each batch with its own
+        query that seeks past the last id, so memory stays bounded and no pooled connection is
+        held between batches.
+        """
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute("SELECT id, sender, message, status FROM messages WHERE recipient=? AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                                    (username, after_id, before_id, batch_size)).fetchall()
+            for row in rows:
+                yield {"id": row[0], "sender": row[1], "message": row[2], "status": row[3]}
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    def read_history(self, username, limit=DEFAULT_HISTORY_BATCH, cursor=None, after_id=0, before_id=0, since_ms=0, until_ms=0):
+        """
+        One page of `username`'s message history, oldest first, with a `next_cursor` to pass
+        back for the page after it. Unlike read_messages, this leaves message status alone.
+        """
+        try:
+            after, before = history_bounds(after_id, before_id, since_ms, until_ms, cursor)
+        except ValueError:
+            return {"status": "error", "message": "Invalid cursor"}
+        limit = min(max(limit or DEFAULT_HISTORY_BATCH, 1), MAX_HISTORY_BATCH)
+        messages = list(itertools.islice(self.iter_history(username, after, before, limit), limit))
+        return {
+            'status': 'success',
+            'message': messages,
+            # empty once the end of the range has been reached
+            'next_cursor': encode_cursor(str(messages[-1]["id"])) if len(messages) == limit else ""
+        }
+
     def delete_message(self, username, recipient, message_id: str):
-        self.cursor.execute("DELETE FROM messages WHERE id=? AND sender=? AND recipient=?", (int(message_id), username, recipient))
-        self.conn.commit()
+        with self.pool.connection() as conn, conn:
+            conn.execute("DELETE FROM messages WHERE id=? AND sender=? AND recipient=?", (int(message_id), username, recipient))
         return {"status": "success"}
-    
+
     def delete_account(self, username, password):
-        
+
         # check if the password is correct
-        self.cursor.execute("SELECT password_hash FROM users WHERE username=?", (username,))
-        user = self.cursor.fetchone()
+        with self.pool.connection() as conn:
+            user = conn.execute("SELECT password_hash FROM users WHERE username=?", (username,)).fetchone()
         if not bcrypt.checkpw(password.encode(), user[0]):
             return {"status": "error", "message": "Invalid credentials"}
 
-        # delete the account
-        self.cursor.execute("DELETE FROM users WHERE username=?", (username,))
-        self.conn.commit()
-        # delete all messages that sending to the account
-        self.cursor.execute("DELETE FROM messages WHERE recipient=?", (username,))
-        self.conn.commit()
+        with self.pool.connection() as conn, conn:
+            # delete the account
+            conn.execute("DELETE FROM users WHERE username=?", (username,))
+            # delete all messages that sending to the account
+            conn.execute("DELETE FROM messages WHERE recipient=?", (username,))
+        self.accounts.remove(username)
         return {"status": "success"}
-        
\ No newline at end of file
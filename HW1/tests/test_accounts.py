@@ -0,0 +1,51 @@
+import random
+import unittest
+from accounts import AccountIndex
+
+
+class TestAccountIndex(unittest.TestCase):
+    def setUp(self):
+        self.names = ["alice", "alicia", "bob", "carol", "malice", "zed"]
+        self.index = AccountIndex(reversed(self.names))
+
+    def test_prefix(self):
+        self.assertEqual(self.index.prefix("ali", 10), ["alice", "alicia"])
+        self.assertEqual(self.index.prefix("ali", 1), ["alice"])
+        self.assertEqual(self.index.prefix("", 3), ["alice", "alicia", "bob"])
+        self.assertEqual(self.index.prefix("nobody", 10), [])
+
+    def test_substring(self):
+        self.assertEqual(self.index.substring("lic", 10), ["alice", "alicia", "malice"])
+        self.assertEqual(self.index.substring("lice", 10), ["alice", "malice"])
+        # shorter than a trigram
+        self.assertEqual(self.index.substring("o", 10), ["bob", "carol"])
+        self.assertEqual(self.index.substring("xyz", 10), [])
+
+    def test_add_and_remove(self):
+        self.index.add("alfred")
+        self.index.add("alfred")
+        self.assertEqual(self.index.prefix("al", 10), ["alfred", "alice", "alicia"])
+        self.assertEqual(len(self.index), len(self.names) + 1)
+
+        self.index.remove("alice")
+        self.index.remove("nobody")
+        self.assertNotIn("alice", self.index)
+        self.assertEqual(self.index.substring("lice", 10), ["malice"])
+        self.assertNotIn("lic", {gram for gram, names in self.index.grams.items() if "alice" in names})
+
+    def test_matches_a_linear_scan(self):
+        rng = random.Random(262)
+        names = {"".join(rng.choice("abcde") for _ in range(rng.randint(1, 8))) for _ in range(2000)}
+        index = AccountIndex(names)
+        for query in ("a", "ab", "abc", "cab", "eeee", "dcba"):
+            self.assertEqual(index.prefix(query, 5000), sorted(n for n in names if n.startswith(query)))
+            self.assertEqual(index.substring(query, 5000), sorted(n for n in names if query in n))
+
+    def test_without_trigrams(self):
+        index = AccountIndex(self.names, substring=False)
+        self.assertIsNone(index.grams)
+        self.assertEqual(index.substring("lice", 10), ["alice", "malice"])
+
+
+if __name__ == "__main__":
+    unittest.main()
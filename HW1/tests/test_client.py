@@ -5,6 +5,7 @@ from client import ChatClient, simple_input
 from protocol import JSONProtocol, CustomProtocol
 from argparse import Namespace
 import tkinter as tk
+import queue
 
 
 class TestChatClient(unittest.TestCase):
@@ -43,11 +44,13 @@ class TestChatClient(unittest.TestCase):
             self.assertIsNone(self.client.username)
 
     def test_list_accounts_json(self):
+        self.client.create_main_screen()
         with patch.object(JSONProtocol, 'send') as mock_send, \
-             patch.object(JSONProtocol, 'receive', return_value={"status": "success", "message": ["user1", "user2"]}):
+             patch.object(self.client, 'check_incoming_message', return_value={"status": "success", "message": ["user1", "user2"]}):
             
             self.client.list_accounts()
             mock_send.assert_called()
+        self.assertIn("Accounts: user1, user2", self.client.chat_log.get("1.0", tk.END))
 
     def test_send_message_json(self):
         self.client.create_main_screen()
@@ -136,7 +139,7 @@ class TestChatClient(unittest.TestCase):
         
         with patch('tkinter.simpledialog.askstring', return_value="password123"), \
             patch.object(JSONProtocol, 'send') as mock_send, \
-            patch.object(JSONProtocol, 'receive', return_value=mock_response), \
+            patch.object(self.client, 'check_incoming_message', return_value=mock_response), \
             patch.object(self.client.client, 'close') as mock_close, \
             patch.object(tk.Tk, 'quit') as mock_quit:
             
@@ -161,6 +164,29 @@ class TestChatClient(unittest.TestCase):
             mock_update.assert_any_call("From user1: Hi")
             mock_update.assert_any_call("From user2: Hello")
 
+    def test_send_request_tags_request_id(self):
+        with patch.object(JSONProtocol, 'send') as mock_send:
+            first = self.client.send_request({'action_type': 4, 'limit': 5})
+            second = self.client.send_request({'action_type': 4, 'limit': 5}, wait=True)
+        self.assertEqual(second, first + 1)
+        self.assertEqual(mock_send.call_args[0][1]["request_id"], second)
+        self.assertIn(second, self.client.pending)
+        self.assertNotIn(first, self.client.pending)
+
+    def test_listen_for_messages_routes_response_by_request_id(self):
+        self.client.create_main_screen()
+        self.client.pending[7] = queue.Queue(maxsize=1)
+        response = {"action": "response", "status": "success", "message": "ok", "request_id": 7}
+
+        with patch.object(JSONProtocol, 'receive', side_effect=[response, Exception("Connection closed")]), \
+            patch.object(self.client, 'update_chat_log') as mock_update:
+            self.client.listen_for_messages()
+
+        self.assertEqual(self.client.check_incoming_message(7, timeout=0), response)
+        self.assertNotIn(7, self.client.pending)
+        for call in mock_update.call_args_list:
+            self.assertNotIn("[Server]: ok", call.args[0])
+
 
 if __name__ == "__main__":
     unittest.main()
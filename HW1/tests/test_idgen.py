@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+import idgen
+from idgen import IdGenerator
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdGenerator(unittest.TestCase):
+    def test_ids_increase(self):
+        ids = IdGenerator()
+        generated = [ids.next_id() for _ in range(10000)]
+        self.assertEqual(generated, sorted(set(generated)))
+
+    def test_fields(self):
+        message_id = IdGenerator(node_id=7, clock=FakeClock(1750000000.123)).next_id()
+        self.assertEqual(idgen.node_id(message_id), 7)
+        self.assertEqual(idgen.timestamp_ms(message_id), 1750000000123)
+        self.assertLess(message_id, 1 << 63)
+
+    def test_sequence_overflow_borrows_next_millisecond(self):
+        clock = FakeClock(1750000000.0)
+        ids = IdGenerator(clock=clock)
+        generated = [ids.next_id() for _ in range(idgen.MAX_SEQUENCE + 2)]
+        self.assertEqual(len(set(generated)), len(generated))
+        self.assertEqual(idgen.timestamp_ms(generated[-1]), 1750000000001)
+
+    def test_clock_going_backwards_stays_monotonic(self):
+        clock = FakeClock(1750000001.0)
+        ids = IdGenerator(clock=clock)
+        first = ids.next_id()
+        clock.now -= 5
+        self.assertGreater(ids.next_id(), first)
+
+    def test_nodes_do_not_collide(self):
+        clock = FakeClock(1750000000.0)
+        self.assertNotEqual(IdGenerator(1, clock).next_id(), IdGenerator(2, clock).next_id())
+
+    def test_first_id_bounds_ids_by_time(self):
+        clock = FakeClock(1750000000.5)
+        message_id = IdGenerator(node_id=idgen.MAX_NODE_ID, clock=clock).next_id()
+        self.assertLessEqual(idgen.first_id(1750000000500), message_id)
+        self.assertLess(message_id, idgen.first_id(1750000000501))
+        self.assertEqual(idgen.first_id(0), 0)
+
+    def test_invalid_node_id(self):
+        with self.assertRaises(ValueError):
+            IdGenerator(node_id=idgen.MAX_NODE_ID + 1)
+
+    def test_thread_safe(self):
+        ids = IdGenerator()
+        generated = []
+
+        def generate():
+            batch = [ids.next_id() for _ in range(5000)]
+            generated.extend(batch)
+
+        threads = [threading.Thread(target=generate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(generated)), 40000)
+
+    def test_throughput(self):
+        ids = IdGenerator()
+        start = time.perf_counter()
+        for _ in range(100000):
+            ids.next_id()
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+from outbox import OutboundQueue
+
+
+class BlockingSocket:
+    """Socket whose sendall waits until `release` is set."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.sending = threading.Event()
+        self.sent = []
+        self.closed = False
+
+    def sendall(self, data):
+        self.sending.set()
+        self.release.wait(5)
+        self.sent.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+
+class TestOutboundQueue(unittest.TestCase):
+    def test_frames_are_sent_in_order_and_flushed_on_close(self):
+        sock = BlockingSocket()
+        sock.release.set()
+        outbox = OutboundQueue(sock).start()
+        for i in range(100):
+            outbox.sendall(b"frame%d;" % i)
+        outbox.close()
+        self.assertEqual(b"".join(sock.sent), b"".join(b"frame%d;" % i for i in range(100)))
+        self.assertTrue(sock.closed)
+
+    def test_queued_frames_are_coalesced(self):
+        sock = BlockingSocket()
+        outbox = OutboundQueue(sock).start()
+        outbox.sendall(b"first")
+        sock.sending.wait(5)
+        # queued while the first write is in progress
+        for frame in (b"a", b"b", b"c"):
+            outbox.sendall(frame)
+        sock.release.set()
+        outbox.close()
+        self.assertEqual(sock.sent, [b"first", b"abc"])
+
+    def test_slow_consumer_refuses_offers_until_below_low_watermark(self):
+        sock = BlockingSocket()
+        outbox = OutboundQueue(sock, high_watermark=100, low_watermark=20).start()
+        self.assertTrue(outbox.offer(b"x" * 10))
+        sock.sending.wait(5)
+        self.assertTrue(outbox.offer(b"x" * 95))
+        self.assertTrue(outbox.paused)
+        self.assertFalse(outbox.offer(b"y"))
+        self.assertEqual(outbox.dropped, 1)
+
+        sock.release.set()
+        outbox.close()
+        self.assertEqual(b"".join(sock.sent), b"x" * 105)
+
+    def test_offer_after_close_is_refused(self):
+        sock = BlockingSocket()
+        sock.release.set()
+        outbox = OutboundQueue(sock).start()
+        outbox.close()
+        self.assertFalse(outbox.offer(b"late"))
+        with self.assertRaises(ConnectionError):
+            outbox.sendall(b"late")
+
+    def test_write_error_closes_queue(self):
+        sock = MagicMock()
+        sock.sendall.side_effect = BrokenPipeError
+        outbox = OutboundQueue(sock).start()
+        outbox.offer(b"frame")
+        outbox.thread.join(5)
+        self.assertTrue(outbox.closed)
+        sock.close.assert_called_once()
+
+    def test_frames_lost_with_the_connection_are_reported(self):
+        sock = BlockingSocket()
+        dropped = []
+        outbox = OutboundQueue(sock, on_dropped=dropped.extend).start()
+        outbox.offer(b"first", 1)
+        sock.sending.wait(5)
+        # queued behind a write that fails
+        outbox.offer(b"second", 2)
+        outbox.sendall(b"response")
+        outbox.offer(b"third", 3)
+        sock.sendall = MagicMock(side_effect=BrokenPipeError)
+        sock.release.set()
+        outbox.thread.join(5)
+        self.assertEqual(sock.sent, [b"first"])
+        self.assertEqual(dropped, [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
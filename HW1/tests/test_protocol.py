@@ -1,8 +1,25 @@
+import gc
+import socket
 import unittest
 from unittest.mock import MagicMock
 import json
 import struct
-from protocol import JSONProtocol, CustomProtocol
+from protocol import JSONProtocol, CustomProtocol, FrameReader, ACTIONS, register_action, STRING, UINT32
+
+
+def feed(mock_socket, *chunks):
+    """Serve `chunks` through recv_into, one chunk per call, then report EOF."""
+    pending = list(chunks)
+
+    def recv_into(buffer, nbytes=0):
+        if not pending:
+            return 0
+        chunk = pending.pop(0)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    mock_socket.recv_into.side_effect = recv_into
+
 
 class TestJSONProtocol(unittest.TestCase):
     def setUp(self):
@@ -21,13 +38,13 @@ class TestJSONProtocol(unittest.TestCase):
         message = json.dumps(data).encode('utf-8')
         message_length = len(message).to_bytes(4, byteorder='big')
         
-        self.mock_socket.recv.side_effect = [message_length, message]
+        feed(self.mock_socket, message_length, message)
         received_data = JSONProtocol.receive(self.mock_socket)
         self.assertEqual(received_data, data)
 
     def test_receive_empty_json(self):
         """Test receiving empty data."""
-        self.mock_socket.recv.side_effect = [b"", b""]
+        feed(self.mock_socket)
         received_data = JSONProtocol.receive(self.mock_socket)
         self.assertIsNone(received_data)
 
@@ -56,10 +73,10 @@ class TestCustomProtocol(unittest.TestCase):
         encoded_username = CustomProtocol.encode_length_prefixed_field(username)
         encoded_password = CustomProtocol.encode_length_prefixed_field(password)
         
-        message = struct.pack(">BB", 1, 2) + encoded_username + encoded_password
+        message = struct.pack(">BBI", 1, 2, 0) + encoded_username + encoded_password
         message_length = struct.pack(">I", len(message))
         
-        self.mock_socket.recv.side_effect = [message_length, message]
+        feed(self.mock_socket, message_length, message)
         received_data = CustomProtocol.receive(self.mock_socket)
         
         self.assertEqual(received_data, {"action": "login", "username": "testuser", "password": "testpass"})
@@ -74,10 +91,10 @@ class TestCustomProtocol(unittest.TestCase):
         encoded_recipient = CustomProtocol.encode_length_prefixed_field(recipient)
         encoded_message = CustomProtocol.encode_length_prefixed_field(message)
         
-        message = struct.pack(">BB", 3, 2) + encoded_recipient + encoded_message
+        message = struct.pack(">BBI", 3, 2, 0) + encoded_recipient + encoded_message
         message_length = struct.pack(">I", len(message))
         
-        self.mock_socket.recv.side_effect = [message_length, message]
+        feed(self.mock_socket, message_length, message)
         received_data = CustomProtocol.receive(self.mock_socket)
         
         self.assertEqual(received_data, {"action": "send_message", "recipient": "friend", "message": "Hello"})
@@ -89,10 +106,10 @@ class TestCustomProtocol(unittest.TestCase):
 
     def test_receive_custom_protocol_list_accounts(self):
         """Test receiving a response for listing accounts."""
-        message = struct.pack(">BB", 2, 1) + struct.pack(">B", 3)
+        message = struct.pack(">BBI", 2, 1, 0) + struct.pack(">I", 3)
         message_length = struct.pack(">I", len(message))
         
-        self.mock_socket.recv.side_effect = [message_length, message]
+        feed(self.mock_socket, message_length, message)
         received_data = CustomProtocol.receive(self.mock_socket)
         
         self.assertEqual(received_data, {"action": "list_accounts", "page_num": 3})
@@ -105,17 +122,17 @@ class TestCustomProtocol(unittest.TestCase):
     def test_receive_custom_protocol_delete_message(self):
         """Test receiving a delete message request."""
         recipient = "friend"
-        message_id = 12345
+        message_id = 1 << 60  # message ids are 64-bit
         encoded_recipient = CustomProtocol.encode_length_prefixed_field(recipient)
-        encoded_message_id = struct.pack(">I", message_id)
+        encoded_message_id = struct.pack(">Q", message_id)
         
-        message = struct.pack(">BB", 5, 2) + encoded_recipient + encoded_message_id
+        message = struct.pack(">BBI", 5, 2, 0) + encoded_recipient + encoded_message_id
         message_length = struct.pack(">I", len(message))
         
-        self.mock_socket.recv.side_effect = [message_length, message]
+        feed(self.mock_socket, message_length, message)
         received_data = CustomProtocol.receive(self.mock_socket)
         
-        self.assertEqual(received_data, {"action": "delete_message", "recipient": "friend", "message_id": 12345})
+        self.assertEqual(received_data, {"action": "delete_message", "recipient": "friend", "message_id": 1 << 60})
 
     def test_send_custom_protocol_response(self):
         """Test sending a response message."""
@@ -129,10 +146,10 @@ class TestCustomProtocol(unittest.TestCase):
         encoded_status = CustomProtocol.encode_length_prefixed_field(status)
         encoded_message = CustomProtocol.encode_length_prefixed_field(message)
         
-        message = struct.pack(">BB", 7, 2) + encoded_status + encoded_message
+        message = struct.pack(">BBI", 7, 2, 0) + encoded_status + encoded_message
         message_length = struct.pack(">I", len(message))
         
-        self.mock_socket.recv.side_effect = [message_length, message]
+        feed(self.mock_socket, message_length, message)
         received_data = CustomProtocol.receive(self.mock_socket)
         
         self.assertEqual(received_data, {"action": "response", "status": "success", "message": "Action completed"})
@@ -152,11 +169,146 @@ class TestCustomProtocol(unittest.TestCase):
         self.assertEqual(value, long_string)
         self.assertEqual(size, 305)
 
+    def test_encode_decode_roundtrip_all_actions(self):
+        """Every registered action survives an encode/decode roundtrip."""
+        messages = [
+            (1, {"username": "testuser", "password": "testpass"}),
+            (2, {"page_num": 3}),
+            (2, {"page_num": 300, "page_size": 20, "cursor": "dXNlcjE="}),
+            (3, {"recipient": "friend", "message": "Hello" * 100}),
+            (4, {"limit": 10}),
+            (5, {"recipient": "friend", "message_id": 12345}),
+            (6, {"password": "testpass"}),
+            (7, {"status": "success", "message": "Action completed"}),
+            (7, {"status": "success", "message": "['user1']", "next_cursor": "dXNlcjE="}),
+            (8, {"query": "ali", "limit": 20, "substring": 1}),
+            (9, {"limit": 100000, "cursor": "MTIz", "after_id": 1 << 40, "before_id": 1 << 62, "since_ms": 1750000000000, "until_ms": 1760000000000}),
+        ]
+        for action_type, fields in messages:
+            frame = CustomProtocol.encode(action_type, **fields)
+            decoded = CustomProtocol.decode(memoryview(frame)[4:])
+            self.assertEqual(decoded, {"action": ACTIONS[action_type].name, **fields})
+
+    def test_missing_field_ends_the_message(self):
+        """Fields after the first missing one are left out, down to none at all."""
+        frame = CustomProtocol.encode(2, page_num=3, cursor="dXNlcjE=")
+        self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": "list_accounts", "page_num": 3})
+        frame = CustomProtocol.encode(7, status="success", message="ok", next_cursor="", extra="dropped")
+        self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": "response", "status": "success", "message": "ok", "next_cursor": ""})
+        for action_type in ACTIONS:
+            frame = CustomProtocol.encode(action_type)
+            self.assertEqual(bytes(frame), struct.pack(">IBBI", 6, action_type, 0, 0))
+            self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": ACTIONS[action_type].name})
+
+    def test_encode_matches_length_prefix(self):
+        frame = CustomProtocol.encode(3, recipient="friend", message="Hello")
+        self.assertEqual(struct.unpack(">I", frame[:4])[0], len(frame) - 4)
+        expected = struct.pack(">BBI", 3, 2, 0) + CustomProtocol.encode_length_prefixed_field("friend") \
+            + CustomProtocol.encode_length_prefixed_field("Hello")
+        self.assertEqual(bytes(frame[4:]), expected)
+
+    def test_empty_string_field(self):
+        """Empty strings use the long form so they aren't mistaken for a 4-byte length prefix."""
+        frame = CustomProtocol.encode(7, status="success", message="")
+        self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": "response", "status": "success", "message": ""})
+
+    def test_response_values_are_stringified(self):
+        frame = CustomProtocol.encode(7, status="success", messages=[{"id": 1}])
+        self.assertEqual(CustomProtocol.decode(frame[4:])["message"], "[{'id': 1}]")
+
+    def test_request_id_roundtrip(self):
+        frame = CustomProtocol.encode(4, request_id=77, limit=5)
+        self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": "read_messages", "limit": 5, "request_id": 77})
+        frame = CustomProtocol.encode(7, request_id=77, status="success")
+        self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": "response", "status": "success", "request_id": 77})
+
+    def test_pipelined_frames_keep_their_request_ids(self):
+        """Several requests written back to back are decoded in order with their ids."""
+        frames = b"".join(bytes(CustomProtocol.encode(4, request_id=i, limit=i)) for i in range(1, 4))
+        feed(self.mock_socket, frames)
+        ids = [CustomProtocol.receive(self.mock_socket)["request_id"] for _ in range(3)]
+        self.assertEqual(ids, [1, 2, 3])
+
+    def test_decode_unknown_action(self):
+        self.assertEqual(CustomProtocol.decode(struct.pack(">BBI", 99, 0, 0)), {"action": "unknown"})
+
+    def test_register_action(self):
+        register_action(200, "ping", ("count", UINT32), ("note", STRING))
+        try:
+            frame = CustomProtocol.encode(200, count=7, note="hi")
+            self.assertEqual(CustomProtocol.decode(frame[4:]), {"action": "ping", "count": 7, "note": "hi"})
+        finally:
+            del ACTIONS[200]
+
     def test_receive_empty_message(self):
         """Test receiving an empty message."""
-        self.mock_socket.recv.side_effect = [b"", b""]
+        feed(self.mock_socket)
         received_data = CustomProtocol.receive(self.mock_socket)
         self.assertIsNone(received_data)
 
+class TestFrameReader(unittest.TestCase):
+    def setUp(self):
+        self.mock_socket = MagicMock()
+
+    def frame(self, payload):
+        return struct.pack(">I", len(payload)) + payload
+
+    def test_short_reads(self):
+        """A frame split across many recv calls is reassembled."""
+        data = self.frame(b"hello world")
+        feed(self.mock_socket, *[data[i:i + 1] for i in range(len(data))])
+        reader = FrameReader(self.mock_socket)
+        self.assertEqual(bytes(reader.read_frame()), b"hello world")
+        self.assertIsNone(reader.read_frame())
+
+    def test_multiple_frames_one_recv(self):
+        """Several frames delivered by one recv call cost a single syscall."""
+        feed(self.mock_socket, self.frame(b"one") + self.frame(b"two") + self.frame(b"three"))
+        reader = FrameReader(self.mock_socket)
+        self.assertEqual(bytes(reader.read_frame()), b"one")
+        self.assertEqual(bytes(reader.read_frame()), b"two")
+        self.assertEqual(bytes(reader.read_frame()), b"three")
+        self.assertEqual(self.mock_socket.recv_into.call_count, 1)
+
+    def test_frame_larger_than_buffer(self):
+        payload = b"x" * 100
+        data = self.frame(payload)
+        feed(self.mock_socket, data[:10], data[10:60], data[60:])
+        reader = FrameReader(self.mock_socket, buffer_size=16)
+        self.assertEqual(bytes(reader.read_frame()), payload)
+
+    def test_partial_frame_is_compacted(self):
+        """Leftover bytes of the next frame are moved to the front of the buffer."""
+        first, second = self.frame(b"a" * 8), self.frame(b"b" * 8)
+        feed(self.mock_socket, first + second[:6], second[6:])
+        reader = FrameReader(self.mock_socket, buffer_size=len(first) + 6)
+        self.assertEqual(bytes(reader.read_frame()), b"a" * 8)
+        self.assertEqual(bytes(reader.read_frame()), b"b" * 8)
+
+    def test_custom_protocol_split_frame(self):
+        message = struct.pack(">BBI", 3, 2, 0) + CustomProtocol.encode_length_prefixed_field("friend") \
+            + CustomProtocol.encode_length_prefixed_field("Hello")
+        data = self.frame(message)
+        feed(self.mock_socket, data[:3], data[3:9], data[9:])
+        received_data = CustomProtocol.receive(self.mock_socket)
+        self.assertEqual(received_data, {"action": "send_message", "recipient": "friend", "message": "Hello"})
+
+    def test_for_socket_reuses_reader(self):
+        self.assertIs(FrameReader.for_socket(self.mock_socket), FrameReader.for_socket(self.mock_socket))
+
+    def test_readers_go_away_with_their_sockets(self):
+        sockets = [socket.socket() for _ in range(50)]
+        for sock in sockets:
+            FrameReader.for_socket(sock)
+        FrameReader.release(sockets.pop())
+        self.assertEqual(sum(sock in FrameReader._readers for sock in sockets), 49)
+        for sock in sockets:
+            sock.close()
+        del sock
+        sockets.clear()
+        gc.collect()
+        self.assertEqual(len(FrameReader._readers), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
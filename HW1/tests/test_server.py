@@ -1,9 +1,15 @@
+import asyncio
+import threading
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 import socket
-from server import ChatServer
+from server import ChatServer, StreamSocket
+from sessions import SessionRegistry
+from outbox import OutboundQueue
 from protocol import JSONProtocol, CustomProtocol
+from wire_trace import tracer
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 
 class TestChatServer(unittest.TestCase):
     def setUp(self):
@@ -13,8 +19,9 @@ class TestChatServer(unittest.TestCase):
             self.server.server = mock_socket
         self.mock_client_socket = MagicMock(spec=socket.socket)
         self.mock_client_socket.getpeername.return_value = ("127.0.0.1", 1234)
-        self.server.clients_sockets = {}
-        self.server.login_users = {"127.0.0.1:1234": "testuser"}
+        self.server.sessions = SessionRegistry()
+        self.server.sessions.connect("127.0.0.1:1234", self.mock_client_socket)
+        self.server.sessions.login("127.0.0.1:1234", "testuser")
     
     def test_handle_login_json(self):
         self.server.use_json = True
@@ -38,7 +45,6 @@ class TestChatServer(unittest.TestCase):
     
     def test_handle_send_message_json(self):
         self.server.use_json = True
-        self.server.login_users["127.0.0.1:1234"] = "testuser"
         with patch.object(JSONProtocol, 'receive', side_effect=[{"action": "send_message", "recipient": "friend", "message": "Hello"}, None]), \
              patch.object(JSONProtocol, 'send') as mock_send, \
              patch('server.Storage') as mock_storage:
@@ -79,7 +85,6 @@ class TestChatServer(unittest.TestCase):
     
     def test_handle_delete_account_json(self):
         self.server.use_json = True
-        self.server.login_users["127.0.0.1:1234"] = "testuser"
         with patch.object(JSONProtocol, 'receive', side_effect=[{"action": "delete_account", "password": "testpass"}, None]), \
              patch.object(JSONProtocol, 'send') as mock_send, \
              patch('server.Storage') as mock_storage:
@@ -87,7 +92,8 @@ class TestChatServer(unittest.TestCase):
             mock_storage.return_value.delete_account.return_value = {"status": "success"}
             self.server.handle_client(self.mock_client_socket)
             mock_send.assert_called()
-            self.assertNotIn("127.0.0.1:1234", self.server.login_users)
+            self.assertIsNone(self.server.sessions.username("127.0.0.1:1234"))
+            self.assertFalse(self.server.sessions.is_online("testuser"))
 
     def test_handle_unknown_action(self):
         self.server.use_json = True
@@ -95,15 +101,210 @@ class TestChatServer(unittest.TestCase):
              patch.object(JSONProtocol, 'send') as mock_send:
             
             self.server.handle_client(self.mock_client_socket)
-            mock_send.assert_called_with(self.mock_client_socket, {"status": "error", "message": "Unknown action"})
+            mock_send.assert_called_with(ANY, {"status": "error", "message": "Unknown action"})
+            # responses are written through the connection's outbound queue
+            outbox = mock_send.call_args.args[0]
+            self.assertIsInstance(outbox, OutboundQueue)
+            self.assertIs(outbox.socket, self.mock_client_socket)
+
+    def test_response_echoes_request_id_json(self):
+        self.server.use_json = True
+        with patch.object(JSONProtocol, 'receive', side_effect=[{"action": "unknown_action", "request_id": 42}, None]), \
+             patch.object(JSONProtocol, 'send') as mock_send:
+
+            self.server.handle_client(self.mock_client_socket)
+            mock_send.assert_called_with(ANY, {"status": "error", "message": "Unknown action", "request_id": 42})
+
+    def test_response_echoes_request_id_custom(self):
+        self.server.use_json = False
+        with patch.object(CustomProtocol, 'receive', side_effect=[{"action": "list_accounts", "page_num": 1, "request_id": 9}, None]), \
+             patch.object(CustomProtocol, 'send') as mock_send, \
+             patch('server.Storage') as mock_storage:
+
+            mock_storage.return_value.list_accounts.return_value = {"status": "success", "message": ["user1"]}
+            self.server.handle_client(self.mock_client_socket)
+            self.assertEqual(mock_send.call_args.kwargs["request_id"], 9)
+
+    def test_send_message_pushes_to_every_recipient_session(self):
+        self.server.use_json = True
+        recipient_sockets = [MagicMock(spec=OutboundQueue), MagicMock(spec=OutboundQueue)]
+        for port, recipient_socket in zip((2001, 2002), recipient_sockets):
+            recipient_socket.offer.return_value = True
+            self.server.sessions.connect(f"127.0.0.1:{port}", recipient_socket)
+            self.server.sessions.login(f"127.0.0.1:{port}", "friend")
+        with patch.object(JSONProtocol, 'receive', side_effect=[{"action": "send_message", "recipient": "friend", "message": "Hello"}, None]), \
+             patch.object(JSONProtocol, 'send'), \
+             patch('server.Storage') as mock_storage:
+
+            mock_storage.return_value.send_message.return_value = {"status": "success"}
+            self.server.handle_client(self.mock_client_socket)
+            frame = JSONProtocol.encode({"status": "New message", "message": "testuser: Hello"})
+            message_id = mock_storage.return_value.ids.next_id.return_value
+            for recipient_socket in recipient_sockets:
+                recipient_socket.offer.assert_called_once_with(frame, message_id)
+            mock_storage.return_value.send_message.assert_called_once_with("testuser", "friend", "Hello", status="read", message_id=message_id)
+            mock_storage.return_value.mark_unread.assert_not_called()
+
+    def test_send_message_to_slow_recipient_is_stored_unread(self):
+        self.server.use_json = True
+        recipient_socket = MagicMock(spec=OutboundQueue)
+        recipient_socket.offer.return_value = False
+        self.server.sessions.connect("127.0.0.1:2001", recipient_socket)
+        self.server.sessions.login("127.0.0.1:2001", "friend")
+        with patch.object(JSONProtocol, 'receive', side_effect=[{"action": "send_message", "recipient": "friend", "message": "Hello"}, None]), \
+             patch.object(JSONProtocol, 'send'), \
+             patch('server.Storage') as mock_storage:
+
+            mock_storage.return_value.send_message.return_value = {"status": "success"}
+            self.server.handle_client(self.mock_client_socket)
+            message_id = mock_storage.return_value.ids.next_id.return_value
+            mock_storage.return_value.mark_unread.assert_called_once_with([message_id])
+
+    def test_trace_user_records_both_directions(self):
+        self.server.use_json = True
+        self.server.trace_users = {"alice"}
+        listener = socket.create_server(("127.0.0.1", 0))
+        client = socket.create_connection(listener.getsockname())
+        connection, _ = listener.accept()
+        listener.close()
+        tracer.records.clear()
+        try:
+            with patch('server.Storage') as mock_storage:
+                mock_storage.return_value.login_register_user.return_value = {"status": "success"}
+                handler = threading.Thread(target=self.server.handle_client, args=(connection,))
+                handler.start()
+                for request in ({"action": "login", "username": "alice", "password": "pw"}, {"action": "unknown_action"}):
+                    JSONProtocol.send(client, request)
+                    JSONProtocol.receive(client)
+                client.close()
+                handler.join(5)
+        finally:
+            tracer.disable()
+        traced = [(record["direction"], record["message"].get("action", record["message"].get("status")))
+                  for record in tracer.records]
+        self.assertIn(("send", "success"), traced)
+        self.assertIn(("receive", "unknown_action"), traced)
+
+    def test_disconnect_logs_out(self):
+        with patch.object(JSONProtocol, 'receive', return_value=None):
+            self.server.handle_client(self.mock_client_socket)
+        self.assertFalse(self.server.sessions.is_online("testuser"))
+        self.assertIsNone(self.server.sessions.socket("127.0.0.1:1234"))
 
     def test_server_start(self):
-        with patch.object(self.server.server, 'accept', side_effect=[(self.mock_client_socket, ('127.0.0.1', 1234)), KeyboardInterrupt]), \
+        with patch.object(self.server.server, 'accept', side_effect=[(self.mock_client_socket, ('127.0.0.1', 5555)), KeyboardInterrupt]), \
              patch('threading.Thread') as mock_thread:
             
             with self.assertRaises(KeyboardInterrupt):  
                 self.server.start()
             mock_thread.assert_called()
+            # pushes go through the outbound queue, so the raw socket is never registered
+            self.assertIsNone(self.server.sessions.socket("127.0.0.1:5555"))
+
+
+class TestAsyncChatServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        args = Namespace(host='127.0.0.1', port=0, json=True, workers=2)
+        self.server = ChatServer(args)
+        self.server.loop = asyncio.get_running_loop()
+        self.server.executor = ThreadPoolExecutor(max_workers=2)
+        self.storage_patch = patch('server.Storage')
+        self.mock_storage = self.storage_patch.start()
+        self.listener = await asyncio.start_server(self.server.handle_client_async, sock=self.server.server)
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.server.executor.shutdown()
+        self.storage_patch.stop()
+
+    async def request(self, reader, writer, data):
+        writer.write(JSONProtocol.encode(data))
+        header = await reader.readexactly(4)
+        return JSONProtocol.decode(await reader.readexactly(int.from_bytes(header, byteorder='big')))
+
+    async def test_login_and_list_accounts(self):
+        self.mock_storage.return_value.login_register_user.return_value = {"status": "success", "message": "Login successful"}
+        self.mock_storage.return_value.list_accounts.return_value = {"status": "success", "message": ["user1"]}
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+
+        response = await self.request(reader, writer, {"action": "login", "username": "alice", "password": "pw", "request_id": 1})
+        self.assertEqual(response, {"status": "success", "message": "Login successful", "request_id": 1})
+        self.assertTrue(self.server.sessions.is_online("alice"))
+
+        response = await self.request(reader, writer, {"action": "list_accounts", "page_num": 1, "request_id": 2})
+        self.assertEqual(response["message"], ["user1"])
+        self.assertEqual(response["request_id"], 2)
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_push_to_other_connection(self):
+        self.mock_storage.return_value.login_register_user.return_value = {"status": "success"}
+        self.mock_storage.return_value.send_message.return_value = {"status": "success", "message": "Message sent"}
+        alice = await asyncio.open_connection('127.0.0.1', self.port)
+        bob = await asyncio.open_connection('127.0.0.1', self.port)
+        await self.request(*alice, {"action": "login", "username": "alice", "password": "pw"})
+        await self.request(*bob, {"action": "login", "username": "bob", "password": "pw"})
+
+        response = await self.request(*alice, {"action": "send_message", "recipient": "bob", "message": "hi"})
+        self.assertEqual(response["status"], "success")
+        header = await bob[0].readexactly(4)
+        push = JSONProtocol.decode(await bob[0].readexactly(int.from_bytes(header, byteorder='big')))
+        self.assertEqual(push, {"status": "New message", "message": "alice: hi"})
+        for _, writer in (alice, bob):
+            writer.close()
+            await writer.wait_closed()
+
+    async def test_disconnect_removes_socket(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.server.sessions), 1)
+        writer.close()
+        await writer.wait_closed()
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.server.sessions), 0)
+
+
+class TestStreamSocket(unittest.TestCase):
+    def test_offers_from_handler_threads_count_toward_the_watermark(self):
+        writer = MagicMock()
+        writer.is_closing.return_value = False
+        writer.transport.get_write_buffer_size.return_value = 0
+        loop = MagicMock()
+        client_socket = StreamSocket(writer, loop, high_watermark=250, low_watermark=50)
+        client_socket.loop_thread = None  # as if called from a handler thread
+
+        # the loop hasn't run the writes yet, so the transport buffer is still empty
+        self.assertEqual([client_socket.offer(b"x" * 100) for _ in range(4)], [True, True, True, False])
+        for call in loop.call_soon_threadsafe.call_args_list:
+            call.args[0](*call.args[1:])
+        self.assertEqual(writer.write.call_count, 3)
+        self.assertTrue(client_socket.offer(b"x" * 100))
+
+    def test_frames_lost_with_the_connection_are_reported(self):
+        writer = MagicMock()
+        writer.is_closing.return_value = False
+        writer.transport.get_write_buffer_size.return_value = 0
+        loop = MagicMock()
+        dropped = []
+        client_socket = StreamSocket(writer, loop, on_dropped=dropped.extend)
+        client_socket.loop_thread = None
+        for tag in (1, 2, 3, 4):
+            client_socket.offer(b"x" * 100, tag)
+        scheduled = loop.call_soon_threadsafe.call_args_list
+        # the transport sends the first frame and half of the second
+        scheduled[0].args[0](*scheduled[0].args[1:])
+        writer.transport.get_write_buffer_size.return_value = 50
+        scheduled[1].args[0](*scheduled[1].args[1:])
+        writer.transport.get_write_buffer_size.return_value = 150
+        scheduled[2].args[0](*scheduled[2].args[1:])
+
+        client_socket.close()
+        writer.is_closing.return_value = True
+        scheduled[3].args[0](*scheduled[3].args[1:])
+        self.assertEqual(dropped, [2, 3, 4])
+        self.assertEqual(writer.write.call_count, 3)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import MagicMock
+from sessions import SessionRegistry
+
+
+class TestSessionRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = SessionRegistry()
+        self.alice_socket = MagicMock()
+        self.registry.connect("1.1.1.1:1", self.alice_socket)
+        self.registry.login("1.1.1.1:1", "alice")
+
+    def test_lookup(self):
+        self.assertEqual(self.registry.username("1.1.1.1:1"), "alice")
+        self.assertIs(self.registry.socket("1.1.1.1:1"), self.alice_socket)
+        self.assertTrue(self.registry.is_online("alice"))
+        self.assertEqual(self.registry.sockets_for("alice"), [self.alice_socket])
+        self.assertEqual(self.registry.sockets_for("bob"), [])
+
+    def test_multiple_sessions(self):
+        other_socket = MagicMock()
+        self.registry.connect("1.1.1.1:2", other_socket)
+        self.registry.login("1.1.1.1:2", "alice")
+        self.assertEqual(self.registry.sockets_for("alice"), [self.alice_socket, other_socket])
+
+        self.registry.disconnect("1.1.1.1:1")
+        self.assertEqual(self.registry.sockets_for("alice"), [other_socket])
+        self.assertTrue(self.registry.is_online("alice"))
+
+    def test_relogin_as_other_user(self):
+        self.registry.login("1.1.1.1:1", "bob")
+        self.assertFalse(self.registry.is_online("alice"))
+        self.assertEqual(self.registry.sockets_for("bob"), [self.alice_socket])
+
+    def test_logout_keeps_connection(self):
+        self.assertEqual(self.registry.logout("1.1.1.1:1"), "alice")
+        self.assertFalse(self.registry.is_online("alice"))
+        self.assertIs(self.registry.socket("1.1.1.1:1"), self.alice_socket)
+
+    def test_logout_user(self):
+        self.registry.connect("1.1.1.1:2", MagicMock())
+        self.registry.login("1.1.1.1:2", "alice")
+        self.assertEqual(sorted(self.registry.logout_user("alice")), ["1.1.1.1:1", "1.1.1.1:2"])
+        self.assertEqual(self.registry.online_users(), [])
+        self.assertEqual(len(self.registry), 2)
+
+    def test_disconnect(self):
+        self.assertEqual(self.registry.disconnect("1.1.1.1:1"), "alice")
+        self.assertEqual(len(self.registry), 0)
+        self.assertIsNone(self.registry.disconnect("1.1.1.1:1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
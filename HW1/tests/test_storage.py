@@ -1,14 +1,17 @@
+import os
+import tempfile
+import threading
 import unittest
 import sqlite3
 import bcrypt
-from storage import Storage
+from storage import MIGRATIONS, ConnectionPool, Storage, migrate
 
 class TestStorage(unittest.TestCase):
     def setUp(self):
         self.storage = Storage(":memory:")  # Use in-memory database for testing
 
     def tearDown(self):
-        self.storage.conn.close()
+        self.storage.close()
 
     def test_login_register_user_register_success(self):
         response = self.storage.login_register_user("testuser", "testpass")
@@ -33,6 +36,63 @@ class TestStorage(unittest.TestCase):
         self.assertIn("user1", response["message"])
         self.assertIn("user2", response["message"])
 
+    def test_list_accounts_with_cursor(self):
+        names = [f"user{i:02d}" for i in range(12)]
+        with self.storage.pool.connection() as conn, conn:
+            conn.executemany("INSERT INTO users (username, password_hash) VALUES (?, 'x')", [(name,) for name in reversed(names)])
+
+        pages, cursor = [], None
+        while True:
+            response = self.storage.list_accounts(page_size=5, cursor=cursor)
+            pages.append(response["message"])
+            cursor = response["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(pages, [names[:5], names[5:10], names[10:]])
+        # page numbers still work and agree with the cursor pages
+        self.assertEqual(self.storage.list_accounts(2, page_size=5)["message"], names[5:10])
+
+    def test_list_accounts_invalid_cursor(self):
+        response = self.storage.list_accounts(cursor="not base64!")
+        self.assertEqual(response, {"status": "error", "message": "Invalid cursor"})
+
+    def test_search_accounts_tracks_registrations(self):
+        for name in ("alice", "alicia", "malice"):
+            self.storage.login_register_user(name, "pass")
+        self.assertEqual(self.storage.search_accounts("ali")["message"], ["alice", "alicia"])
+        self.assertEqual(self.storage.search_accounts("lice", substring=True)["message"], ["alice", "malice"])
+
+        self.storage.delete_account("alice", "pass")
+        self.assertEqual(self.storage.search_accounts("ali")["message"], ["alicia"])
+
+    def test_read_history_pages_and_ranges(self):
+        self.storage.login_register_user("sender", "pass")
+        self.storage.login_register_user("reader", "pass")
+        clock = [1750000000.0]
+        self.storage.ids.clock = lambda: clock[0]
+        for i in range(7):
+            self.storage.send_message("sender", "reader", f"m{i}")
+            clock[0] += 1
+        self.storage.read_messages("reader", 2)
+
+        pages, cursor = [], None
+        while True:
+            response = self.storage.read_history("reader", limit=3, cursor=cursor)
+            pages.append([msg["message"] for msg in response["message"]])
+            cursor = response["next_cursor"]
+            if not cursor:
+                break
+        # read and unread messages alike, oldest first
+        self.assertEqual(pages, [["m0", "m1", "m2"], ["m3", "m4", "m5"], ["m6"]])
+
+        # messages m2 and m3 were sent in [1750000002, 1750000004)
+        response = self.storage.read_history("reader", since_ms=1750000002000, until_ms=1750000004000)
+        self.assertEqual([msg["message"] for msg in response["message"]], ["m2", "m3"])
+        ids = [msg["id"] for msg in self.storage.read_history("reader")["message"]]
+        response = self.storage.read_history("reader", after_id=ids[4], before_id=ids[6])
+        self.assertEqual([msg["message"] for msg in response["message"]], ["m5"])
+        self.assertEqual(self.storage.read_history("reader", cursor="???")["status"], "error")
+
     def test_send_message_success(self):
         self.storage.login_register_user("sender", "pass")
         self.storage.login_register_user("recipient", "pass")
@@ -54,11 +114,36 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(len(response["messages"]), 1)
         self.assertEqual(response["messages"][0]["message"], "Hello")
 
+    def test_delivered_message_is_not_read_again(self):
+        self.storage.login_register_user("sender", "pass")
+        self.storage.login_register_user("recipient", "pass")
+        self.storage.send_message("sender", "recipient", "Hello", status="read")
+        response = self.storage.read_messages("recipient")
+        self.assertEqual(response["status"], "error")
+
+    def test_undelivered_push_is_marked_unread(self):
+        self.storage.login_register_user("sender", "pass")
+        self.storage.login_register_user("recipient", "pass")
+        self.storage.send_message("sender", "recipient", "Hello", status="read", message_id=42)
+        self.storage.mark_unread([42])
+        response = self.storage.read_messages("recipient")
+        self.assertEqual([message["id"] for message in response["messages"]], [42])
+
+    def test_messages_sent_in_the_same_second_are_all_stored(self):
+        self.storage.login_register_user("sender", "pass")
+        self.storage.login_register_user("recipient", "pass")
+        for i in range(20):
+            self.assertEqual(self.storage.send_message("sender", "recipient", f"Hello {i}")["status"], "success")
+        response = self.storage.read_messages("recipient", limit=50)
+        self.assertEqual(len(response["messages"]), 20)
+        self.assertEqual(response["messages"][0]["message"], "Hello 19")
+
     def test_delete_message_success(self):
         self.storage.login_register_user("sender", "pass")
         self.storage.login_register_user("recipient", "pass")
         self.storage.send_message("sender", "recipient", "Hello")
-        message_id = int(self.storage.cursor.execute("SELECT id FROM messages").fetchone()[0])
+        with self.storage.pool.connection() as conn:
+            message_id = int(conn.execute("SELECT id FROM messages").fetchone()[0])
         response = self.storage.delete_message("sender", "recipient", message_id)
         self.assertEqual(response["status"], "success")
 
@@ -73,5 +158,137 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(response["status"], "error")
         self.assertEqual(response["message"], "Invalid credentials")
 
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp.name, "test.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_connections_use_wal(self):
+        pool = ConnectionPool(self.db_name, size=2)
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        pool.close()
+
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(self.db_name, size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(pool.opened, 1)
+        pool.close()
+
+    def test_pool_is_bounded(self):
+        pool = ConnectionPool(self.db_name, size=2)
+        borrowed = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with pool.connection():
+                borrowed.set()
+                release.wait(5)
+
+        holders = [threading.Thread(target=hold) for _ in range(2)]
+        for holder in holders:
+            holder.start()
+        borrowed.wait(5)
+        def wait():
+            with pool.connection():
+                pass
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        release.set()
+        waiter.join(5)
+        for holder in holders:
+            holder.join()
+        self.assertEqual(pool.opened, 2)
+        pool.close()
+
+    def test_memory_database_uses_one_connection(self):
+        self.assertEqual(ConnectionPool(":memory:", size=8).size, 1)
+
+    def test_concurrent_readers_get_each_message_once(self):
+        storage = Storage(self.db_name, pool_size=4)
+        with storage.pool.connection() as conn, conn:
+            conn.executemany("INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, 'sender', 'recipient', 'Hello', 'unread')",
+                             [(message_id,) for message_id in range(1, 51)])
+
+        read_ids = []
+        def reader():
+            while True:
+                response = storage.read_messages("recipient", limit=3)
+                if response["status"] != "success":
+                    break
+                read_ids.extend(message["id"] for message in response["messages"])
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(read_ids), list(range(1, 51)))
+        storage.close()
+
+    def test_storage_shared_between_threads(self):
+        storage = Storage(self.db_name, pool_size=4)
+        threads = [threading.Thread(target=storage.login_register_user, args=(f"user{i}", "pass")) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with storage.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0], 8)
+        storage.close()
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp.name, "test.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def indexes(self, conn):
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND name NOT LIKE 'sqlite_%'")}
+
+    def test_new_database_is_at_latest_version(self):
+        storage = Storage(self.db_name)
+        with storage.pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+            self.assertEqual(self.indexes(conn), {"messages_recipient_status", "messages_sender_recipient", "messages_recipient_id"})
+        storage.close()
+
+    def test_existing_database_is_upgraded_in_place(self):
+        # a data.db written before migrations existed
+        conn = sqlite3.connect(self.db_name)
+        conn.execute("CREATE TABLE users (username TEXT PRIMARY KEY, password_hash TEXT)")
+        conn.execute("CREATE TABLE messages (id INT PRIMARY KEY, sender TEXT, recipient TEXT, message TEXT, status TEXT)")
+        conn.execute("INSERT INTO messages VALUES (1, 'sender', 'recipient', 'Hello', 'unread')")
+        conn.commit()
+        conn.close()
+
+        storage = Storage(self.db_name)
+        with storage.pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+            self.assertIn("messages_recipient_status", self.indexes(conn))
+        self.assertEqual(storage.read_messages("recipient")["messages"][0]["message"], "Hello")
+        storage.close()
+
+    def test_migrate_is_idempotent(self):
+        conn = sqlite3.connect(self.db_name)
+        self.assertEqual(migrate(conn), len(MIGRATIONS))
+        self.assertEqual(migrate(conn), len(MIGRATIONS))
+        conn.close()
+
+
 if __name__ == "__main__":
     unittest.main()
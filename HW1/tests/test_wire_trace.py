@@ -0,0 +1,99 @@
+import gc
+import threading
+import unittest
+from unittest.mock import MagicMock
+import logging
+from protocol import JSONProtocol, CustomProtocol
+from wire_trace import WireMetrics, WireTracer, metrics, tracer
+
+
+class TestWireMetrics(unittest.TestCase):
+    def test_counters(self):
+        m = WireMetrics()
+        m.record_send(10)
+        m.record_send(5)
+        m.record_receive(7)
+        self.assertEqual(m.snapshot(), {"frames_sent": 2, "bytes_sent": 15, "frames_received": 1, "bytes_received": 7})
+        m.reset()
+        self.assertEqual(m.snapshot()["frames_sent"], 0)
+
+    def test_threads_count_without_sharing_a_lock(self):
+        m = WireMetrics()
+        m.lock = MagicMock()
+        def count():
+            for _ in range(100):
+                m.record_send(2)
+                m.record_receive(3)
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+        # taken once when each thread starts counting and once when it ends, not per frame
+        self.assertLessEqual(m.lock.__enter__.call_count, 2 * len(threads))
+        m.lock = threading.RLock()
+        # the threads have ended, and their counts were kept
+        self.assertEqual(m.live, {})
+        self.assertEqual(m.snapshot(), {"frames_sent": 400, "bytes_sent": 800, "frames_received": 400, "bytes_received": 1200})
+
+    def test_protocol_send_updates_metrics(self):
+        before = metrics.snapshot()
+        frame = CustomProtocol.encode(3, recipient="friend", message="Hello")
+        CustomProtocol.send(MagicMock(), 3, recipient="friend", message="Hello")
+        after = metrics.snapshot()
+        self.assertEqual(after["frames_sent"] - before["frames_sent"], 1)
+        self.assertEqual(after["bytes_sent"] - before["bytes_sent"], len(frame))
+
+
+class TestWireTracer(unittest.TestCase):
+    def setUp(self):
+        self.tracer = WireTracer(capacity=3)
+        self.sock = MagicMock()
+        self.sock.getpeername.return_value = ("127.0.0.1", 1234)
+
+    def test_disabled_by_default(self):
+        self.assertFalse(self.tracer.active)
+        self.assertFalse(self.tracer.wants(self.sock))
+
+    def test_enable_single_socket(self):
+        other = MagicMock()
+        self.tracer.enable(self.sock)
+        self.assertTrue(self.tracer.active)
+        self.assertTrue(self.tracer.wants(self.sock))
+        self.assertFalse(self.tracer.wants(other))
+        self.tracer.disable(self.sock)
+        self.assertFalse(self.tracer.active)
+
+    def test_enable_all(self):
+        self.tracer.enable()
+        self.assertTrue(self.tracer.wants(MagicMock()))
+        self.tracer.disable()
+        self.assertFalse(self.tracer.active)
+
+    def test_sampling(self):
+        self.tracer.enable(sample_rate=0.0)
+        self.assertFalse(any(self.tracer.wants(self.sock) for _ in range(100)))
+
+    def test_ring_buffer_and_logger(self):
+        log = MagicMock(spec=logging.Logger)
+        self.tracer.enable(logger=log)
+        for i in range(5):
+            self.tracer.record("send", "json", self.sock, i, {"n": i})
+        self.assertEqual([r["message"]["n"] for r in self.tracer.records], [2, 3, 4])
+        self.assertEqual(self.tracer.records[-1]["peer"], ("127.0.0.1", 1234))
+        self.assertEqual(log.debug.call_count, 5)
+
+    def test_protocol_traces_enabled_socket(self):
+        tracer.enable(self.sock)
+        try:
+            JSONProtocol.send(self.sock, {"action": "login"})
+            JSONProtocol.send(MagicMock(), {"action": "other"})
+        finally:
+            tracer.disable()
+        self.assertEqual(tracer.records[-1]["message"], {"action": "login"})
+        self.assertEqual(tracer.records[-1]["direction"], "send")
+
+
+if __name__ == "__main__":
+    unittest.main()
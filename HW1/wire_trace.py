@@ -0,0 +1,139 @@
+"""
+Wire tracing and frame counters for the HW1 protocols.
+
+Tracing is off by default. It can be switched on for every connection or only
+for selected sockets, optionally sampled, and records go to an in-memory ring
+buffer and (optionally) a logger. Frame and byte counters are always kept.
+"""
+import collections
+import logging
+import random
+import threading
+import time
+import weakref
+
+logger = logging.getLogger("wire")
+
+
+class WireMetrics:
+    """
+    Frame and byte counters for both directions. Each thread counts into its own cells,
+    so counting a frame takes no lock; snapshot() adds the cells up. The counts of a
+    thread that has ended are folded into `retired`.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()  # finalizers may run while a thread holds it
+        self.local = threading.local()
+        self.live = {}  # id -> [frames_sent, bytes_sent, frames_received, bytes_received]
+        self.retired = [0, 0, 0, 0]
+
+    def _register(self):
+        """Create the calling thread's cells, on its first frame."""
+        cells = self.local.cells = [0, 0, 0, 0]
+        # the thread's locals go away with it, and the finalizer keeps its counts
+        owner = self.local.owner = _ThreadCells()
+        with self.lock:
+            self.live[id(cells)] = cells
+        weakref.finalize(owner, self._retire, id(cells))
+        return cells
+
+    def _retire(self, key):
+        with self.lock:
+            cells = self.live.pop(key, None)
+            if cells is not None:
+                self.retired = [total + count for total, count in zip(self.retired, cells)]
+
+    def reset(self):
+        with self.lock:
+            self.retired = [0, 0, 0, 0]
+            for cells in self.live.values():
+                cells[:] = [0, 0, 0, 0]
+
+    def record_send(self, nbytes):
+        try:
+            cells = self.local.cells
+        except AttributeError:
+            cells = self._register()
+        cells[0] += 1
+        cells[1] += nbytes
+
+    def record_receive(self, nbytes):
+        try:
+            cells = self.local.cells
+        except AttributeError:
+            cells = self._register()
+        cells[2] += 1
+        cells[3] += nbytes
+
+    def snapshot(self):
+        with self.lock:
+            totals = list(self.retired)
+            for cells in self.live.values():
+                totals = [total + count for total, count in zip(totals, cells)]
+        return dict(zip(("frames_sent", "bytes_sent", "frames_received", "bytes_received"), totals))
+
+
+class _ThreadCells:
+    """Lives in one thread's locals; its finalizer retires that thread's counters."""
+
+
+class WireTracer:
+    """
+    Records decoded frames for debugging.
+    `active` is the only attribute checked on the hot path, so connections that
+    aren't traced pay for a single attribute lookup per frame.
+    """
+    def __init__(self, capacity=1000):
+        self.records = collections.deque(maxlen=capacity)
+        self.sockets = weakref.WeakSet()
+        self.trace_all = False
+        self.sample_rate = 1.0
+        self.logger = None
+        self.active = False
+
+    def enable(self, socket=None, sample_rate=1.0, logger=None):
+        """Trace `socket`, or every connection if no socket is given."""
+        if socket is None:
+            self.trace_all = True
+        else:
+            self.sockets.add(socket)
+        self.sample_rate = sample_rate
+        if logger is not None:
+            self.logger = logger
+        self.active = True
+
+    def disable(self, socket=None):
+        """Stop tracing `socket`, or stop tracing altogether if no socket is given."""
+        if socket is None:
+            self.trace_all = False
+            self.sockets.clear()
+        else:
+            self.sockets.discard(socket)
+        self.active = self.trace_all or len(self.sockets) > 0
+
+    def wants(self, socket):
+        """Whether the next frame on this socket should be recorded."""
+        if not (self.trace_all or socket in self.sockets):
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, direction, protocol, socket, nbytes, message):
+        try:
+            peer = socket.getpeername()
+        except OSError:
+            peer = None
+        self.records.append({
+            "time": time.time(),
+            "direction": direction,
+            "protocol": protocol,
+            "peer": peer,
+            "bytes": nbytes,
+            "message": message,
+        })
+        if self.logger is not None:
+            self.logger.debug("[%s] %s %s %d bytes: %s", protocol, direction, peer, nbytes, message)
+
+
+# process-wide instances used by protocol.py
+metrics = WireMetrics()
+tracer = WireTracer()
@@ -0,0 +1,99 @@
+"""
+Password hashing off the gRPC request threads.
+
+bcrypt is deliberately slow, so a burst of logins could occupy every gRPC worker and
+stall unrelated calls. PasswordHasher runs bcrypt on its own small thread pool (bcrypt
+releases the GIL) and turns requests away once too many are waiting, so only a bounded
+number of request threads are ever blocked on hashing. Successful checks can be
+remembered for a short time, so a client that reconnects doesn't pay for bcrypt again.
+"""
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+
+class Overloaded(Exception):
+    """Raised when the hashing pool is already at its limit of waiting requests."""
+
+
+class CredentialCache:
+    """
+    Bounded, short-lived record of recently verified (username, password) pairs.
+    Keys are HMACs under a per-process secret, so neither passwords nor anything
+    that could be brute-forced offline are kept in memory. Each entry also records
+    the password hash it was checked against, so it stops matching as soon as the
+    account is deleted or re-registered.
+    """
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.secret = os.urandom(32)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, username, password):
+        return hmac.new(self.secret, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def get(self, username, password, password_hash):
+        key = self.key(username, password)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            stored_hash, expires = entry
+            if expires < time.monotonic() or stored_hash != password_hash:
+                del self.entries[key]
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def put(self, username, password, password_hash):
+        key = self.key(username, password)
+        with self.lock:
+            self.entries[key] = (password_hash, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on `workers` threads. At most `max_pending` hash or check calls may be
+    queued or running at once; further calls raise Overloaded instead of waiting.
+    Set `cache_ttl` to 0 to verify every login with bcrypt.
+    """
+    def __init__(self, workers=2, max_pending=8, cache_ttl=300, cache_size=10000):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.cache = CredentialCache(cache_ttl, cache_size) if cache_ttl > 0 else None
+
+    def _run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise Overloaded("too many logins in progress")
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+
+    def check(self, username, password, password_hash):
+        if self.cache is not None and self.cache.get(username, password, password_hash):
+            return True
+        valid = self._run(bcrypt.checkpw, password.encode(), password_hash)
+        if valid and self.cache is not None:
+            self.cache.put(username, password, password_hash)
+        return valid
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
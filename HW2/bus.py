@@ -0,0 +1,38 @@
+"""
+Event bus between the worker processes of one sharded server.
+
+Each worker owns an inbox, a multiprocessing queue that every other worker can put into.
+Presence, session and account changes are broadcast to every other worker, and a
+message for a user listening on another worker goes straight to that worker's inbox. A
+thread in each worker reads its inbox and hands the events to the ChatService.
+"""
+import threading
+
+
+class Bus:
+    def __init__(self, inboxes, index):
+        self.inboxes = inboxes
+        # this worker's position in `inboxes`, also its id-generator node id
+        self.index = index
+
+    def broadcast(self, kind, *args):
+        """Sends an event to every other worker. Never blocks: the queue's feeder thread does the writing."""
+        for i, inbox in enumerate(self.inboxes):
+            if i != self.index:
+                inbox.put((kind, args))
+
+    def send(self, worker, kind, *args):
+        self.inboxes[worker].put((kind, args))
+
+    def start(self, handle):
+        """Calls handle(kind, *args) for every event sent to this worker, on a daemon thread."""
+        def listen():
+            inbox = self.inboxes[self.index]
+            while True:
+                kind, args = inbox.get()
+                try:
+                    handle(kind, *args)
+                except Exception as e:
+                    print(f"Error handling bus event {kind}: {e}")
+
+        threading.Thread(target=listen, daemon=True, name=f"bus-{self.index}").start()
@@ -49,6 +49,11 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.ListAccountsRequest.SerializeToString,
                 response_deserializer=chat__pb2.ListAccountsResponse.FromString,
                 _registered_method=True)
+        self.SearchAccounts = channel.unary_unary(
+                '/ChatService/SearchAccounts',
+                request_serializer=chat__pb2.SearchAccountsRequest.SerializeToString,
+                response_deserializer=chat__pb2.ListAccountsResponse.FromString,
+                _registered_method=True)
         self.SendMessage = channel.unary_unary(
                 '/ChatService/SendMessage',
                 request_serializer=chat__pb2.SendMessageRequest.SerializeToString,
@@ -59,6 +64,11 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.ReadMessagesRequest.SerializeToString,
                 response_deserializer=chat__pb2.ReadMessagesResponse.FromString,
                 _registered_method=True)
+        self.StreamHistory = channel.unary_stream(
+                '/ChatService/StreamHistory',
+                request_serializer=chat__pb2.StreamHistoryRequest.SerializeToString,
+                response_deserializer=chat__pb2.HistoryChunk.FromString,
+                _registered_method=True)
         self.DeleteMessage = channel.unary_unary(
                 '/ChatService/DeleteMessage',
                 request_serializer=chat__pb2.DeleteMessageRequest.SerializeToString,
@@ -97,6 +107,12 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SearchAccounts(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def SendMessage(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -109,6 +125,12 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamHistory(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def DeleteMessage(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -145,6 +167,11 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.ListAccountsRequest.FromString,
                     response_serializer=chat__pb2.ListAccountsResponse.SerializeToString,
             ),
+            'SearchAccounts': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchAccounts,
+                    request_deserializer=chat__pb2.SearchAccountsRequest.FromString,
+                    response_serializer=chat__pb2.ListAccountsResponse.SerializeToString,
+            ),
             'SendMessage': grpc.unary_unary_rpc_method_handler(
                     servicer.SendMessage,
                     request_deserializer=chat__pb2.SendMessageRequest.FromString,
@@ -155,6 +182,11 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.ReadMessagesRequest.FromString,
                     response_serializer=chat__pb2.ReadMessagesResponse.SerializeToString,
             ),
+            'StreamHistory': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamHistory,
+                    request_deserializer=chat__pb2.StreamHistoryRequest.FromString,
+                    response_serializer=chat__pb2.HistoryChunk.SerializeToString,
+            ),
             'DeleteMessage': grpc.unary_unary_rpc_method_handler(
                     servicer.DeleteMessage,
                     request_deserializer=chat__pb2.DeleteMessageRequest.FromString,
@@ -262,6 +294,33 @@ class ChatService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def SearchAccounts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/ChatService/SearchAccounts',
+            chat__pb2.SearchAccountsRequest.SerializeToString,
+            chat__pb2.ListAccountsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def SendMessage(request,
             target,
@@ -316,6 +375,33 @@ class ChatService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def StreamHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/ChatService/StreamHistory',
+            chat__pb2.StreamHistoryRequest.SerializeToString,
+            chat__pb2.HistoryChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def DeleteMessage(request,
             target,
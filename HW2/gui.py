@@ -4,6 +4,7 @@ import threading
 import chat_pb2
 import chat_pb2_grpc
 import grpc
+from tokens import TokenClientInterceptor
 from argparse import ArgumentParser
 
 def parse_args():
@@ -20,9 +21,11 @@ class ChatGUI:
 
         # gRPC channel and stub
         self.channel = grpc.insecure_channel(f"{args.host}:{args.port}")
-        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+        # every call after Login carries the session token it returned
+        self.stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(self.channel, TokenClientInterceptor(lambda: self.token)))
         self.username = None
         self.password = None
+        self.token = None
 
         # add procedure to handle window close event
         self.root.protocol("WM_DELETE_WINDOW", self.handle_close)
@@ -60,6 +63,7 @@ class ChatGUI:
         if response.status == "success":
             self.username = username
             self.password = password
+            self.token = response.token
             messagebox.showinfo("Success", "Login successful!")
             self.show_chat_window()
             threading.Thread(target=self.listen_for_messages, daemon=True).start()
@@ -99,6 +103,12 @@ class ChatGUI:
         list_accounts_button = tk.Button(self.root, text="List Accounts", command=self.list_accounts)
         list_accounts_button.pack()
 
+        search_accounts_button = tk.Button(self.root, text="Search Accounts", command=self.search_accounts)
+        search_accounts_button.pack()
+
+        history_button = tk.Button(self.root, text="Message History", command=self.show_history)
+        history_button.pack()
+
         delete_message_button = tk.Button(self.root, text="Delete Most Recent Message With ...", command=self.delete_message)
         delete_message_button.pack()
 
@@ -163,10 +173,38 @@ class ChatGUI:
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
+    def show_history(self):
+        """Show every message sent to this user, oldest first."""
+        try:
+            self.chat_display.config(state=tk.NORMAL)
+            self.chat_display.insert(tk.END, "\n--- History ---\n")
+            for chunk in self.stub.StreamHistory(chat_pb2.StreamHistoryRequest(username=self.username)):
+                for msg in chunk.messages:
+                    self.chat_display.insert(tk.END, f"From {msg.sender}: {msg.message}\n")
+            self.chat_display.config(state=tk.DISABLED)
+        except grpc.RpcError as e:
+            messagebox.showerror("Error", e.details())
+
     def list_accounts(self):
-        """List available user accounts."""
-        response = self.stub.ListAccounts(chat_pb2.ListAccountsRequest(page_num=1))
-        messagebox.showinfo("Accounts", "\n".join(response.usernames))
+        """List available user accounts, one page at a time."""
+        usernames, cursor = [], ""
+        while True:
+            response = self.stub.ListAccounts(chat_pb2.ListAccountsRequest(cursor=cursor))
+            usernames.extend(response.usernames)
+            cursor = response.next_cursor
+            if not cursor:
+                messagebox.showinfo("Accounts", "\n".join(usernames))
+                return
+            if not messagebox.askyesno("Accounts", "\n".join(usernames) + "\n\nShow more?"):
+                return
+
+    def search_accounts(self):
+        """Find accounts whose username contains the given text."""
+        query = simpledialog.askstring("Input", "Username contains:")
+        if not query:
+            return
+        response = self.stub.SearchAccounts(chat_pb2.SearchAccountsRequest(query=query, substring=True))
+        messagebox.showinfo("Accounts", "\n".join(response.usernames) or "No matching accounts")
 
     def delete_message(self):
         """Delete Most recent message, given the recipient."""
@@ -0,0 +1,57 @@
+"""
+Snowflake-style 64-bit message ids, generated in memory.
+
+    | 41 bits: ms since EPOCH_MS | 10 bits: node id | 12 bits: sequence |
+
+Ids from one generator strictly increase, so they sort in send order, and ids
+from generators with different node ids never collide.
+"""
+import threading
+import time
+
+EPOCH_MS = 1735689600000  # 2025-01-01 00:00:00 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class IdGenerator:
+    """Thread-safe id generator for one node."""
+    def __init__(self, node_id=0, clock=time.time):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"node id must be between 0 and {MAX_NODE_ID}")
+        self.node_id = node_id
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.last_ms = -1
+        self.sequence = 0
+
+    def next_id(self):
+        with self.lock:
+            now = int(self.clock() * 1000) - EPOCH_MS
+            if now <= self.last_ms:
+                # same millisecond, or the clock went backwards: keep counting on the last
+                # timestamp, and borrow the next millisecond when its sequence runs out
+                now = self.last_ms
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now
+            return (now << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self.sequence
+
+
+def timestamp_ms(message_id):
+    """Unix time in milliseconds at which `message_id` was generated."""
+    return (message_id >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_MS
+
+
+def first_id(timestamp_ms):
+    """The smallest id that can be generated at or after Unix time `timestamp_ms`."""
+    return max(timestamp_ms - EPOCH_MS, 0) << (NODE_BITS + SEQUENCE_BITS)
+
+
+def node_id(message_id):
+    return (message_id >> SEQUENCE_BITS) & MAX_NODE_ID
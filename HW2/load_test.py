@@ -0,0 +1,216 @@
+"""
+Load test for the chat server.
+
+Starts server.py once for every combination of the swept server settings. It drives each
+server with SendMessage and ReadMessages calls at several concurrency levels and prints
+throughput and latency percentiles for each run. Plotting the rows gives a throughput/
+latency curve per setting:
+
+    python load_test.py --workers 4 10 32 --concurrency 1 8 32 128 --listeners 200 --csv results.csv
+    python load_test.py --processes 1 2 4 8 --connections 16 --concurrency 64 256
+
+Every server gets a fresh database in a temporary directory. The load comes from one
+grpc.aio client in this process, and the server runs in a process of its own. The client
+opens `--connections` separate connections, because a sharded server (`--processes`)
+hands out whole connections to its workers. Each account sticks to the connection it
+logged in on, as a real client's channel would.
+"""
+import argparse
+import asyncio
+import collections
+import csv
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+from tokens import TOKEN_METADATA_KEY
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+SERVER_ARGS = []
+PASSWORD = "load-test"
+COLUMNS = ["processes", "workers", "stream_workers", "max_concurrent_rpcs", "message_bytes", "listeners", "concurrency",
+           "calls", "errors", "calls_per_sec", "p50_ms", "p90_ms", "p99_ms"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port, processes, workers, stream_workers, max_concurrent_rpcs):
+    command = [sys.executable, SERVER, "--port", str(port), *SERVER_ARGS, "--processes", str(processes),
+               "--workers", str(workers), "--stream-workers", str(stream_workers),
+               "--max-concurrent-rpcs", str(max_concurrent_rpcs),
+               # the server refuses a bcrypt queue as long as the worker pool
+               "--hash-queue", str(min(4, workers - 1))]
+    return subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Session:
+    def __init__(self, stub, username, token):
+        # the connection the account logged in on, and keeps using
+        self.stub = stub
+        self.username = username
+        self.metadata = ((TOKEN_METADATA_KEY, token),)
+
+
+async def login(stub, username):
+    while True:
+        response = await stub.Login(chat_pb2.LoginRequest(username=username, password=PASSWORD))
+        if response.status == "success":
+            return Session(stub, username, response.token)
+        # a full bcrypt queue says "busy"; anything else is a real failure
+        if "busy" not in response.message.lower():
+            raise RuntimeError(f"login failed for {username}: {response.message}")
+        await asyncio.sleep(0.05)
+
+
+async def login_all(stubs, usernames, parallel=2):
+    slots = asyncio.Semaphore(parallel)
+
+    async def one(stub, username):
+        async with slots:
+            return await login(stub, username)
+
+    return await asyncio.gather(*(one(stubs[i % len(stubs)], username) for i, username in enumerate(usernames)))
+
+
+async def drain(call):
+    try:
+        async for _ in call:
+            pass
+    except grpc.RpcError:
+        pass
+
+
+async def drive(senders, recipients, concurrency, duration, read_fraction, payload):
+    """Keeps `concurrency` calls in flight for `duration` seconds. Returns latencies and error counts."""
+    latencies, errors = [], collections.Counter()
+    deadline = time.perf_counter() + duration
+
+    async def caller(rng):
+        while time.perf_counter() < deadline:
+            sender = rng.choice(senders)
+            started = time.perf_counter()
+            try:
+                if rng.random() < read_fraction:
+                    await sender.stub.ReadMessages(chat_pb2.ReadMessagesRequest(username=sender.username, limit=10),
+                                                   metadata=sender.metadata)
+                else:
+                    request = chat_pb2.SendMessageRequest(username=sender.username, recipient=rng.choice(recipients), message=payload)
+                    await sender.stub.SendMessage(request, metadata=sender.metadata)
+            except grpc.RpcError as e:
+                errors[e.code().name] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(caller(random.Random(i)) for i in range(concurrency)))
+    return latencies, errors
+
+
+async def run_server_settings(args, processes, workers, stream_workers, max_concurrent_rpcs, writer):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(directory, port, processes, workers, stream_workers, max_concurrent_rpcs)
+        # without a local subchannel pool, channels to one address share a connection
+        channels = [grpc.aio.insecure_channel(f"127.0.0.1:{port}", options=[("grpc.use_local_subchannel_pool", 1)])
+                    for _ in range(args.connections)]
+        try:
+            for channel in channels:
+                await asyncio.wait_for(channel.channel_ready(), 30)
+            stubs = [chat_pb2_grpc.ChatServiceStub(channel) for channel in channels]
+            senders = await login_all(stubs, [f"user{i}" for i in range(args.users)])
+            listeners = await login_all(stubs, [f"listener{i}" for i in range(args.listeners)])
+            streams = [asyncio.ensure_future(drain(listener.stub.ListenForMessages(
+                chat_pb2.ListenForMessagesRequest(username=listener.username), metadata=listener.metadata)))
+                for listener in listeners]
+            recipients = [session.username for session in senders + listeners]
+
+            for message_bytes, concurrency in itertools.product(args.message_bytes, args.concurrency):
+                payload = "x" * message_bytes
+                await drive(senders, recipients, concurrency, args.warmup, args.read_fraction, payload)
+                latencies, errors = await drive(senders, recipients, concurrency, args.duration, args.read_fraction, payload)
+                latencies.sort()
+                row = dict(processes=processes, workers=workers, stream_workers=stream_workers, max_concurrent_rpcs=max_concurrent_rpcs,
+                           message_bytes=message_bytes, listeners=args.listeners, concurrency=concurrency,
+                           calls=len(latencies), errors=sum(errors.values()),
+                           calls_per_sec=round(len(latencies) / args.duration, 1),
+                           p50_ms=round(percentile(latencies, 0.50) * 1000, 2),
+                           p90_ms=round(percentile(latencies, 0.90) * 1000, 2),
+                           p99_ms=round(percentile(latencies, 0.99) * 1000, 2))
+                writer(row, errors)
+
+            for stream in streams:
+                stream.cancel()
+        finally:
+            for channel in channels:
+                await channel.close()
+            server.terminate()
+            server.wait()
+
+
+def table_writer(csv_file):
+    widths = [max(len(column), 8) for column in COLUMNS]
+    print("  ".join(column.rjust(width) for column, width in zip(COLUMNS, widths)), flush=True)
+    csv_writer = None
+    if csv_file is not None:
+        csv_writer = csv.DictWriter(csv_file, COLUMNS)
+        csv_writer.writeheader()
+
+    def write(row, errors):
+        line = "  ".join(str(row[column]).rjust(width) for column, width in zip(COLUMNS, widths))
+        if errors:
+            line += "  " + ", ".join(f"{code}={count}" for code, count in errors.most_common())
+        print(line, flush=True)
+        if csv_writer is not None:
+            csv_writer.writerow(row)
+            csv_file.flush()
+
+    return write
+
+
+async def main(args):
+    csv_file = open(args.csv, "w", newline="") if args.csv else None
+    try:
+        writer = table_writer(csv_file)
+        for settings in itertools.product(args.processes, args.workers, args.stream_workers, args.max_concurrent_rpcs):
+            await run_server_settings(args, *settings, writer)
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep server settings and report throughput and latency")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1], help="Worker process counts to try")
+    parser.add_argument('--workers', type=int, nargs='+', default=[10], help="Unary worker counts to try (at least 2)")
+    parser.add_argument('--stream-workers', type=int, nargs='+', default=[4], help="StreamHistory worker counts to try")
+    parser.add_argument('--max-concurrent-rpcs', type=int, nargs='+', default=[0], help="Concurrency limits to try; 0 means none")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64], help="Calls kept in flight by the client")
+    parser.add_argument('--message-bytes', type=int, nargs='+', default=[64], help="Message sizes to send")
+    parser.add_argument('--connections', type=int, default=4, help="Client connections the load is spread over")
+    parser.add_argument('--users', type=int, default=16, help="Accounts sending and reading")
+    parser.add_argument('--listeners', type=int, default=0, help="Extra accounts holding ListenForMessages open; each costs one bcrypt login")
+    parser.add_argument('--read-fraction', type=float, default=0.2, help="Share of calls that are ReadMessages rather than SendMessage")
+    parser.add_argument('--duration', type=float, default=5, help="Seconds measured per row")
+    parser.add_argument('--warmup', type=float, default=1, help="Seconds of unmeasured load before each row")
+    parser.add_argument('--csv', help="Also write the rows to this CSV file")
+    args = parser.parse_args()
+    if min(args.workers) < 2:
+        parser.error("--workers must be at least 2, to leave room for a bcrypt queue")
+
+    asyncio.run(main(args))
@@ -1,53 +1,168 @@
+import asyncio
+import multiprocessing
 import grpc
 from concurrent import futures
-import time
 import chat_pb2
 import chat_pb2_grpc
-from storage import Storage
+from storage import DEFAULT_HISTORY_BATCH, MAX_HISTORY_BATCH, Storage, encode_cursor, history_bounds
+from idgen import IdGenerator, MAX_NODE_ID
+from auth import PasswordHasher
+from tokens import AsyncTokenAuthInterceptor, SessionTokens, token_digest, token_from_context
+from mailboxes import DEFAULT_MAILBOX_SIZE, Mailbox, MailboxClosed
+from serverconfig import ServerConfig, StreamExecutorInterceptor, add_server_arguments
+from bus import Bus
 import queue
-from queue import Queue
+import signal
 import sys
+import threading
+
+# a history chunk is sent once it holds this many bytes, well inside the 64 KiB initial
+# HTTP/2 flow-control window, so one chunk never has to wait for a window update halfway
+HISTORY_CHUNK_BYTES = 32 * 1024
 
 class ChatService(chat_pb2_grpc.ChatServiceServicer):
-    def __init__(self):
-        self.storage = Storage("data.db")
-        self.online_users = {}  # username -> queue of messages
+    def __init__(self, hasher=None, tokens=None, mailbox_size=DEFAULT_MAILBOX_SIZE, node_id=0, bus=None):
+        # ids are assigned here so the pushed message and the stored one share it; the
+        # worker processes of a sharded server each have their own node id
+        self.ids = IdGenerator(node_id)
+        self.storage = Storage("data.db", ids=self.ids, hasher=hasher)
+        self.online_users = {}  # username -> Mailbox of messages to push
+        self.mailbox_size = mailbox_size
+        self.online_lock = threading.Lock()
+        # session token -> username, checked by TokenAuthInterceptor before every other call
+        self.tokens = tokens if tokens is not None else SessionTokens()
+        # connects the worker processes of a sharded server; None for a single process
+        self.bus = bus
+        self.presence = {}  # username -> worker holding their mailbox, for users online on other workers
+
+    def share(self, kind, *args):
+        """Tells the other worker processes, if any, about a change they have to mirror."""
+        if self.bus is not None:
+            self.bus.broadcast(kind, *args)
+
+    def handle_bus_event(self, kind, *args):
+        """Applies an event shared by another worker process."""
+        if kind == "online":
+            username, digest, worker = args
+            self.tokens.add(digest, username, self.tokens.clock() + self.tokens.ttl)
+            self.storage.accounts.add(username)
+            # the user logged in again over there, which ends a listener here
+            self.unsubscribe(username)
+            self.presence[username] = worker
+        elif kind == "offline":
+            username, worker = args
+            if self.presence.get(username) == worker:
+                del self.presence[username]
+        elif kind == "deliver":
+            message_id, sender, recipient, message = args
+            mailbox = self.online_users.get(recipient)
+            try:
+                if mailbox is None:
+                    raise queue.Full
+                mailbox.put(chat_pb2.Message(id=message_id, sender=sender, message=message))
+            except queue.Full:
+                self.storage.mark_unread([message_id])
+        elif kind == "revoke":
+            self.tokens.discard(*args)
+        elif kind == "delete_account":
+            username, = args
+            self.tokens.revoke_user(username)
+            self.storage.accounts.remove(username)
+            self.presence.pop(username, None)
+            self.unsubscribe(username)
 
     def Login(self, request, context):
         response = self.storage.login_register_user(request.username, request.password)
         if response["status"] == "success":
-            self.online_users[request.username] = queue.Queue()
+            self.subscribe(request.username)
+            token = self.tokens.issue(request.username)
+            self.share("online", request.username, token_digest(token), self.ids.node_id)
+            return chat_pb2.Response(status="success", message=response.get("message", ""), token=token)
         return chat_pb2.Response(status=response["status"], message=response.get("message", ""))
     
+    def subscribe(self, username):
+        """Gives the user a fresh mailbox, ending the stream of any listener still on the old one."""
+        mailbox = Mailbox(self.mailbox_size)
+        with self.online_lock:
+            old, self.online_users[username] = self.online_users.get(username), mailbox
+            self.presence.pop(username, None)
+        if old is not None:
+            self.close_mailbox(old)
+
+    def unsubscribe(self, username, mailbox=None, undelivered=()):
+        """
+        Takes the user offline, or only `mailbox` if given and still theirs. Closing the
+        mailbox ends its ListenForMessages stream, and messages pushed to it but never
+        sent are put back to unread. Returns whether the user went offline.
+        """
+        offline = False
+        with self.online_lock:
+            if mailbox is None:
+                mailbox = self.online_users.pop(username, None)
+                offline = mailbox is not None
+            elif self.online_users.get(username) is mailbox:
+                del self.online_users[username]
+                offline = True
+        if mailbox is not None:
+            self.close_mailbox(mailbox, undelivered)
+        return offline
+
+    def close_mailbox(self, mailbox, undelivered=()):
+        leftovers = list(undelivered) + mailbox.close()
+        if leftovers:
+            self.storage.mark_unread([message.id for message in leftovers])
+
     def Logout(self, request, context):
-        self.online_users.pop(request.username, None)
+        if self.unsubscribe(request.username):
+            self.share("offline", request.username, self.ids.node_id)
+        token = token_from_context(context)
+        if token:
+            self.tokens.revoke(token)
+            self.share("revoke", token_digest(token))
         return chat_pb2.Response(status="success", message="User logged out.")
 
     def SendMessage(self, request, context):
         sender = request.username
         recipient = request.recipient
         message = request.message
+        message_id = self.ids.next_id()
 
         # record message size (to compare with the wire protocol design)
         request_size = sys.getsizeof(request.SerializeToString())
         print(f"Received request size: {request_size} bytes")
 
 
-        if recipient in self.online_users and isinstance(self.online_users[recipient], Queue):
+        # stored before it is pushed, so a message left in a mailbox whose listener went
+        # away is already in the table and can be put back to unread
+        mailbox = self.online_users.get(recipient)
+        worker = self.presence.get(recipient) if mailbox is None else None
+        status = 'read' if mailbox is not None or worker is not None else 'unread'
+        stored = self.storage.send_message(sender, recipient, message, status=status, message_id=message_id)
+        if mailbox is not None and stored["status"] == "success":
             try:
-                self.online_users[recipient].put(chat_pb2.Message(id=int(time.time()), sender=sender, message=message))
+                mailbox.put(chat_pb2.Message(id=message_id, sender=sender, message=message))
                 print(f"Real-time message delivered to {recipient}")
-                self.storage.send_message(sender, recipient, message, status='read')
                 return chat_pb2.Response(status="success", message="Message delivered in real-time.")
             except queue.Full:
-                pass
+                # the listener is too far behind or already gone
+                self.storage.mark_unread([message_id])
+        elif worker is not None and stored["status"] == "success":
+            # the recipient is listening on another worker process, which pushes the
+            # message, or puts it back to unread if it can't
+            self.bus.send(worker, "deliver", message_id, sender, recipient, message)
+            return chat_pb2.Response(status="success", message="Message delivered in real-time.")
 
-        self.storage.send_message(sender, recipient, message)
         return chat_pb2.Response(status="success", message="Message stored for later delivery.")
 
     
     def ListAccounts(self, request, context):
-        response = self.storage.list_accounts(request.page_num)
+        response = self.storage.list_accounts(request.page_num, request.page_size, request.cursor)
+        if response["status"] != "success":
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, response["message"])
+        return chat_pb2.ListAccountsResponse(usernames=response["message"], next_cursor=response["next_cursor"])
+
+    def SearchAccounts(self, request, context):
+        response = self.storage.search_accounts(request.query, request.limit, request.substring)
         return chat_pb2.ListAccountsResponse(usernames=response["message"])
 
     def ReadMessages(self, request, context):
@@ -70,23 +185,54 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         )
 
 
-    def ListenForMessages(self, request, context):
-        """ Streams new messages in real-time using a Queue. """
-        username = request.username
-        if username not in self.online_users:
-            context.abort(grpc.StatusCode.NOT_FOUND, "User not logged in")
+    def StreamHistory(self, request, context):
+        """
+        Streams the messages sent to the user, oldest first, in chunks. gRPC asks for the next
+        chunk only once the last one has been sent, so a slow reader holds back the walk over
+        the table instead of letting chunks pile up in memory.
+        """
+        try:
+            after_id, before_id = history_bounds(request.after_id, request.before_id, request.since_ms, request.until_ms, request.resume_token)
+        except ValueError:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Invalid resume token")
+            return
+        chunk_size = min(max(request.chunk_size or DEFAULT_HISTORY_BATCH, 1), MAX_HISTORY_BATCH)
 
-        q = self.online_users[username]
+        messages, size = [], 0
+        for row in self.storage.iter_history(request.username, after_id, before_id, chunk_size):
+            message = chat_pb2.Message(id=row["id"], sender=row["sender"], message=row["message"])
+            messages.append(message)
+            size += message.ByteSize()
+            if len(messages) == chunk_size or size >= HISTORY_CHUNK_BYTES:
+                yield chat_pb2.HistoryChunk(messages=messages, resume_token=encode_cursor(str(message.id)))
+                messages, size = [], 0
+        if messages:
+            yield chat_pb2.HistoryChunk(messages=messages, resume_token=encode_cursor(str(messages[-1].id)))
 
-        while True:
-            try:
-                message = q.get(timeout=10) 
+    async def ListenForMessages(self, request, context):
+        """
+        Streams new messages in real-time. This runs on the event loop rather than the worker
+        pool: waiting for the next message parks a coroutine, not a thread, so online users
+        don't use up the workers that serve every other call.
+        """
+        mailbox = self.online_users.get(request.username)
+        if mailbox is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, "User not logged in")
+            return
+
+        # gRPC cancels this coroutine when the client goes away, which ends up in the finally
+        message = None
+        try:
+            while True:
+                message = await mailbox.get()
                 yield message
-            except queue.Empty:
-                pass  # Continue waiting for new messages
-            except grpc.RpcError:
-                del self.online_users[username]  # Remove disconnected users
-                break
+                # the next message is only asked for once this one has been written
+                message = None
+        except MailboxClosed:
+            pass
+        finally:
+            if self.unsubscribe(request.username, mailbox, [message] if message is not None else []):
+                self.share("offline", request.username, self.ids.node_id)
 
     def DeleteMessage(self, request, context):
         response = self.storage.delete_message(request.username, request.recipient)
@@ -95,20 +241,104 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
     def DeleteAccount(self, request, context):
         response = self.storage.delete_account(request.username, request.password)
         if response["status"] == "success":
-            self.online_users.pop(request.username, None)  # Remove from online users
+            self.unsubscribe(request.username)  # Remove from online users
+            self.tokens.revoke_user(request.username)
+            self.share("delete_account", request.username)
         return chat_pb2.Response(status=response["status"], message=response.get("message", ""))
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), server)
-    server.add_insecure_port("0.0.0.0:50051")
-    print("Starting gRPC server on port 50051...")
-    server.start()
+def create_server(service, config=None):
+    """
+    A grpc.aio server for `service`, set up from a ServerConfig; call it from a running event
+    loop. Unary handlers run on `config.workers` threads, StreamHistory on its own
+    `config.stream_workers`, and ListenForMessages on the loop itself.
+    """
+    config = config or ServerConfig()
+    interceptors = [AsyncTokenAuthInterceptor(service.tokens)]
+    if config.stream_workers:
+        interceptors.append(StreamExecutorInterceptor(futures.ThreadPoolExecutor(max_workers=config.stream_workers)))
+    server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=config.workers),
+                             interceptors=interceptors,
+                             options=config.options(),
+                             maximum_concurrent_rpcs=config.max_concurrent_rpcs)
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+    return server
+
+async def run_server(service, address, config=None):
+    server = create_server(service, config)
+    server.add_insecure_port(address)
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+
+def run_worker(settings, index=0, inboxes=None):
+    """Runs one server process; with `inboxes`, it is worker `index` of a sharded server."""
+    bus = Bus(inboxes, index) if inboxes is not None else None
+    # keep hash_queue below config.workers, so logins can never take up every gRPC worker
+    hasher = PasswordHasher(workers=settings["hash_workers"], max_pending=settings["hash_queue"], cache_ttl=settings["credential_ttl"])
+    service = ChatService(hasher, SessionTokens(ttl=settings["session_ttl"]), settings["mailbox_size"], node_id=index, bus=bus)
+    if bus is not None:
+        bus.start(service.handle_bus_event)
+    try:
+        asyncio.run(run_server(service, settings["address"], settings["config"]))
+    except KeyboardInterrupt:
+        pass
+
+def run_sharded(processes, settings):
+    """
+    Runs `processes` worker processes on one port. The kernel spreads incoming connections
+    over them (SO_REUSEPORT), and a Bus carries presence, sessions and messages between them.
+    """
+    # spawn rather than fork: gRPC's threads and sockets don't survive a fork
+    context = multiprocessing.get_context("spawn")
+    inboxes = [context.Queue() for _ in range(processes)]
+    workers = [context.Process(target=run_worker, args=(settings, index, inboxes), name=f"chat-worker-{index}")
+               for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    # a plain kill of the parent must not leave the workers holding the port
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
-        while True:
-            time.sleep(86400)
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+def serve(hash_workers=2, hash_queue=4, credential_ttl=300, session_ttl=3600, mailbox_size=DEFAULT_MAILBOX_SIZE,
+          host="0.0.0.0", port=50051, config=None, processes=1):
+    config = config or ServerConfig()
+    config.reuse_port = processes > 1
+    settings = dict(hash_workers=hash_workers, hash_queue=hash_queue, credential_ttl=credential_ttl, session_ttl=session_ttl,
+                    mailbox_size=mailbox_size, address=f"{host}:{port}", config=config)
+    print(f"Starting gRPC server on port {port}" + (f" with {processes} processes" if processes > 1 else "") + "...")
+    try:
+        if processes > 1:
+            run_sharded(processes, settings)
+        else:
+            run_worker(settings)
     except KeyboardInterrupt:
-        server.stop(0)
+        pass
 
 if __name__ == "__main__":
-    serve()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default="0.0.0.0", help="Address to listen on")
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes sharing the port")
+    parser.add_argument('--hash-workers', type=int, default=2, help="Threads running bcrypt")
+    parser.add_argument('--hash-queue', type=int, default=4, help="Logins allowed to wait for bcrypt before new ones are refused")
+    parser.add_argument('--credential-ttl', type=int, default=300, help="Seconds a verified login is remembered; 0 disables")
+    parser.add_argument('--session-ttl', type=int, default=3600, help="Seconds an unused session token stays valid")
+    parser.add_argument('--mailbox-size', type=int, default=DEFAULT_MAILBOX_SIZE, help="Messages queued for an online user before the rest are left unread")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    if args.hash_queue >= args.workers:
+        parser.error("--hash-queue must be below --workers, or waiting logins can hold every worker")
+    if not 1 <= args.processes <= MAX_NODE_ID + 1:
+        parser.error(f"--processes must be between 1 and {MAX_NODE_ID + 1}")
+
+    serve(hash_workers=args.hash_workers, hash_queue=args.hash_queue, credential_ttl=args.credential_ttl, session_ttl=args.session_ttl,
+          mailbox_size=args.mailbox_size, host=args.host, port=args.port, config=ServerConfig.from_args(args),
+          processes=args.processes)
@@ -0,0 +1,78 @@
+import threading
+import pytest
+import bcrypt
+from unittest.mock import patch
+from auth import CredentialCache, Overloaded, PasswordHasher
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, max_pending=1, cache_ttl=60)
+    yield hasher
+    hasher.shutdown()
+
+def test_hash_and_check(hasher):
+    password_hash = hasher.hash("secret")
+    assert hasher.check("alice", "secret", password_hash)
+    assert not hasher.check("alice", "wrong", password_hash)
+
+def test_cached_login_skips_bcrypt(hasher):
+    password_hash = hasher.hash("secret")
+    assert hasher.check("alice", "secret", password_hash)
+    with patch("auth.bcrypt.checkpw") as checkpw:
+        assert hasher.check("alice", "secret", password_hash)
+        checkpw.assert_not_called()
+        # a wrong password is never served from the cache
+        checkpw.return_value = False
+        assert not hasher.check("alice", "wrong", password_hash)
+
+def test_cache_entry_stops_matching_when_hash_changes():
+    cache = CredentialCache(ttl=60)
+    cache.put("alice", "secret", b"old-hash")
+    assert cache.get("alice", "secret", b"old-hash")
+    assert not cache.get("alice", "secret", b"new-hash")
+    assert not cache.get("alice", "secret", b"old-hash")
+
+def test_cache_expires_and_is_bounded():
+    cache = CredentialCache(ttl=0)
+    cache.put("alice", "secret", b"hash")
+    assert not cache.get("alice", "secret", b"hash")
+
+    cache = CredentialCache(ttl=60, max_entries=2)
+    for name in ("a", "b", "c"):
+        cache.put(name, "pw", b"hash")
+    assert len(cache.entries) == 2
+    assert not cache.get("a", "pw", b"hash")
+
+def test_cache_does_not_keep_passwords():
+    cache = CredentialCache(ttl=60)
+    cache.put("alice", "secret", b"hash")
+    assert all(b"secret" not in key for key in cache.entries)
+
+def test_overloaded_when_queue_full(hasher):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_hashpw(password, salt):
+        started.set()
+        release.wait(5)
+        return b"hash"
+
+    with patch("auth.bcrypt.hashpw", side_effect=slow_hashpw):
+        worker = threading.Thread(target=hasher.hash, args=("secret",))
+        worker.start()
+        started.wait(5)
+        with pytest.raises(Overloaded):
+            hasher.hash("other")
+        release.set()
+        worker.join()
+    # the slot is free again
+    assert hasher.check("alice", "secret", bcrypt.hashpw(b"secret", bcrypt.gensalt()))
+
+def test_storage_reports_busy(tmp_path):
+    from storage import Storage
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    storage = Storage(str(tmp_path / "busy.db"), hasher=hasher)
+    with patch.object(hasher, "hash", side_effect=Overloaded):
+        result = storage.login_register_user("alice", "secret")
+    assert result == {"status": "error", "message": "Server busy, please try again"}
+    hasher.shutdown()
@@ -0,0 +1,101 @@
+import os
+import queue
+import time
+import pytest
+import chat_pb2
+from bus import Bus
+from server import ChatService
+from tokens import TOKEN_METADATA_KEY
+
+class MockContext:
+    def __init__(self, token=None):
+        self.metadata = [(TOKEN_METADATA_KEY, token)] if token else []
+
+    def invocation_metadata(self):
+        return self.metadata
+
+    def abort(self, code, details):
+        raise AssertionError(details)
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "bus event never arrived"
+        time.sleep(0.01)
+
+@pytest.fixture
+def workers():
+    """Two services on one database, connected the way the processes of a sharded server are"""
+    if os.path.exists("data.db"):
+        os.remove("data.db")
+    inboxes = [queue.Queue(), queue.Queue()]
+    services = []
+    for index in range(2):
+        service = ChatService(node_id=index, bus=Bus(inboxes, index))
+        service.bus.start(service.handle_bus_event)
+        services.append(service)
+    return services
+
+def login(service, username):
+    response = service.Login(chat_pb2.LoginRequest(username=username, password="pw"), MockContext())
+    assert response.status == "success"
+    return response.token
+
+def test_broadcast_skips_the_sender():
+    inboxes = [queue.Queue(), queue.Queue(), queue.Queue()]
+    Bus(inboxes, 1).broadcast("offline", "alice", 1)
+    assert inboxes[0].get_nowait() == ("offline", ("alice", 1))
+    assert inboxes[2].get_nowait() == ("offline", ("alice", 1))
+    assert inboxes[1].empty()
+
+def test_send_reaches_one_worker():
+    inboxes = [queue.Queue(), queue.Queue()]
+    Bus(inboxes, 0).send(1, "revoke", "token")
+    assert inboxes[1].get_nowait() == ("revoke", ("token",))
+    assert inboxes[0].empty()
+
+def test_login_is_shared(workers):
+    a, b = workers
+    token = login(a, "alice")
+    wait_for(lambda: b.presence.get("alice") == 0)
+    assert b.tokens.lookup(token) == "alice"
+    assert b.storage.search_accounts("ali")["message"] == ["alice"]
+
+def test_message_reaches_listener_on_other_worker(workers):
+    a, b = workers
+    login(a, "bob")
+    login(b, "alice")
+    wait_for(lambda: "bob" in b.presence)
+    response = b.SendMessage(chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hi"), MockContext())
+    assert response.status == "success"
+    wait_for(lambda: len(a.online_users["bob"]) == 1)
+    pushed = a.online_users["bob"].get_nowait()
+    assert pushed.message == "hi"
+    # stored as read once, by the sending worker, with the id the listener saw
+    assert b.storage.read_messages("bob", 10)["status"] == "error"
+
+def test_logout_on_other_worker_clears_presence_and_session(workers):
+    a, b = workers
+    token = login(a, "bob")
+    wait_for(lambda: "bob" in b.presence)
+    a.Logout(chat_pb2.LogoutRequest(username="bob"), MockContext(token))
+    wait_for(lambda: "bob" not in b.presence and b.tokens.lookup(token) is None)
+
+def test_delivery_after_listener_left_stays_unread(workers):
+    a, b = workers
+    login(a, "bob")
+    login(b, "alice")
+    wait_for(lambda: "bob" in b.presence)
+    # bob's listener goes away before the message crosses the bus
+    a.unsubscribe("bob")
+    b.SendMessage(chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="late"), MockContext())
+    wait_for(lambda: b.storage.read_messages("bob", 10)["status"] == "success")
+
+def test_login_elsewhere_ends_old_listener(workers):
+    a, b = workers
+    login(a, "bob")
+    mailbox = a.online_users["bob"]
+    login(b, "bob")
+    wait_for(lambda: mailbox.closed)
+    assert "bob" not in a.online_users
+    assert a.presence["bob"] == 1
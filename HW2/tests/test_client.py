@@ -7,9 +7,11 @@ from client import run
 from argparse import Namespace
 
 class MockResponse:
-    def __init__(self, status="success", message="", usernames=None, messages=None):
+    def __init__(self, status="success", message="", usernames=None, messages=None, token="", next_cursor=""):
         self.status = status
         self.message = message
+        self.token = token
+        self.next_cursor = next_cursor
         self.usernames = usernames or []
         self.messages = messages or []
 
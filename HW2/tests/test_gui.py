@@ -8,9 +8,11 @@ from argparse import Namespace
 
 class MockResponse:
     """Mock gRPC response object"""
-    def __init__(self, status="success", message="", usernames=None, messages=None):
+    def __init__(self, status="success", message="", usernames=None, messages=None, token="", next_cursor=""):
         self.status = status
         self.message = message
+        self.token = token
+        self.next_cursor = next_cursor
         self.usernames = usernames or []
         self.messages = messages or []
 
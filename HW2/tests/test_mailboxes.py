@@ -0,0 +1,77 @@
+import asyncio
+import queue
+import threading
+import pytest
+from mailboxes import Mailbox, MailboxClosed
+
+def test_get_nowait():
+    mailbox = Mailbox()
+    mailbox.put("a")
+    mailbox.put("b")
+    assert len(mailbox) == 2
+    assert mailbox.get_nowait() == "a"
+    assert mailbox.get_nowait() == "b"
+    with pytest.raises(queue.Empty):
+        mailbox.get_nowait()
+
+def test_put_from_another_thread_wakes_the_listener():
+    mailbox = Mailbox()
+
+    async def listen():
+        received = asyncio.ensure_future(mailbox.get())
+        await asyncio.sleep(0.05)
+        assert not received.done()
+        threading.Thread(target=mailbox.put, args=("hello",)).start()
+        return await asyncio.wait_for(received, 5)
+
+    assert asyncio.run(listen()) == "hello"
+    assert mailbox.waiter is None
+
+def test_cancelled_listener_is_forgotten():
+    mailbox = Mailbox()
+
+    async def listen():
+        received = asyncio.ensure_future(mailbox.get())
+        await asyncio.sleep(0.05)
+        received.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(listen())
+    assert mailbox.waiter is None
+    # the loop is closed by now; putting must not try to wake it
+    mailbox.put("later")
+    assert mailbox.get_nowait() == "later"
+
+def test_full_mailbox_refuses_messages():
+    mailbox = Mailbox(maxsize=2)
+    mailbox.put("a")
+    mailbox.put("b")
+    with pytest.raises(queue.Full):
+        mailbox.put("c")
+    mailbox.get_nowait()
+    mailbox.put("c")
+
+def test_close_returns_leftovers_and_ends_the_wait():
+    mailbox = Mailbox()
+    mailbox.put("a")
+    assert mailbox.close() == ["a"]
+    with pytest.raises(queue.Full):
+        mailbox.put("b")
+
+    async def listen():
+        await mailbox.get()
+
+    with pytest.raises(MailboxClosed):
+        asyncio.run(listen())
+
+def test_close_wakes_a_waiting_listener():
+    mailbox = Mailbox()
+
+    async def listen():
+        waiting = asyncio.ensure_future(mailbox.get())
+        await asyncio.sleep(0.05)
+        threading.Thread(target=mailbox.close).start()
+        with pytest.raises(MailboxClosed):
+            await asyncio.wait_for(waiting, 5)
+
+    asyncio.run(listen())
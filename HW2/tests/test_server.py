@@ -1,8 +1,12 @@
+import asyncio
 import pytest
 import grpc
 import chat_pb2
 import chat_pb2_grpc
-from server import ChatService
+from server import ChatService, create_server
+from serverconfig import ServerConfig
+from mailboxes import Mailbox
+from tokens import TokenClientInterceptor
 from concurrent import futures
 import threading
 import time
@@ -17,6 +21,10 @@ class MockContext:
         self.abort_code = None
         self.abort_details = None
         self._active = True
+        self.metadata = []
+
+    def invocation_metadata(self):
+        return self.metadata
 
     def abort(self, code, details):
         self.aborted = True
@@ -50,6 +58,7 @@ def test_login(service, context):
     response = service.Login(request, context)
     assert response.status == "success"
     assert "testuser" in service.online_users
+    assert service.tokens.lookup(response.token) == "testuser"
 
     # Test logging in again
     response = service.Login(request, context)
@@ -59,13 +68,15 @@ def test_logout(service, context):
     """Test Logout functionality"""
     # First login
     login_request = chat_pb2.LoginRequest(username="testuser", password="password123")
-    service.Login(login_request, context)
+    token = service.Login(login_request, context).token
 
     # Test logout
+    context.metadata = [("session-token", token)]
     request = chat_pb2.LogoutRequest(username="testuser")
     response = service.Logout(request, context)
     assert response.status == "success"
     assert "testuser" not in service.online_users
+    assert service.tokens.lookup(token) is None
 
 def test_list_accounts(service, context):
     """Test ListAccounts functionality"""
@@ -87,6 +98,35 @@ def test_list_accounts(service, context):
     
     assert len(response.usernames) > 0, "No users found after multiple attempts"
 
+def test_search_accounts(service, context):
+    """Test SearchAccounts functionality"""
+    for user in ("searcher", "research", "other"):
+        service.Login(chat_pb2.LoginRequest(username=user, password="password123"), context)
+    request = chat_pb2.SearchAccountsRequest(query="search", substring=True)
+    response = service.SearchAccounts(request, context)
+    assert list(response.usernames) == ["research", "searcher"]
+
+def test_stream_history(service, context):
+    """StreamHistory sends every message in order, in chunks, and resumes from a token"""
+    for user in ("chronicler", "historian"):
+        service.Login(chat_pb2.LoginRequest(username=user, password="pass"), context)
+    for i in range(7):
+        service.SendMessage(chat_pb2.SendMessageRequest(username="chronicler", recipient="historian", message=f"m{i}"), context)
+
+    request = chat_pb2.StreamHistoryRequest(username="historian", chunk_size=3)
+    chunks = list(service.StreamHistory(request, context))
+    assert [len(chunk.messages) for chunk in chunks][-3:] == [3, 3, 1]
+    messages = [msg.message for chunk in chunks for msg in chunk.messages]
+    assert messages[-7:] == [f"m{i}" for i in range(7)]
+
+    # pick up after the second-to-last chunk
+    request = chat_pb2.StreamHistoryRequest(username="historian", resume_token=chunks[-2].resume_token)
+    resumed = [msg.message for chunk in service.StreamHistory(request, context) for msg in chunk.messages]
+    assert resumed == ["m6"]
+
+    list(service.StreamHistory(chat_pb2.StreamHistoryRequest(username="historian", resume_token="???"), context))
+    assert context.abort_code == grpc.StatusCode.INVALID_ARGUMENT
+
 def test_send_message(service, context):
     """Test SendMessage functionality"""
     service.Login(chat_pb2.LoginRequest(username="sender", password="pass"), context)
@@ -179,40 +219,107 @@ def test_listen_for_messages(service, context):
         service.Login(chat_pb2.LoginRequest(username="listener", password="pass"), context)
         time.sleep(0.1)
 
-        # Create a list to store received messages
-        received_messages = []
+        async def listen_and_send():
+            listener = service.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="listener"), context)
+            received = asyncio.ensure_future(anext(listener))
+            await asyncio.sleep(0.1)
+            assert not received.done()
 
-        # Create a thread to simulate listening for messages
-        def listen_thread():
-            request = chat_pb2.ListenForMessagesRequest(username="listener")
-            try:
-                for message in service.ListenForMessages(request, context):
-                    received_messages.append(message)
-                    break
-            except Exception:
-                pass
+            # the server runs SendMessage on a worker thread
+            request = chat_pb2.SendMessageRequest(username="sender", recipient="listener", message="Real-time message")
+            await asyncio.to_thread(service.SendMessage, request, context)
+            message = await asyncio.wait_for(received, 5)
+            await listener.aclose()
+            return message
 
-        # Start listening thread
-        thread = threading.Thread(target=listen_thread)
-        thread.daemon = True
-        thread.start()
+        assert asyncio.run(listen_and_send()).message == "Real-time message"
+    except sqlite3.OperationalError:
+        pytest.skip("Skipping due to database lock")
 
-        time.sleep(0.1)
+def test_full_mailbox_leaves_messages_unread(service, context):
+    suffix = time.time_ns()
+    sender, recipient = f"sender{suffix}", f"slow{suffix}"
+    service.mailbox_size = 2
+    for user in (sender, recipient):
+        service.Login(chat_pb2.LoginRequest(username=user, password="pass"), context)
 
-        # Send a message
-        service.SendMessage(
-            chat_pb2.SendMessageRequest(
-                username="sender",
-                recipient="listener",
-                message="Real-time message"
-            ),
-            context
-        )
+    replies = [service.SendMessage(chat_pb2.SendMessageRequest(username=sender, recipient=recipient, message=f"m{i}"), context).message
+               for i in range(3)]
+    assert replies == ["Message delivered in real-time."] * 2 + ["Message stored for later delivery."]
+    assert len(service.online_users[recipient]) == 2
+    unread = service.ReadMessages(chat_pb2.ReadMessagesRequest(username=recipient, limit=10), context).messages
+    assert [msg.message for msg in unread] == ["m2"]
 
+def test_disconnected_listener_is_cleaned_up(service, context):
+    suffix = time.time_ns()
+    sender, recipient = f"sender{suffix}", f"gone{suffix}"
+    for user in (sender, recipient):
+        service.Login(chat_pb2.LoginRequest(username=user, password="pass"), context)
+
+    async def listen_then_disconnect():
+        listener = service.ListenForMessages(chat_pb2.ListenForMessagesRequest(username=recipient), context)
+        received = asyncio.ensure_future(anext(listener))
+        for i in range(3):
+            request = chat_pb2.SendMessageRequest(username=sender, recipient=recipient, message=f"m{i}")
+            await asyncio.to_thread(service.SendMessage, request, context)
+        await received
+        # the client goes away before the stream asks for the next message
+        await listener.aclose()
+
+    asyncio.run(listen_then_disconnect())
+    assert recipient not in service.online_users
+    # nothing was confirmed written, so all three wait in storage
+    unread = service.ReadMessages(chat_pb2.ReadMessagesRequest(username=recipient, limit=10), context).messages
+    assert sorted(msg.message for msg in unread) == ["m0", "m1", "m2"]
+    reply = service.SendMessage(chat_pb2.SendMessageRequest(username=sender, recipient=recipient, message="later"), context)
+    assert reply.message == "Message stored for later delivery."
+
+def test_logout_ends_the_stream(service, context):
+    service.Login(chat_pb2.LoginRequest(username="leaver", password="pass"), context)
+
+    async def listen():
+        return [message async for message in service.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="leaver"), context)]
+
+    async def listen_and_log_out():
+        listening = asyncio.ensure_future(listen())
+        await asyncio.sleep(0.05)
+        await asyncio.to_thread(service.Logout, chat_pb2.LogoutRequest(username="leaver"), context)
+        return await asyncio.wait_for(listening, 5)
+
+    assert asyncio.run(listen_and_log_out()) == []
+
+def test_listeners_do_not_hold_workers(service):
+    """With more listeners than worker threads, unary calls still go through."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def start():
+        server = create_server(service, ServerConfig(workers=2))
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        return server, port
+
+    server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    streams = []
+    try:
+        sender = service.tokens.issue("sender")
+        for i in range(20):
+            name = f"listener{i}"
+            service.storage.execute_query("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)", (name, b"x"), commit=True)
+            service.online_users[name] = Mailbox()
+            stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(channel, TokenClientInterceptor(lambda token=service.tokens.issue(name): token)))
+            streams.append(stub.ListenForMessages(chat_pb2.ListenForMessagesRequest(username=name)))
         time.sleep(0.2)
-        
-        if received_messages:
-            assert received_messages[0].message == "Real-time message"
-        
-    except sqlite3.OperationalError:
-        pytest.skip("Skipping due to database lock")
+
+        stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(channel, TokenClientInterceptor(lambda: sender)))
+        for i in range(20):
+            request = chat_pb2.SendMessageRequest(username="sender", recipient=f"listener{i}", message=f"hello {i}")
+            assert stub.SendMessage(request, timeout=5).status == "success"
+        assert [next(stream).message for stream in streams] == [f"hello {i}" for i in range(20)]
+    finally:
+        for stream in streams:
+            stream.cancel()
+        channel.close()
+        asyncio.run_coroutine_threadsafe(server.stop(0), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from argparse import ArgumentParser
+from concurrent import futures
+import grpc
+import pytest
+import chat_pb2
+import chat_pb2_grpc
+from serverconfig import ServerConfig, StreamExecutorInterceptor, add_server_arguments
+
+def test_options_from_the_command_line():
+    parser = ArgumentParser()
+    add_server_arguments(parser)
+    config = ServerConfig.from_args(parser.parse_args(["--workers", "32", "--keepalive-time", "30", "--max-message-bytes", "1024"]))
+    assert config.workers == 32
+    assert config.max_concurrent_rpcs is None
+    options = dict(config.options())
+    assert options["grpc.keepalive_time_ms"] == 30000
+    assert options["grpc.keepalive_timeout_ms"] == 20000
+    assert options["grpc.max_receive_message_length"] == 1024
+
+def test_keepalive_is_left_alone_by_default():
+    assert "grpc.keepalive_time_ms" not in dict(ServerConfig().options())
+
+
+class HistoryService(chat_pb2_grpc.ChatServiceServicer):
+    def StreamHistory(self, request, context):
+        if request.resume_token == "bad":
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Invalid resume token")
+            return
+        for i in range(3):
+            yield chat_pb2.HistoryChunk(resume_token=threading.current_thread().name)
+
+@pytest.fixture
+def history_stub():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def start():
+        executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="streams")
+        server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="unary"),
+                                 interceptors=[StreamExecutorInterceptor(executor)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(HistoryService(), server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        return server, port
+
+    server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    yield chat_pb2_grpc.ChatServiceStub(channel)
+    channel.close()
+    asyncio.run_coroutine_threadsafe(server.stop(0), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+def test_plain_streams_run_on_the_stream_executor(history_stub):
+    chunks = list(history_stub.StreamHistory(chat_pb2.StreamHistoryRequest(username="alice")))
+    assert len(chunks) == 3
+    assert all(chunk.resume_token.startswith("streams") for chunk in chunks)
+
+def test_abort_from_a_stream_thread_reaches_the_client(history_stub):
+    with pytest.raises(grpc.RpcError) as error:
+        list(history_stub.StreamHistory(chat_pb2.StreamHistoryRequest(username="alice", resume_token="bad")))
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+    assert error.value.details() == "Invalid resume token"
@@ -13,8 +13,10 @@ def storage():
         os.remove(test_db)
     storage = Storage(test_db)
     yield storage
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    # WAL mode leaves -wal and -shm files next to the database
+    for path in (test_db, test_db + "-wal", test_db + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
 
 def test_initialize_database(storage):
     """Test if database is properly initialized with required tables."""
@@ -69,6 +71,32 @@ def test_list_accounts(storage):
     assert result["status"] == "success"
     assert len(result["message"]) <= 5
 
+def test_list_accounts_with_cursor(storage):
+    """Following next_cursor walks every account exactly once, in order."""
+    names = [f"user{i:02d}" for i in range(12)]
+    storage.execute_query("DELETE FROM users", commit=True)
+    for name in reversed(names):
+        storage.execute_query("INSERT INTO users (username, password_hash) VALUES (?, 'x')", (name,), commit=True)
+
+    pages, cursor = [], None
+    while True:
+        result = storage.list_accounts(page_size=5, cursor=cursor)
+        pages.append(result["message"])
+        cursor = result["next_cursor"]
+        if not cursor:
+            break
+    assert pages == [names[:5], names[5:10], names[10:]]
+    assert storage.list_accounts(cursor="not base64!") == {"status": "error", "message": "Invalid cursor"}
+
+def test_search_accounts(storage):
+    """Search is served from the in-memory index and follows registrations and deletions."""
+    for name in ("alice", "alicia", "malice"):
+        storage.login_register_user(name, "password123")
+    assert storage.search_accounts("ali")["message"] == ["alice", "alicia"]
+    assert storage.search_accounts("lice", substring=True)["message"] == ["alice", "malice"]
+    storage.delete_account("alice", "password123")
+    assert storage.search_accounts("lice", substring=True)["message"] == ["malice"]
+
 def test_send_message(storage):
     """Test message sending functionality."""
     storage.login_register_user("sender", "password123")
@@ -83,6 +111,35 @@ def test_send_message(storage):
     assert result["status"] == "error"
     assert "Recipient does not exist" in result["message"]
 
+def test_existing_database_is_upgraded(tmp_path):
+    """A database created before migrations existed gets the indexes and keeps its data."""
+    from storage import MIGRATIONS
+    db_name = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE users (username TEXT PRIMARY KEY, password_hash BLOB)")
+    conn.execute("CREATE TABLE messages (id INT PRIMARY KEY, sender TEXT, recipient TEXT, message TEXT, status TEXT)")
+    conn.execute("INSERT INTO messages VALUES (1, 'sender', 'recipient', 'Hello', 'unread')")
+    conn.commit()
+    conn.close()
+
+    storage = Storage(db_name)
+    conn = sqlite3.connect(db_name)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {"messages_recipient_status", "messages_sender_recipient"} <= indexes
+    conn.close()
+    assert storage.read_messages("recipient")["messages"][0]["message"] == "Hello"
+
+def test_messages_sent_in_the_same_second_are_all_stored(storage):
+    """Message ids don't collide however fast messages are sent."""
+    storage.login_register_user("sender", "password123")
+    storage.login_register_user("recipient", "password123")
+    for i in range(20):
+        assert storage.send_message("sender", "recipient", f"Hello {i}")["status"] == "success"
+    result = storage.read_messages("recipient", limit=50)
+    assert len(result["messages"]) == 20
+    assert result["messages"][0]["message"] == "Hello 19"
+
 def test_read_messages(storage):
     """Test message reading functionality."""
     storage.login_register_user("sender", "password123")
@@ -109,6 +166,46 @@ def test_read_messages(storage):
     assert result["status"] == "error"
     assert result["messages"][0]["message"] == "No unread messages from other users"
 
+def test_mark_unread(storage):
+    """Messages pushed but never delivered go back to the unread queue."""
+    storage.login_register_user("sender", "password123")
+    storage.login_register_user("recipient", "password123")
+    storage.send_message("sender", "recipient", "pushed", status="read", message_id=1)
+    storage.send_message("sender", "recipient", "seen", status="read", message_id=2)
+
+    storage.mark_unread([1])
+    result = storage.read_messages("recipient", limit=10)
+    assert [msg["message"] for msg in result["messages"]] == ["pushed"]
+
+def test_concurrent_readers_get_each_message_once(storage):
+    """Concurrent read_messages calls must not return the same unread message twice."""
+    import threading
+
+    storage.login_register_user("sender", "password123")
+    storage.login_register_user("recipient", "password123")
+    for message_id in range(1, 51):
+        storage.execute_query(
+            "INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)",
+            (message_id, "sender", "recipient", f"Message {message_id}", "unread"),
+            commit=True
+        )
+
+    read_ids = []
+    def reader():
+        while True:
+            result = storage.read_messages("recipient", limit=3)
+            if result["status"] != "success":
+                break
+            read_ids.extend(message["id"] for message in result["messages"])
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(read_ids) == list(range(1, 51))
+
 def test_delete_message(storage):
     """Test message deletion functionality."""
     storage.login_register_user("sender", "password123")
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+from concurrent import futures
+import grpc
+import pytest
+import chat_pb2
+import chat_pb2_grpc
+from tokens import AsyncTokenAuthInterceptor, SessionTokens, TokenAuthInterceptor, TokenClientInterceptor, token_digest
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_lookup_and_revoke():
+    tokens = SessionTokens(ttl=60)
+    alice = tokens.issue("alice")
+    other = tokens.issue("alice")
+    bob = tokens.issue("bob")
+    assert alice != other
+    assert tokens.lookup(alice) == "alice"
+    assert tokens.lookup("made-up") is None
+
+    tokens.revoke(alice)
+    assert tokens.lookup(alice) is None
+    assert tokens.lookup(other) == "alice"
+
+    tokens.revoke_user("alice")
+    assert tokens.lookup(other) is None
+    assert tokens.lookup(bob) == "bob"
+    assert "alice" not in tokens.by_user
+
+def test_tokens_expire_unless_used():
+    clock = Clock()
+    tokens = SessionTokens(ttl=60, clock=clock)
+    used = tokens.issue("alice")
+    idle = tokens.issue("bob")
+
+    clock.now += 50
+    assert tokens.lookup(used) == "alice"
+    clock.now += 50
+    # the lookup 50 seconds in pushed alice's expiry back
+    assert tokens.lookup(used) == "alice"
+    assert tokens.lookup(idle) is None
+
+def test_expired_tokens_are_evicted_on_issue():
+    clock = Clock()
+    tokens = SessionTokens(ttl=60, clock=clock)
+    for name in ("a", "b", "c"):
+        tokens.issue(name)
+    clock.now += 61
+    tokens.issue("d")
+    assert len(tokens) == 1
+    assert list(tokens.by_user) == ["d"]
+
+def test_snapshot_and_replace():
+    tokens = SessionTokens(ttl=60)
+    token = tokens.issue("alice")
+    copy = SessionTokens(ttl=60)
+    copy.issue("stale")
+    copy.replace(tokens.snapshot())
+    assert copy.lookup(token) == "alice"
+    assert list(copy.by_user) == ["alice"]
+    # only the digest leaves the table, and it can't be used as a token
+    assert tokens.snapshot()[0][0] == token_digest(token)
+    assert copy.lookup(token_digest(token)) is None
+    copy.discard(token_digest(token))
+    assert copy.lookup(token) is None
+
+
+class EchoService(chat_pb2_grpc.ChatServiceServicer):
+    def Login(self, request, context):
+        return chat_pb2.Response(status="success")
+
+    def ReadMessages(self, request, context):
+        return chat_pb2.ReadMessagesResponse(status="success")
+
+    def ListenForMessages(self, request, context):
+        yield chat_pb2.Message(id=1, sender="bob", message="hi")
+
+@pytest.fixture
+def secured():
+    tokens = SessionTokens(ttl=60)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), interceptors=[TokenAuthInterceptor(tokens)])
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(EchoService(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    yield tokens, channel
+    channel.close()
+    server.stop(0)
+
+def stub_with(channel, token):
+    return chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(channel, TokenClientInterceptor(lambda: token)))
+
+def test_interceptor_requires_token(secured):
+    tokens, channel = secured
+    stub = stub_with(channel, None)
+    # Login is the one call that doesn't need a token
+    assert stub.Login(chat_pb2.LoginRequest(username="alice", password="pw")).status == "success"
+    with pytest.raises(grpc.RpcError) as error:
+        stub.ReadMessages(chat_pb2.ReadMessagesRequest(username="alice", limit=1))
+    assert error.value.code() == grpc.StatusCode.UNAUTHENTICATED
+
+    with pytest.raises(grpc.RpcError) as error:
+        list(stub_with(channel, "made-up").ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice")))
+    assert error.value.code() == grpc.StatusCode.UNAUTHENTICATED
+
+def test_interceptor_accepts_valid_token(secured):
+    tokens, channel = secured
+    stub = stub_with(channel, tokens.issue("alice"))
+    assert stub.ReadMessages(chat_pb2.ReadMessagesRequest(username="alice", limit=1)).status == "success"
+    messages = list(stub.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice")))
+    assert [message.message for message in messages] == ["hi"]
+
+def test_interceptor_rejects_other_users_name(secured):
+    tokens, channel = secured
+    stub = stub_with(channel, tokens.issue("mallory"))
+    with pytest.raises(grpc.RpcError) as error:
+        stub.ReadMessages(chat_pb2.ReadMessagesRequest(username="alice", limit=1))
+    assert error.value.code() == grpc.StatusCode.PERMISSION_DENIED
+
+
+class AsyncEchoService(EchoService):
+    async def ListenForMessages(self, request, context):
+        yield chat_pb2.Message(id=1, sender="bob", message="hi")
+
+@pytest.fixture
+def secured_aio():
+    tokens = SessionTokens(ttl=60)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def start():
+        server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=2),
+                                 interceptors=[AsyncTokenAuthInterceptor(tokens)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncEchoService(), server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        return server, port
+
+    server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    yield tokens, channel
+    channel.close()
+    asyncio.run_coroutine_threadsafe(server.stop(0), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+def test_async_interceptor_checks_sync_and_async_handlers(secured_aio):
+    tokens, channel = secured_aio
+    stub = stub_with(channel, tokens.issue("alice"))
+    assert stub.ReadMessages(chat_pb2.ReadMessagesRequest(username="alice", limit=1)).status == "success"
+    messages = list(stub.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice")))
+    assert [message.message for message in messages] == ["hi"]
+
+    with pytest.raises(grpc.RpcError) as error:
+        stub.ReadMessages(chat_pb2.ReadMessagesRequest(username="bob", limit=1))
+    assert error.value.code() == grpc.StatusCode.PERMISSION_DENIED
+    with pytest.raises(grpc.RpcError) as error:
+        list(stub.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="bob")))
+    assert error.value.code() == grpc.StatusCode.PERMISSION_DENIED
+
+    with pytest.raises(grpc.RpcError) as error:
+        list(stub_with(channel, None).ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice")))
+    assert error.value.code() == grpc.StatusCode.UNAUTHENTICATED
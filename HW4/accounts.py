@@ -0,0 +1,87 @@
+"""
+In-memory username index for account search.
+
+Usernames are kept in one sorted list, so a prefix search is a binary search followed by
+a short scan. Substring searches of three or more characters go through a trigram index
+and only look at the usernames that contain every trigram of the query.
+"""
+import bisect
+import threading
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class AccountIndex:
+    """Thread-safe sorted set of usernames. Load it once, then keep it in step with the users table."""
+    def __init__(self, usernames=(), substring=True):
+        self.names = sorted(set(usernames))
+        # trigram -> usernames containing it; None disables the trigram index
+        self.grams = {} if substring else None
+        self.lock = threading.Lock()
+        if self.grams is not None:
+            for name in self.names:
+                self._index(name)
+
+    def _index(self, name):
+        for gram in trigrams(name):
+            self.grams.setdefault(gram, set()).add(name)
+
+    def add(self, name):
+        with self.lock:
+            i = bisect.bisect_left(self.names, name)
+            if i < len(self.names) and self.names[i] == name:
+                return
+            self.names.insert(i, name)
+            if self.grams is not None:
+                self._index(name)
+
+    def remove(self, name):
+        with self.lock:
+            i = bisect.bisect_left(self.names, name)
+            if i == len(self.names) or self.names[i] != name:
+                return
+            del self.names[i]
+            if self.grams is not None:
+                for gram in trigrams(name):
+                    names = self.grams[gram]
+                    names.discard(name)
+                    if not names:
+                        del self.grams[gram]
+
+    def prefix(self, prefix, limit):
+        """Up to `limit` usernames starting with `prefix`, in order."""
+        with self.lock:
+            i = bisect.bisect_left(self.names, prefix)
+            matches = []
+            while i < len(self.names) and len(matches) < limit and self.names[i].startswith(prefix):
+                matches.append(self.names[i])
+                i += 1
+            return matches
+
+    def substring(self, text, limit):
+        """Up to `limit` usernames containing `text`, in order."""
+        with self.lock:
+            grams = trigrams(text)
+            if self.grams is None or not grams:
+                # too short for trigrams: scan, stopping once there are enough matches
+                candidates = self.names
+            else:
+                sets = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+                candidates = sorted(set.intersection(*sets))
+            matches = []
+            for name in candidates:
+                if text in name:
+                    matches.append(name)
+                    if len(matches) == limit:
+                        break
+            return matches
+
+    def __contains__(self, name):
+        with self.lock:
+            i = bisect.bisect_left(self.names, name)
+            return i < len(self.names) and self.names[i] == name
+
+    def __len__(self):
+        return len(self.names)
@@ -25,7 +25,7 @@ _sym_db = _symbol_database.Default()
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x1a\x1bgoogle/protobuf/empty.proto\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"!\n\rLogoutRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"\'\n\x13ListAccountsRequest\x12\x10\n\x08page_num\x18\x01 \x01(\x05\"9\n\x14ListAccountsResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x11\n\tusernames\x18\x02 \x03(\t\"J\n\x12SendMessageRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"6\n\x13ReadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\"B\n\x14ReadMessagesResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x1a\n\x08messages\x18\x02 \x03(\x0b\x32\x08.Message\"6\n\x07Message\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\";\n\x14\x44\x65leteMessageRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\":\n\x14\x44\x65leteAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\",\n\x18ListenForMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"G\n\x17ReplicateMessageRequest\x12\x19\n\x07message\x18\x01 \x01(\x0b\x32\x08.Message\x12\x11\n\trecipient\x18\x02 \x01(\t\"+\n\x08Response\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\t\"\x12\n\x10HeartbeatRequest\"H\n\x15LeaderElectionRequest\x12\x1c\n\x14requesting_server_id\x18\x01 \x01(\t\x12\x11\n\tleader_id\x18\x02 \x01(\t\"D\n\x0f\x45lectionRequest\x12\x19\n\x11\x63\x61ndidate_address\x18\x01 \x01(\t\x12\x16\n\x0e\x63\x61ndidate_port\x18\x02 \x01(\x05\"\"\n\x10\x45lectionResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\"0\n\x12\x43oordinatorMessage\x12\x1a\n\x12new_leader_address\x18\x01 \x01(\t\"1\n\x17\x46ollowerSyncDataRequest\x12\x16\n\x0eleader_address\x18\x01 \x01(\t\"*\n\x0fSyncDataRequest\x12\x17\n\x0freplica_address\x18\x01 \x01(\t\"\x91\x01\n\x10SyncDataResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x19\n\x11replica_addresses\x18\x02 \x03(\t\x12\x1e\n\x08messages\x18\x03 \x03(\x0b\x32\x0c.MessageData\x12\x18\n\x05users\x18\x04 \x03(\x0b\x32\t.UserData\x12\x18\n\x10online_usernames\x18\x05 \x03(\t\"]\n\x0bMessageData\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x11\n\trecipient\x18\x03 \x01(\t\x12\x0f\n\x07message\x18\x04 \x01(\t\x12\x0e\n\x06status\x18\x05 \x01(\t\"3\n\x08UserData\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x15\n\rpassword_hash\x18\x02 \x01(\x0c\"0\n\x13ReplicaListResponse\x12\x19\n\x11replica_addresses\x18\x01 \x03(\t\"?\n\x12LeaderInfoResponse\x12\x16\n\x0eleader_address\x18\x01 \x01(\t\x12\x11\n\tis_leader\x18\x02 \x01(\x08\x32\x88\x07\n\x0b\x43hatService\x12!\n\x05Login\x12\r.LoginRequest\x1a\t.Response\x12#\n\x06Logout\x12\x0e.LogoutRequest\x1a\t.Response\x12;\n\x0cListAccounts\x12\x14.ListAccountsRequest\x1a\x15.ListAccountsResponse\x12-\n\x0bSendMessage\x12\x13.SendMessageRequest\x1a\t.Response\x12;\n\x0cReadMessages\x12\x14.ReadMessagesRequest\x1a\x15.ReadMessagesResponse\x12\x31\n\rDeleteMessage\x12\x15.DeleteMessageRequest\x1a\t.Response\x12\x31\n\rDeleteAccount\x12\x15.DeleteAccountRequest\x1a\t.Response\x12:\n\x11ListenForMessages\x12\x19.ListenForMessagesRequest\x1a\x08.Message0\x01\x12\x37\n\x10ReplicateMessage\x12\x18.ReplicateMessageRequest\x1a\t.Response\x12)\n\tHeartbeat\x12\x11.HeartbeatRequest\x1a\t.Response\x12\x33\n\x0eLeaderElection\x12\x16.LeaderElectionRequest\x1a\t.Response\x12\x43\n\x13GetReplicaAddresses\x12\x16.google.protobuf.Empty\x1a\x14.ReplicaListResponse\x12:\n\x0bWhoIsLeader\x12\x16.google.protobuf.Empty\x1a\x13.LeaderInfoResponse\x12/\n\x08SyncData\x12\x10.SyncDataRequest\x1a\x11.SyncDataResponse\x12\x33\n\x0c\x46ollowerSync\x12\x18.FollowerSyncDataRequest\x1a\t.Response\x12\x34\n\rStartElection\x12\x10.ElectionRequest\x1a\x11.ElectionResponse\x12\x30\n\x0e\x41nnounceLeader\x12\x13.CoordinatorMessage\x1a\t.Responseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x1a\x1bgoogle/protobuf/empty.proto\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"!\n\rLogoutRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"J\n\x13ListAccountsRequest\x12\x10\n\x08page_num\x18\x01 \x01(\x05\x12\x11\n\tpage_size\x18\x02 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\t\"N\n\x14ListAccountsResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x11\n\tusernames\x18\x02 \x03(\t\x12\x13\n\x0bnext_cursor\x18\x03 \x01(\t\"H\n\x15SearchAccountsRequest\x12\r\n\x05query\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\x11\n\tsubstring\x18\x03 \x01(\x08\"J\n\x12SendMessageRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"6\n\x13ReadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\"\x9b\x01\n\x14StreamHistoryRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08\x61\x66ter_id\x18\x02 \x01(\x03\x12\x11\n\tbefore_id\x18\x03 \x01(\x03\x12\x10\n\x08since_ms\x18\x04 \x01(\x03\x12\x10\n\x08until_ms\x18\x05 \x01(\x03\x12\x14\n\x0cresume_token\x18\x06 \x01(\t\x12\x12\n\nchunk_size\x18\x07 \x01(\x05\"@\n\x0cHistoryChunk\x12\x1a\n\x08messages\x18\x01 \x03(\x0b\x32\x08.Message\x12\x14\n\x0cresume_token\x18\x02 \x01(\t\"S\n\x14ReadMessagesResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x1a\n\x08messages\x18\x02 \x03(\x0b\x32\x08.Message\x12\x0f\n\x07message\x18\x03 \x01(\t\"6\n\x07Message\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\";\n\x14\x44\x65leteMessageRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\":\n\x14\x44\x65leteAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\",\n\x18ListenForMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"G\n\x17ReplicateMessageRequest\x12\x19\n\x07message\x18\x01 \x01(\x0b\x32\x08.Message\x12\x11\n\trecipient\x18\x02 \x01(\t\":\n\x08Response\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\r\n\x05token\x18\x03 \x01(\t\"\x12\n\x10HeartbeatRequest\"H\n\x15LeaderElectionRequest\x12\x1c\n\x14requesting_server_id\x18\x01 \x01(\t\x12\x11\n\tleader_id\x18\x02 \x01(\t\"D\n\x0f\x45lectionRequest\x12\x19\n\x11\x63\x61ndidate_address\x18\x01 \x01(\t\x12\x16\n\x0e\x63\x61ndidate_port\x18\x02 \x01(\x05\"\"\n\x10\x45lectionResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\"0\n\x12\x43oordinatorMessage\x12\x1a\n\x12new_leader_address\x18\x01 \x01(\t\"1\n\x17\x46ollowerSyncDataRequest\x12\x16\n\x0eleader_address\x18\x01 \x01(\t\"V\n\x0fSyncDataRequest\x12\x17\n\x0freplica_address\x18\x01 \x01(\t\x12\x11\n\tafter_seq\x18\x02 \x01(\x03\x12\x17\n\x0fstream_snapshot\x18\x03 \x01(\x08\"\x8c\x02\n\x10SyncDataResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\x12\x19\n\x11replica_addresses\x18\x02 \x03(\t\x12\x1e\n\x08messages\x18\x03 \x03(\x0b\x32\x0c.MessageData\x12\x18\n\x05users\x18\x04 \x03(\x0b\x32\t.UserData\x12\x18\n\x10online_usernames\x18\x05 \x03(\t\x12\x1e\n\x08sessions\x18\x06 \x03(\x0b\x32\x0c.SessionData\x12\x1a\n\x07\x65ntries\x18\x07 \x03(\x0b\x32\t.LogEntry\x12\x10\n\x08last_seq\x18\x08 \x01(\x03\x12\x10\n\x08snapshot\x18\t \x01(\x08\x12\x19\n\x11snapshot_required\x18\n \x01(\x08\"O\n\x0fSnapshotRequest\x12\x17\n\x0freplica_address\x18\x01 \x01(\t\x12\x13\n\x0bsnapshot_id\x18\x02 \x01(\t\x12\x0e\n\x06offset\x18\x03 \x01(\x03\"\xa3\x01\n\rSnapshotChunk\x12\x13\n\x0bsnapshot_id\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x03\x12\x0c\n\x04\x64\x61ta\x18\x03 \x01(\x0c\x12\x13\n\x0btotal_bytes\x18\x04 \x01(\x03\x12\x10\n\x08last_seq\x18\x05 \x01(\x03\x12\x1e\n\x08sessions\x18\x06 \x03(\x0b\x32\x0c.SessionData\x12\x18\n\x10online_usernames\x18\x07 \x03(\t\">\n\x0eReplicationAck\x12\x17\n\x0freplica_address\x18\x01 \x01(\t\x12\x13\n\x0b\x61pplied_seq\x18\x02 \x01(\x03\"1\n\x08LogEntry\x12\x0b\n\x03seq\x18\x01 \x01(\x03\x12\n\n\x02op\x18\x02 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x03 \x01(\t\"]\n\x0bMessageData\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x11\n\trecipient\x18\x03 \x01(\t\x12\x0f\n\x07message\x18\x04 \x01(\t\x12\x0e\n\x06status\x18\x05 \x01(\t\"I\n\x0bSessionData\x12\x14\n\x0ctoken_digest\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x12\n\nexpires_at\x18\x03 \x01(\x01\"3\n\x08UserData\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x15\n\rpassword_hash\x18\x02 \x01(\x0c\"0\n\x13ReplicaListResponse\x12\x19\n\x11replica_addresses\x18\x01 \x03(\t\"?\n\x12LeaderInfoResponse\x12\x16\n\x0eleader_address\x18\x01 \x01(\t\x12\x11\n\tis_leader\x18\x02 \x01(\x08\x32\xf5\x08\n\x0b\x43hatService\x12!\n\x05Login\x12\r.LoginRequest\x1a\t.Response\x12#\n\x06Logout\x12\x0e.LogoutRequest\x1a\t.Response\x12;\n\x0cListAccounts\x12\x14.ListAccountsRequest\x1a\x15.ListAccountsResponse\x12?\n\x0eSearchAccounts\x12\x16.SearchAccountsRequest\x1a\x15.ListAccountsResponse\x12-\n\x0bSendMessage\x12\x13.SendMessageRequest\x1a\t.Response\x12;\n\x0cReadMessages\x12\x14.ReadMessagesRequest\x1a\x15.ReadMessagesResponse\x12\x37\n\rStreamHistory\x12\x15.StreamHistoryRequest\x1a\r.HistoryChunk0\x01\x12\x31\n\rDeleteMessage\x12\x15.DeleteMessageRequest\x1a\t.Response\x12\x31\n\rDeleteAccount\x12\x15.DeleteAccountRequest\x1a\t.Response\x12:\n\x11ListenForMessages\x12\x19.ListenForMessagesRequest\x1a\x08.Message0\x01\x12\x37\n\x10ReplicateMessage\x12\x18.ReplicateMessageRequest\x1a\t.Response\x12)\n\tHeartbeat\x12\x11.HeartbeatRequest\x1a\t.Response\x12\x33\n\x0eLeaderElection\x12\x16.LeaderElectionRequest\x1a\t.Response\x12\x43\n\x13GetReplicaAddresses\x12\x16.google.protobuf.Empty\x1a\x14.ReplicaListResponse\x12:\n\x0bWhoIsLeader\x12\x16.google.protobuf.Empty\x1a\x13.LeaderInfoResponse\x12/\n\x08SyncData\x12\x10.SyncDataRequest\x1a\x11.SyncDataResponse\x12\x33\n\x0c\x46ollowerSync\x12\x18.FollowerSyncDataRequest\x1a\t.Response\x12;\n\x11ReplicationStream\x12\x0f.ReplicationAck\x1a\x11.SyncDataResponse(\x01\x30\x01\x12\x34\n\x0eSnapshotStream\x12\x10.SnapshotRequest\x1a\x0e.SnapshotChunk0\x01\x12\x34\n\rStartElection\x12\x10.ElectionRequest\x1a\x11.ElectionResponse\x12\x30\n\x0e\x41nnounceLeader\x12\x13.CoordinatorMessage\x1a\t.Responseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -37,51 +37,67 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_LOGOUTREQUEST']._serialized_start=95
   _globals['_LOGOUTREQUEST']._serialized_end=128
   _globals['_LISTACCOUNTSREQUEST']._serialized_start=130
-  _globals['_LISTACCOUNTSREQUEST']._serialized_end=169
-  _globals['_LISTACCOUNTSRESPONSE']._serialized_start=171
-  _globals['_LISTACCOUNTSRESPONSE']._serialized_end=228
-  _globals['_SENDMESSAGEREQUEST']._serialized_start=230
-  _globals['_SENDMESSAGEREQUEST']._serialized_end=304
-  _globals['_READMESSAGESREQUEST']._serialized_start=306
-  _globals['_READMESSAGESREQUEST']._serialized_end=360
-  _globals['_READMESSAGESRESPONSE']._serialized_start=362
-  _globals['_READMESSAGESRESPONSE']._serialized_end=428
-  _globals['_MESSAGE']._serialized_start=430
-  _globals['_MESSAGE']._serialized_end=484
-  _globals['_DELETEMESSAGEREQUEST']._serialized_start=486
-  _globals['_DELETEMESSAGEREQUEST']._serialized_end=545
-  _globals['_DELETEACCOUNTREQUEST']._serialized_start=547
-  _globals['_DELETEACCOUNTREQUEST']._serialized_end=605
-  _globals['_LISTENFORMESSAGESREQUEST']._serialized_start=607
-  _globals['_LISTENFORMESSAGESREQUEST']._serialized_end=651
-  _globals['_REPLICATEMESSAGEREQUEST']._serialized_start=653
-  _globals['_REPLICATEMESSAGEREQUEST']._serialized_end=724
-  _globals['_RESPONSE']._serialized_start=726
-  _globals['_RESPONSE']._serialized_end=769
-  _globals['_HEARTBEATREQUEST']._serialized_start=771
-  _globals['_HEARTBEATREQUEST']._serialized_end=789
-  _globals['_LEADERELECTIONREQUEST']._serialized_start=791
-  _globals['_LEADERELECTIONREQUEST']._serialized_end=863
-  _globals['_ELECTIONREQUEST']._serialized_start=865
-  _globals['_ELECTIONREQUEST']._serialized_end=933
-  _globals['_ELECTIONRESPONSE']._serialized_start=935
-  _globals['_ELECTIONRESPONSE']._serialized_end=969
-  _globals['_COORDINATORMESSAGE']._serialized_start=971
-  _globals['_COORDINATORMESSAGE']._serialized_end=1019
-  _globals['_FOLLOWERSYNCDATAREQUEST']._serialized_start=1021
-  _globals['_FOLLOWERSYNCDATAREQUEST']._serialized_end=1070
-  _globals['_SYNCDATAREQUEST']._serialized_start=1072
-  _globals['_SYNCDATAREQUEST']._serialized_end=1114
-  _globals['_SYNCDATARESPONSE']._serialized_start=1117
-  _globals['_SYNCDATARESPONSE']._serialized_end=1262
-  _globals['_MESSAGEDATA']._serialized_start=1264
-  _globals['_MESSAGEDATA']._serialized_end=1357
-  _globals['_USERDATA']._serialized_start=1359
-  _globals['_USERDATA']._serialized_end=1410
-  _globals['_REPLICALISTRESPONSE']._serialized_start=1412
-  _globals['_REPLICALISTRESPONSE']._serialized_end=1460
-  _globals['_LEADERINFORESPONSE']._serialized_start=1462
-  _globals['_LEADERINFORESPONSE']._serialized_end=1525
-  _globals['_CHATSERVICE']._serialized_start=1528
-  _globals['_CHATSERVICE']._serialized_end=2432
+  _globals['_LISTACCOUNTSREQUEST']._serialized_end=204
+  _globals['_LISTACCOUNTSRESPONSE']._serialized_start=206
+  _globals['_LISTACCOUNTSRESPONSE']._serialized_end=284
+  _globals['_SEARCHACCOUNTSREQUEST']._serialized_start=286
+  _globals['_SEARCHACCOUNTSREQUEST']._serialized_end=358
+  _globals['_SENDMESSAGEREQUEST']._serialized_start=360
+  _globals['_SENDMESSAGEREQUEST']._serialized_end=434
+  _globals['_READMESSAGESREQUEST']._serialized_start=436
+  _globals['_READMESSAGESREQUEST']._serialized_end=490
+  _globals['_STREAMHISTORYREQUEST']._serialized_start=493
+  _globals['_STREAMHISTORYREQUEST']._serialized_end=648
+  _globals['_HISTORYCHUNK']._serialized_start=650
+  _globals['_HISTORYCHUNK']._serialized_end=714
+  _globals['_READMESSAGESRESPONSE']._serialized_start=716
+  _globals['_READMESSAGESRESPONSE']._serialized_end=799
+  _globals['_MESSAGE']._serialized_start=801
+  _globals['_MESSAGE']._serialized_end=855
+  _globals['_DELETEMESSAGEREQUEST']._serialized_start=857
+  _globals['_DELETEMESSAGEREQUEST']._serialized_end=916
+  _globals['_DELETEACCOUNTREQUEST']._serialized_start=918
+  _globals['_DELETEACCOUNTREQUEST']._serialized_end=976
+  _globals['_LISTENFORMESSAGESREQUEST']._serialized_start=978
+  _globals['_LISTENFORMESSAGESREQUEST']._serialized_end=1022
+  _globals['_REPLICATEMESSAGEREQUEST']._serialized_start=1024
+  _globals['_REPLICATEMESSAGEREQUEST']._serialized_end=1095
+  _globals['_RESPONSE']._serialized_start=1097
+  _globals['_RESPONSE']._serialized_end=1155
+  _globals['_HEARTBEATREQUEST']._serialized_start=1157
+  _globals['_HEARTBEATREQUEST']._serialized_end=1175
+  _globals['_LEADERELECTIONREQUEST']._serialized_start=1177
+  _globals['_LEADERELECTIONREQUEST']._serialized_end=1249
+  _globals['_ELECTIONREQUEST']._serialized_start=1251
+  _globals['_ELECTIONREQUEST']._serialized_end=1319
+  _globals['_ELECTIONRESPONSE']._serialized_start=1321
+  _globals['_ELECTIONRESPONSE']._serialized_end=1355
+  _globals['_COORDINATORMESSAGE']._serialized_start=1357
+  _globals['_COORDINATORMESSAGE']._serialized_end=1405
+  _globals['_FOLLOWERSYNCDATAREQUEST']._serialized_start=1407
+  _globals['_FOLLOWERSYNCDATAREQUEST']._serialized_end=1456
+  _globals['_SYNCDATAREQUEST']._serialized_start=1458
+  _globals['_SYNCDATAREQUEST']._serialized_end=1544
+  _globals['_SYNCDATARESPONSE']._serialized_start=1547
+  _globals['_SYNCDATARESPONSE']._serialized_end=1815
+  _globals['_SNAPSHOTREQUEST']._serialized_start=1817
+  _globals['_SNAPSHOTREQUEST']._serialized_end=1896
+  _globals['_SNAPSHOTCHUNK']._serialized_start=1899
+  _globals['_SNAPSHOTCHUNK']._serialized_end=2062
+  _globals['_REPLICATIONACK']._serialized_start=2064
+  _globals['_REPLICATIONACK']._serialized_end=2126
+  _globals['_LOGENTRY']._serialized_start=2128
+  _globals['_LOGENTRY']._serialized_end=2177
+  _globals['_MESSAGEDATA']._serialized_start=2179
+  _globals['_MESSAGEDATA']._serialized_end=2272
+  _globals['_SESSIONDATA']._serialized_start=2274
+  _globals['_SESSIONDATA']._serialized_end=2347
+  _globals['_USERDATA']._serialized_start=2349
+  _globals['_USERDATA']._serialized_end=2400
+  _globals['_REPLICALISTRESPONSE']._serialized_start=2402
+  _globals['_REPLICALISTRESPONSE']._serialized_end=2450
+  _globals['_LEADERINFORESPONSE']._serialized_start=2452
+  _globals['_LEADERINFORESPONSE']._serialized_end=2515
+  _globals['_CHATSERVICE']._serialized_start=2518
+  _globals['_CHATSERVICE']._serialized_end=3659
 # @@protoc_insertion_point(module_scope)
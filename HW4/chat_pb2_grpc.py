@@ -50,6 +50,11 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.ListAccountsRequest.SerializeToString,
                 response_deserializer=chat__pb2.ListAccountsResponse.FromString,
                 _registered_method=True)
+        self.SearchAccounts = channel.unary_unary(
+                '/ChatService/SearchAccounts',
+                request_serializer=chat__pb2.SearchAccountsRequest.SerializeToString,
+                response_deserializer=chat__pb2.ListAccountsResponse.FromString,
+                _registered_method=True)
         self.SendMessage = channel.unary_unary(
                 '/ChatService/SendMessage',
                 request_serializer=chat__pb2.SendMessageRequest.SerializeToString,
@@ -60,6 +65,11 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.ReadMessagesRequest.SerializeToString,
                 response_deserializer=chat__pb2.ReadMessagesResponse.FromString,
                 _registered_method=True)
+        self.StreamHistory = channel.unary_stream(
+                '/ChatService/StreamHistory',
+                request_serializer=chat__pb2.StreamHistoryRequest.SerializeToString,
+                response_deserializer=chat__pb2.HistoryChunk.FromString,
+                _registered_method=True)
         self.DeleteMessage = channel.unary_unary(
                 '/ChatService/DeleteMessage',
                 request_serializer=chat__pb2.DeleteMessageRequest.SerializeToString,
@@ -110,6 +120,16 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.FollowerSyncDataRequest.SerializeToString,
                 response_deserializer=chat__pb2.Response.FromString,
                 _registered_method=True)
+        self.ReplicationStream = channel.stream_stream(
+                '/ChatService/ReplicationStream',
+                request_serializer=chat__pb2.ReplicationAck.SerializeToString,
+                response_deserializer=chat__pb2.SyncDataResponse.FromString,
+                _registered_method=True)
+        self.SnapshotStream = channel.unary_stream(
+                '/ChatService/SnapshotStream',
+                request_serializer=chat__pb2.SnapshotRequest.SerializeToString,
+                response_deserializer=chat__pb2.SnapshotChunk.FromString,
+                _registered_method=True)
         self.StartElection = channel.unary_unary(
                 '/ChatService/StartElection',
                 request_serializer=chat__pb2.ElectionRequest.SerializeToString,
@@ -143,6 +163,12 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SearchAccounts(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def SendMessage(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -155,6 +181,12 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamHistory(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def DeleteMessage(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -218,6 +250,21 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ReplicationStream(self, request_iterator, context):
+        """Opened by a follower for as long as it follows: the leader pushes log batches as the log
+        grows, and the follower acknowledges each one once applied.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SnapshotStream(self, request, context):
+        """A consistent copy of the leader's database, in chunks, for a follower the log can't catch up
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def StartElection(self, request, context):
         """New leader election methods
         """
@@ -249,6 +296,11 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.ListAccountsRequest.FromString,
                     response_serializer=chat__pb2.ListAccountsResponse.SerializeToString,
             ),
+            'SearchAccounts': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchAccounts,
+                    request_deserializer=chat__pb2.SearchAccountsRequest.FromString,
+                    response_serializer=chat__pb2.ListAccountsResponse.SerializeToString,
+            ),
             'SendMessage': grpc.unary_unary_rpc_method_handler(
                     servicer.SendMessage,
                     request_deserializer=chat__pb2.SendMessageRequest.FromString,
@@ -259,6 +311,11 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.ReadMessagesRequest.FromString,
                     response_serializer=chat__pb2.ReadMessagesResponse.SerializeToString,
             ),
+            'StreamHistory': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamHistory,
+                    request_deserializer=chat__pb2.StreamHistoryRequest.FromString,
+                    response_serializer=chat__pb2.HistoryChunk.SerializeToString,
+            ),
             'DeleteMessage': grpc.unary_unary_rpc_method_handler(
                     servicer.DeleteMessage,
                     request_deserializer=chat__pb2.DeleteMessageRequest.FromString,
@@ -309,6 +366,16 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.FollowerSyncDataRequest.FromString,
                     response_serializer=chat__pb2.Response.SerializeToString,
             ),
+            'ReplicationStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.ReplicationStream,
+                    request_deserializer=chat__pb2.ReplicationAck.FromString,
+                    response_serializer=chat__pb2.SyncDataResponse.SerializeToString,
+            ),
+            'SnapshotStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.SnapshotStream,
+                    request_deserializer=chat__pb2.SnapshotRequest.FromString,
+                    response_serializer=chat__pb2.SnapshotChunk.SerializeToString,
+            ),
             'StartElection': grpc.unary_unary_rpc_method_handler(
                     servicer.StartElection,
                     request_deserializer=chat__pb2.ElectionRequest.FromString,
@@ -411,6 +478,33 @@ class ChatService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def SearchAccounts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/ChatService/SearchAccounts',
+            chat__pb2.SearchAccountsRequest.SerializeToString,
+            chat__pb2.ListAccountsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def SendMessage(request,
             target,
@@ -465,6 +559,33 @@ class ChatService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def StreamHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/ChatService/StreamHistory',
+            chat__pb2.StreamHistoryRequest.SerializeToString,
+            chat__pb2.HistoryChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def DeleteMessage(request,
             target,
@@ -735,6 +856,60 @@ class ChatService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def ReplicationStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/ChatService/ReplicationStream',
+            chat__pb2.ReplicationAck.SerializeToString,
+            chat__pb2.SyncDataResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SnapshotStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/ChatService/SnapshotStream',
+            chat__pb2.SnapshotRequest.SerializeToString,
+            chat__pb2.SnapshotChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def StartElection(request,
             target,
@@ -2,6 +2,7 @@ import grpc
 import chat_pb2
 import chat_pb2_grpc
 import threading
+from tokens import TokenClientInterceptor
 from argparse import ArgumentParser
 
 def parse_args():
@@ -21,6 +22,9 @@ def listen_for_messages(stub, username):
 
 def run(args):
     channel = grpc.insecure_channel(f"{args.host}:{args.port}")
+    # every call after Login carries the session token it returned
+    session = {"token": None}
+    channel = grpc.intercept_channel(channel, TokenClientInterceptor(lambda: session["token"]))
     stub = chat_pb2_grpc.ChatServiceStub(channel)
 
     print("Welcome to the Chat App!")
@@ -32,6 +36,7 @@ def run(args):
     if login_response.status != "success":
         print("Login failed:", login_response.message)
         return
+    session["token"] = login_response.token
 
     print("Login successful! Listening for new messages...")
     
@@ -45,12 +50,19 @@ def run(args):
         print("4. Delete message")
         print("5. Delete account")
         print("6. Exit")
+        print("7. Search accounts")
+        print("8. Message history")
 
         choice = input("Enter choice: ")
         
         if choice == "1":
-            response = stub.ListAccounts(chat_pb2.ListAccountsRequest(page_num=1))
-            print("Accounts:", response.usernames)
+            cursor = ""
+            while True:
+                response = stub.ListAccounts(chat_pb2.ListAccountsRequest(cursor=cursor))
+                print("Accounts:", response.usernames)
+                cursor = response.next_cursor
+                if not cursor or input("Show more accounts? (y/n): ").lower() != "y":
+                    break
 
         elif choice == "2":
             recipient = input("Recipient username: ")
@@ -70,6 +82,8 @@ def run(args):
 
             response = stub.ReadMessages(chat_pb2.ReadMessagesRequest(username=username, limit=limit))
 
+            if response.status == "error" and response.message:
+                print(response.status, response.message)
             if response.messages:
                 for msg in response.messages:
                     print(f"From {msg.sender}: {msg.message}")
@@ -93,6 +107,20 @@ def run(args):
                         print("Logged out successfully.")
                         break
 
+        elif choice == "7":
+            query = input("Username contains: ")
+            response = stub.SearchAccounts(chat_pb2.SearchAccountsRequest(query=query, substring=True))
+            print("Accounts:", response.usernames)
+
+        elif choice == "8":
+            # one call streams the whole history, a chunk at a time
+            count = 0
+            for chunk in stub.StreamHistory(chat_pb2.StreamHistoryRequest(username=username)):
+                for msg in chunk.messages:
+                    print(f"[{msg.id}] From {msg.sender}: {msg.message}")
+                count += len(chunk.messages)
+            print(f"{count} messages")
+
         elif choice == "6":
             response = stub.Logout(chat_pb2.LogoutRequest(username=username))
             if response.status == "success":
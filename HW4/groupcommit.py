@@ -0,0 +1,113 @@
+"""
+Group commit for the leader's writes.
+
+Every SendMessage used to cost its own SQLite transaction and its own round of
+FollowerSync calls, so the leader's write rate was one replication round trip per
+message however many clients were sending. GroupCommit queues the writes instead. A
+commit thread takes whatever has queued up, up to `max_batch` writes, and stores it in
+one transaction. A replication thread then tells the followers to catch up once for
+everything committed since its last round, while the next batch is being committed.
+
+Batches form on their own under load, because writes queue up while the previous batch
+is committed. The commit thread also lingers for up to `window` seconds to fill a batch,
+but only while the last batch held more than one write, so a lone write on an idle
+server is committed straight away.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_MAX_BATCH = 256
+DEFAULT_WINDOW = 0.002  # seconds
+
+
+class Write:
+    """
+    A queued write. `committed` resolves with the commit function's result for it once
+    its batch is stored, and `replicated` with whether the quorum acknowledged it.
+    """
+    def __init__(self, item):
+        self.item = item
+        self.committed = Future()
+        self.replicated = Future()
+
+
+class GroupCommit:
+    """
+    commit: stores a list of items in one transaction and returns one result per item.
+    replicate: brings the followers up to date with everything committed so far and
+        returns whether the quorum acknowledged it (ChatService.Broadcast_Sync).
+    """
+    def __init__(self, commit, replicate, max_batch=DEFAULT_MAX_BATCH, window=DEFAULT_WINDOW):
+        self.commit = commit
+        self.replicate = replicate
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self.writes = queue.Queue()
+        self.last_batch = 0
+        # futures for the next replication round
+        self.unreplicated = []
+        self.replication_due = threading.Condition()
+        threading.Thread(target=self.commit_loop, daemon=True).start()
+        threading.Thread(target=self.replicate_loop, daemon=True).start()
+
+    def submit(self, item):
+        """Queues `item` for the next batch and returns its Write."""
+        write = Write(item)
+        self.writes.put(write)
+        return write
+
+    def sync(self):
+        """
+        A future for a replication round that starts after this call, for writes stored
+        outside the pipeline (logins, reads, deletes). Concurrent callers share a round.
+        """
+        future = Future()
+        self.request_replication([future])
+        return future
+
+    def request_replication(self, futures):
+        with self.replication_due:
+            self.unreplicated.extend(futures)
+            self.replication_due.notify()
+
+    def next_batch(self):
+        batch = [self.writes.get()]
+        # linger only under load; an idle server commits a lone write at once
+        deadline = time.monotonic() + (self.window if self.last_batch > 1 else 0)
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.writes.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        self.last_batch = len(batch)
+        return batch
+
+    def commit_loop(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.commit([write.item for write in batch])
+            except Exception as e:
+                for write in batch:
+                    write.committed.set_exception(e)
+                    write.replicated.set_exception(e)
+                continue
+            for write, result in zip(batch, results):
+                write.committed.set_result(result)
+            self.request_replication([write.replicated for write in batch])
+
+    def replicate_loop(self):
+        while True:
+            with self.replication_due:
+                self.replication_due.wait_for(lambda: self.unreplicated)
+                futures, self.unreplicated = self.unreplicated, []
+            try:
+                reached = self.replicate()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future in futures:
+                future.set_result(reached)
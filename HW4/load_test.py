@@ -0,0 +1,226 @@
+"""
+Load test for the chat server.
+
+Starts server.py once for every combination of the swept server settings. It drives each
+server with SendMessage and ReadMessages calls at several concurrency levels and prints
+throughput and latency percentiles for each run. Plotting the rows gives a throughput/
+latency curve per setting:
+
+    python load_test.py --workers 4 10 32 --concurrency 1 8 32 128 --listeners 200 --csv results.csv
+
+Every server gets a fresh database in a temporary directory. The load comes from one
+grpc.aio client in this process, and the server runs in a process of its own. With
+`--followers`, that many followers join the leader first, so every write pays for
+replication as it would in a real cluster:
+
+    python load_test.py --followers 2 --max-batch 1 256 --read-fraction 0 --concurrency 1 16 64
+"""
+import argparse
+import asyncio
+import collections
+import csv
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import grpc
+from google.protobuf import empty_pb2
+import chat_pb2
+import chat_pb2_grpc
+from tokens import TOKEN_METADATA_KEY
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+SERVER_ARGS = ["--leader"]
+PASSWORD = "load-test"
+COLUMNS = ["workers", "stream_workers", "max_concurrent_rpcs", "max_batch", "message_bytes", "listeners", "concurrency",
+           "calls", "errors", "calls_per_sec", "p50_ms", "p90_ms", "p99_ms"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port, role_args, workers, stream_workers, max_concurrent_rpcs, max_batch):
+    command = [sys.executable, SERVER, "--port", str(port), *role_args,
+               "--workers", str(workers), "--stream-workers", str(stream_workers),
+               "--max-concurrent-rpcs", str(max_concurrent_rpcs), "--max-batch", str(max_batch),
+               # the server refuses a bcrypt queue as long as the worker pool
+               "--hash-queue", str(min(4, workers - 1))]
+    return subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Session:
+    def __init__(self, username, token):
+        self.username = username
+        self.metadata = ((TOKEN_METADATA_KEY, token),)
+
+
+async def login(stub, username):
+    while True:
+        response = await stub.Login(chat_pb2.LoginRequest(username=username, password=PASSWORD))
+        if response.status == "success":
+            return Session(username, response.token)
+        # a full bcrypt queue says "busy"; anything else is a real failure
+        if "busy" not in response.message.lower():
+            raise RuntimeError(f"login failed for {username}: {response.message}")
+        await asyncio.sleep(0.05)
+
+
+async def login_all(stub, usernames, parallel=2):
+    slots = asyncio.Semaphore(parallel)
+
+    async def one(username):
+        async with slots:
+            return await login(stub, username)
+
+    return await asyncio.gather(*(one(username) for username in usernames))
+
+
+async def drain(call):
+    try:
+        async for _ in call:
+            pass
+    except grpc.RpcError:
+        pass
+
+
+async def drive(stub, senders, recipients, concurrency, duration, read_fraction, payload):
+    """Keeps `concurrency` calls in flight for `duration` seconds. Returns latencies and error counts."""
+    latencies, errors = [], collections.Counter()
+    deadline = time.perf_counter() + duration
+
+    async def caller(rng):
+        while time.perf_counter() < deadline:
+            sender = rng.choice(senders)
+            started = time.perf_counter()
+            try:
+                if rng.random() < read_fraction:
+                    await stub.ReadMessages(chat_pb2.ReadMessagesRequest(username=sender.username, limit=10),
+                                            metadata=sender.metadata)
+                else:
+                    request = chat_pb2.SendMessageRequest(username=sender.username, recipient=rng.choice(recipients), message=payload)
+                    await stub.SendMessage(request, metadata=sender.metadata)
+            except grpc.RpcError as e:
+                errors[e.code().name] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(caller(random.Random(i)) for i in range(concurrency)))
+    return latencies, errors
+
+
+async def start_followers(stub, directory, leader_port, count, *settings):
+    """Starts `count` followers of the leader and waits until it has registered all of them."""
+    followers = [start_server(directory, free_port(), ["--leader_address", f"127.0.0.1:{leader_port}"], *settings)
+                 for _ in range(count)]
+    deadline = time.monotonic() + 30
+    while len((await stub.GetReplicaAddresses(empty_pb2.Empty())).replica_addresses) < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError("followers did not join the leader")
+        await asyncio.sleep(0.1)
+    return followers
+
+
+async def run_server_settings(args, workers, stream_workers, max_concurrent_rpcs, max_batch, writer):
+    port = free_port()
+    settings = (workers, stream_workers, max_concurrent_rpcs, max_batch)
+    with tempfile.TemporaryDirectory() as directory:
+        servers = [start_server(directory, port, SERVER_ARGS, *settings)]
+        try:
+            async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+                await asyncio.wait_for(channel.channel_ready(), 30)
+                stub = chat_pb2_grpc.ChatServiceStub(channel)
+                servers += await start_followers(stub, directory, port, args.followers, *settings)
+                senders = await login_all(stub, [f"user{i}" for i in range(args.users)])
+                listeners = await login_all(stub, [f"listener{i}" for i in range(args.listeners)])
+                streams = [asyncio.ensure_future(drain(stub.ListenForMessages(
+                    chat_pb2.ListenForMessagesRequest(username=listener.username), metadata=listener.metadata)))
+                    for listener in listeners]
+                recipients = [session.username for session in senders + listeners]
+
+                for message_bytes, concurrency in itertools.product(args.message_bytes, args.concurrency):
+                    payload = "x" * message_bytes
+                    await drive(stub, senders, recipients, concurrency, args.warmup, args.read_fraction, payload)
+                    latencies, errors = await drive(stub, senders, recipients, concurrency, args.duration, args.read_fraction, payload)
+                    latencies.sort()
+                    row = dict(workers=workers, stream_workers=stream_workers, max_concurrent_rpcs=max_concurrent_rpcs, max_batch=max_batch,
+                               message_bytes=message_bytes, listeners=args.listeners, concurrency=concurrency,
+                               calls=len(latencies), errors=sum(errors.values()),
+                               calls_per_sec=round(len(latencies) / args.duration, 1),
+                               p50_ms=round(percentile(latencies, 0.50) * 1000, 2),
+                               p90_ms=round(percentile(latencies, 0.90) * 1000, 2),
+                               p99_ms=round(percentile(latencies, 0.99) * 1000, 2))
+                    writer(row, errors)
+
+                for stream in streams:
+                    stream.cancel()
+        finally:
+            for server in servers:
+                server.terminate()
+            for server in servers:
+                server.wait()
+
+
+def table_writer(csv_file):
+    widths = [max(len(column), 8) for column in COLUMNS]
+    print("  ".join(column.rjust(width) for column, width in zip(COLUMNS, widths)), flush=True)
+    csv_writer = None
+    if csv_file is not None:
+        csv_writer = csv.DictWriter(csv_file, COLUMNS)
+        csv_writer.writeheader()
+
+    def write(row, errors):
+        line = "  ".join(str(row[column]).rjust(width) for column, width in zip(COLUMNS, widths))
+        if errors:
+            line += "  " + ", ".join(f"{code}={count}" for code, count in errors.most_common())
+        print(line, flush=True)
+        if csv_writer is not None:
+            csv_writer.writerow(row)
+            csv_file.flush()
+
+    return write
+
+
+async def main(args):
+    csv_file = open(args.csv, "w", newline="") if args.csv else None
+    try:
+        writer = table_writer(csv_file)
+        for settings in itertools.product(args.workers, args.stream_workers, args.max_concurrent_rpcs, args.max_batch):
+            await run_server_settings(args, *settings, writer)
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep server settings and report throughput and latency")
+    parser.add_argument('--workers', type=int, nargs='+', default=[10], help="Unary worker counts to try (at least 2)")
+    parser.add_argument('--stream-workers', type=int, nargs='+', default=[4], help="StreamHistory worker counts to try")
+    parser.add_argument('--max-concurrent-rpcs', type=int, nargs='+', default=[0], help="Concurrency limits to try; 0 means none")
+    parser.add_argument('--max-batch', type=int, nargs='+', default=[256], help="Group commit batch limits to try; 1 turns batching off")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64], help="Calls kept in flight by the client")
+    parser.add_argument('--message-bytes', type=int, nargs='+', default=[64], help="Message sizes to send")
+    parser.add_argument('--followers', type=int, default=0, help="Followers replicating from the leader")
+    parser.add_argument('--users', type=int, default=16, help="Accounts sending and reading")
+    parser.add_argument('--listeners', type=int, default=0, help="Extra accounts holding ListenForMessages open; each costs one bcrypt login")
+    parser.add_argument('--read-fraction', type=float, default=0.2, help="Share of calls that are ReadMessages rather than SendMessage")
+    parser.add_argument('--duration', type=float, default=5, help="Seconds measured per row")
+    parser.add_argument('--warmup', type=float, default=1, help="Seconds of unmeasured load before each row")
+    parser.add_argument('--csv', help="Also write the rows to this CSV file")
+    args = parser.parse_args()
+    if min(args.workers) < 2:
+        parser.error("--workers must be at least 2, to leave room for a bcrypt queue")
+
+    asyncio.run(main(args))
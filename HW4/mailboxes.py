@@ -0,0 +1,88 @@
+"""
+Per-user mailboxes for real-time delivery.
+
+SendMessage runs on a worker thread and drops the message into the recipient's Mailbox
+without blocking. ListenForMessages is a coroutine on the server's event loop that
+awaits the mailbox, so a connected listener costs one parked coroutine and a deque
+rather than a worker thread, and thousands of them fit in one process.
+
+A mailbox holds at most `maxsize` messages and is closed when its listener goes away.
+A message that doesn't fit, or arrives after the close, is left unread in storage, so
+memory grows with the number of live listeners and not with what they fail to read.
+"""
+import asyncio
+import collections
+import queue
+import threading
+
+DEFAULT_MAILBOX_SIZE = 100
+
+
+class MailboxClosed(Exception):
+    pass
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Mailbox:
+    """Thread-safe bounded message queue with a non-blocking put and an awaitable get."""
+    def __init__(self, maxsize=DEFAULT_MAILBOX_SIZE):
+        self.maxsize = maxsize
+        self.messages = collections.deque()
+        self.closed = False
+        # future the listening coroutine is parked on, if any
+        self.waiter = None
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        """
+        Queue a message and wake the listener. Safe to call from any thread. Raises
+        queue.Full if the mailbox is full or closed.
+        """
+        with self.lock:
+            if self.closed or len(self.messages) >= self.maxsize:
+                raise queue.Full
+            self.messages.append(message)
+            waiter, self.waiter = self.waiter, None
+        if waiter is not None:
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+    def get_nowait(self):
+        with self.lock:
+            if not self.messages:
+                raise queue.Empty
+            return self.messages.popleft()
+
+    async def get(self):
+        """Wait for the next message on the running event loop. Raises MailboxClosed once closed."""
+        while True:
+            with self.lock:
+                if self.closed:
+                    raise MailboxClosed
+                if self.messages:
+                    return self.messages.popleft()
+                self.waiter = waiter = asyncio.get_running_loop().create_future()
+            try:
+                await waiter
+            finally:
+                # a listener that went away must not be woken on a loop that may be gone
+                with self.lock:
+                    if self.waiter is waiter:
+                        self.waiter = None
+
+    def close(self):
+        """Refuse further messages, end the listener's wait and return the undelivered ones."""
+        with self.lock:
+            self.closed = True
+            leftovers = list(self.messages)
+            self.messages.clear()
+            waiter, self.waiter = self.waiter, None
+        if waiter is not None:
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+        return leftovers
+
+    def __len__(self):
+        return len(self.messages)
@@ -1,9 +1,18 @@
+import asyncio
+import json
 import grpc
 from concurrent import futures
 import time
 import chat_pb2
 import chat_pb2_grpc
-from storage import Storage
+from storage import DEFAULT_HISTORY_BATCH, MAX_HISTORY_BATCH, MAX_LOG_BATCH, Storage, encode_cursor, history_bounds
+from idgen import IdGenerator, MAX_NODE_ID
+from auth import PasswordHasher
+from tokens import TOKEN_METADATA_KEY, AsyncTokenAuthInterceptor, SessionTokens, token_digest, token_from_context
+from mailboxes import DEFAULT_MAILBOX_SIZE, Mailbox, MailboxClosed
+from serverconfig import ServerConfig, StreamExecutorInterceptor, add_server_arguments
+from groupcommit import DEFAULT_MAX_BATCH, DEFAULT_WINDOW, GroupCommit
+from snapshots import SNAPSHOT_CHUNK_BYTES, SnapshotIncomplete, SnapshotStore, discard_downloads, part_path, partial_download
 import queue
 import os
 import sys
@@ -11,6 +20,53 @@ import socket
 import threading
 from google.protobuf import empty_pb2
 
+# a history chunk is sent once it holds this many bytes, well inside the 64 KiB initial
+# HTTP/2 flow-control window, so one chunk never has to wait for a window update halfway
+HISTORY_CHUNK_BYTES = 32 * 1024
+# how many followers a write waits for before the client gets its answer
+SYNC_QUORUMS = ("1", "majority", "all")
+# log entries the leader pushes down a ReplicationStream before it waits for an ack
+DEFAULT_REPLICATION_WINDOW = 4 * MAX_LOG_BATCH
+# seconds a follower waits before reopening a ReplicationStream that failed
+STREAM_RETRY_INTERVAL = 1
+
+
+def quorum_size(quorum, replicas):
+    """Follower acknowledgements a write needs under `quorum`, out of `replicas` followers."""
+    if quorum == "all":
+        return replicas
+    if quorum == "majority":
+        # a majority of the whole cluster, of which the leader is one
+        return (replicas + 1) // 2
+    return min(1, replicas)
+
+
+class FollowerStream:
+    """
+    The leader's end of one follower's ReplicationStream. `acked` is the newest log entry
+    the follower has applied, and `head` the newest one the leader has asked it to reach.
+    The handler waits on `changed`, which is set from any thread by advance() and on the
+    loop by every ack.
+    """
+    def __init__(self, loop, acked):
+        self.loop = loop
+        self.acked = acked
+        self.head = acked
+        self.closed = False
+        self.changed = asyncio.Event()
+
+    def advance(self, head):
+        """Asks for the log up to `head` to be pushed. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._advance, head)
+
+    def _advance(self, head):
+        self.head = max(self.head, head)
+        self.changed.set()
+
+    async def wait_for(self, predicate):
+        while not predicate():
+            self.changed.clear()
+            await self.changed.wait()
 
 
 def get_local_ip():
@@ -25,13 +81,42 @@ def get_local_ip():
     return ip
 
 class ChatService(chat_pb2_grpc.ChatServiceServicer):
-    def __init__(self, port, is_leader=False, leader_address=None, replica_addresses=None):
+    def __init__(self, port, is_leader=False, leader_address=None, replica_addresses=None, hasher=None, tokens=None,
+                 mailbox_size=DEFAULT_MAILBOX_SIZE, sync_quorum="all", sync_timeout=2.0,
+                 max_batch=DEFAULT_MAX_BATCH, batch_window=DEFAULT_WINDOW, replication_window=DEFAULT_REPLICATION_WINDOW):
         self.port = port
         self.ip = get_local_ip()
         self.is_leader = is_leader
         self.leader_address = leader_address
-        self.storage = Storage(f"chat-{port}.db")
-        self.online_users = {}
+        # the port doubles as node id, so a newly elected leader doesn't reuse its predecessor's ids
+        self.ids = IdGenerator(port % (MAX_NODE_ID + 1))
+        self.db_name = f"chat-{port}.db"
+        self.storage = Storage(self.db_name, ids=self.ids, hasher=hasher)
+        # the leader logs its writes, and followers replay the log instead of copying the database
+        self.storage.log_writes = is_leader
+        self.last_applied = self.storage.log_head()  # newest entry of the leader's log applied here
+        self.sync_lock = threading.Lock()
+        self.sync_quorum = sync_quorum
+        self.sync_timeout = sync_timeout
+        # replicas whose last sync failed or timed out; writes don't wait for them until they catch up
+        self.lagging = set()
+        # replica address -> FollowerStream, for followers with a ReplicationStream open
+        self.streams = {}
+        self.replication_window = replication_window
+        # notified whenever a replica acknowledges, so Broadcast_Sync can count them
+        self.replication_progress = threading.Condition()
+        self.following = None  # the thread running follow_leader()
+        # backups streamed to followers by SnapshotStream
+        self.snapshots = SnapshotStore(self.db_name)
+        # SyncData's own threads, see SyncData
+        self.sync_executor = futures.ThreadPoolExecutor(max_workers=4)
+        # messages are stored and replicated in batches; other writes join the next replication round
+        self.writes = GroupCommit(self.commit_messages, lambda: self.Broadcast_Sync(), max_batch, batch_window)
+        self.online_users = {}  # username -> Mailbox of messages to push
+        self.mailbox_size = mailbox_size
+        self.online_lock = threading.Lock()
+        # session token -> username; followers copy the leader's table in SyncData
+        self.tokens = tokens if tokens is not None else SessionTokens()
 
         self.replica_addresses = replica_addresses if replica_addresses else []
         self.replicas = []
@@ -45,71 +130,283 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             self.leader_channel = grpc.insecure_channel(self.leader_address)
             # initial data syncing.
             self.leader_stub = chat_pb2_grpc.ChatServiceStub(self.leader_channel)
-            sync_request = chat_pb2.SyncDataRequest(replica_address=f"{self.ip}:{self.port}")
-            response = self.leader_stub.SyncData(sync_request)
-
-            if response.status == "success":
-                self.storage.store_synced_data(response.messages, response.users)
-                for replica_address in response.replica_addresses:
-                    if replica_address not in self.replica_addresses:
-                        self.replica_addresses.append(replica_address)
-                        self.replicas.append(chat_pb2_grpc.ChatServiceStub(grpc.insecure_channel(replica_address)))
+            self.pull_from_leader()
             print(f"Synced with leader on port {self.leader_address.split(':')[-1]}")
+            self.start_following()
 
         threading.Thread(target=self.Monitor, daemon=True).start()
 
     def Login(self, request, context):
         response = self.storage.login_register_user(request.username, request.password)
+        token = ""
         if response["status"] == "success":
-            self.online_users[request.username] = queue.Queue()
-        
-        if self.is_leader:
-            self.Broadcast_Sync()
-        return chat_pb2.Response(status=response["status"], message=response.get("message", ""))
+            self.subscribe(request.username)
+            token = self.tokens.issue(request.username)
+            # followers get the token's digest, which is all a lookup needs
+            self.storage.log("login", request.username, token_digest(token), self.tokens.clock() + self.tokens.ttl)
+            if not self.replicate():
+                return chat_pb2.Response(status="error", message=self.unreplicated("Logged in"), token=token)
+        return chat_pb2.Response(status=response["status"], message=response.get("message", ""), token=token)
+
+    def replicate(self):
+        """
+        Waits for the writes made so far to reach the `sync_quorum` of replicas, and returns
+        whether they did. Always True on a follower, whose writes come from the leader.
+        """
+        return not self.is_leader or self.writes.sync().result()
+
+    def unreplicated(self, change):
+        """What the client is told when `change` was made here but the quorum wasn't reached."""
+        # kept here and replicated once the followers catch up, but lost if this leader fails first
+        return f"{change}, but not yet acknowledged by the {self.sync_quorum} quorum of replicas."
+
+    def subscribe(self, username):
+        """Gives the user a fresh mailbox, ending the stream of any listener still on the old one."""
+        mailbox = Mailbox(self.mailbox_size)
+        with self.online_lock:
+            old, self.online_users[username] = self.online_users.get(username), mailbox
+        if old is not None:
+            self.close_mailbox(old)
+
+    def unsubscribe(self, username, mailbox=None, undelivered=()):
+        """
+        Takes the user offline, or only `mailbox` if given and still theirs. Closing the
+        mailbox ends its ListenForMessages stream, and messages pushed to it but never
+        sent are put back to unread. Returns whether the user went offline.
+        """
+        offline = False
+        with self.online_lock:
+            if mailbox is None:
+                mailbox = self.online_users.pop(username, None)
+                offline = mailbox is not None
+            elif self.online_users.get(username) is mailbox:
+                del self.online_users[username]
+                offline = True
+        if mailbox is not None:
+            self.close_mailbox(mailbox, undelivered)
+        return offline
+
+    def close_mailbox(self, mailbox, undelivered=()):
+        leftovers = list(undelivered) + mailbox.close()
+        if leftovers:
+            self.storage.mark_unread([message.id for message in leftovers])
 
     def Logout(self, request, context):
-        self.online_users.pop(request.username, None)
-        if self.is_leader:
-            self.Broadcast_Sync()
+        self.unsubscribe(request.username)
+        token = token_from_context(context)
+        if token:
+            self.tokens.revoke(token)
+        self.storage.log("logout", request.username, token_digest(token) if token else "")
+        if not self.replicate():
+            return chat_pb2.Response(status="error", message=self.unreplicated("Logged out"))
         return chat_pb2.Response(status="success", message="User logged out.")
 
-    def SendMessage(self, request, context):
+    async def SendMessage(self, request, context):
+        # a coroutine on the event loop, so that a batch can hold more writes than there are workers
         if not self.is_leader:
             return chat_pb2.Response(status="error", message="Not the leader")
 
-        sender = request.username
-        recipient = request.recipient
-        message = request.message
-        message_id = int(time.time() * 1000)  # ensure uniqueness
-
         # record request size
         request_size = sys.getsizeof(request.SerializeToString())
         print(f"Received request size: {request_size} bytes")
 
-        # Real-time delivery if recipient is online
-        if recipient in self.online_users and isinstance(self.online_users[recipient], queue.Queue):
+        write = self.writes.submit((self.ids.next_id(), request.username, request.recipient, request.message))
+        delivered = await asyncio.wrap_future(write.committed)
+        if not await asyncio.wrap_future(write.replicated):
+            return chat_pb2.Response(status="error", message=self.unreplicated("Message stored"))
+        if delivered:
+            return chat_pb2.Response(status="success", message="Message delivered in real-time.")
+        return chat_pb2.Response(status="success", message="Message stored for later retrieval.")
+
+    def commit_messages(self, messages):
+        """
+        Stores a batch of (id, sender, recipient, message) in one transaction, then pushes
+        each to its recipient's mailbox. Messages are stored before they are pushed, so one
+        left in a mailbox whose listener went away can be put back to unread. Returns for
+        each message whether it was delivered in real time.
+        """
+        mailboxes = [self.online_users.get(recipient) for _, _, recipient, _ in messages]
+        rows = [(message_id, sender, recipient, message, 'read' if mailbox is not None else 'unread')
+                for (message_id, sender, recipient, message), mailbox in zip(messages, mailboxes)]
+        stored = self.storage.send_messages(rows)
+        delivered, undelivered = [], []
+        for (message_id, sender, recipient, message), mailbox, result in zip(messages, mailboxes, stored):
+            if mailbox is None or result["status"] != "success":
+                delivered.append(False)
+                continue
             try:
-                self.online_users[recipient].put(chat_pb2.Message(id=message_id, sender=sender, message=message))
+                mailbox.put(chat_pb2.Message(id=message_id, sender=sender, message=message))
                 print(f"Real-time message delivered to {recipient}")
-                self.storage.send_message(sender, recipient, message, status='read')
-                self.Broadcast_Sync()
-                return chat_pb2.Response(status="success", message="Message delivered in real-time.")
+                delivered.append(True)
             except queue.Full:
-                pass  # fall through to store message below
-
-        # Store for later retrieval if recipient is offline
-        self.storage.send_message(sender, recipient, message, status='unread')
-        self.Broadcast_Sync()
-        return chat_pb2.Response(status="success", message="Message stored for later retrieval.")
+                # the listener is too far behind or already gone: keep it for ReadMessages
+                undelivered.append(message_id)
+                delivered.append(False)
+        if undelivered:
+            self.storage.mark_unread(undelivered)
+        return delivered
 
     def Broadcast_Sync(self):
-        for replica in self.replicas:
+        """
+        Brings every replica up to the leader's newest log entry, all at once, and waits until
+        `sync_quorum` of them have acknowledged it, or `sync_timeout` has passed. The rest
+        finish in the background. Replicas with a ReplicationStream open are pushed the new
+        entries; the others are told to pull them with FollowerSync. A replica that fails or
+        times out doesn't count toward the quorum until it has caught up again, so a dead or
+        slow replica costs the timeout once rather than on every write. Returns whether the
+        quorum was reached.
+        """
+        replicas = list(self.replicas)
+        streams = {replica: self.streams.get(address) for address, replica in zip(self.replica_addresses, replicas)}
+        pushed = [(replica, streams[replica]) for replica in replicas if streams.get(replica) is not None]
+        polled = [replica for replica in replicas if streams.get(replica) is None]
+        needed = min(quorum_size(self.sync_quorum, len(replicas)), len(replicas) - len(self.lagging.intersection(replicas)))
+        target = self.storage.log_head() if pushed else 0
+        done = self.replication_progress
+        acks, pending = 0, len(polled)
+
+        def finished(call, replica):
+            nonlocal acks, pending
             try:
-                replica.FollowerSync(chat_pb2.FollowerSyncDataRequest(leader_address=f"{self.ip}:{self.port}"))
+                synced = call.result().status == "success"
             except grpc.RpcError as e:
                 print(f"Error syncing data to replica: {e}")
-
-    def SyncData(self, request, context):
+                synced = False
+            if synced:
+                self.lagging.discard(replica)
+            else:
+                self.lagging.add(replica)
+            with done:
+                acks += synced
+                pending -= 1
+                done.notify_all()
+
+        def acknowledged():
+            return acks + sum(stream.acked >= target for _, stream in pushed)
+
+        def settled():
+            return pending == 0 and all(stream.acked >= target or stream.closed for _, stream in pushed)
+
+        for _, stream in pushed:
+            stream.advance(target)
+        request = chat_pb2.FollowerSyncDataRequest(leader_address=f"{self.ip}:{self.port}")
+        for replica in polled:
+            call = replica.FollowerSync.future(request, timeout=self.sync_timeout)
+            call.add_done_callback(lambda call, replica=replica: finished(call, replica))
+        with done:
+            done.wait_for(lambda: acknowledged() >= needed or settled(), timeout=self.sync_timeout)
+            count = acknowledged()
+            for replica, stream in pushed:
+                if stream.acked >= target:
+                    self.lagging.discard(replica)
+                else:
+                    self.lagging.add(replica)
+        reached = count >= quorum_size(self.sync_quorum, len(replicas))
+        if not reached:
+            print(f"Write acknowledged by {count} of {len(replicas)} replicas, short of the {self.sync_quorum} quorum")
+        return reached
+
+    async def ReplicationStream(self, request_iterator, context):
+        """
+        Pushes the log to a follower as it grows, starting after the `applied_seq` of the
+        follower's first ack, or with a snapshot if the log doesn't reach back that far.
+        The follower acks every batch once applied. At most `replication_window` entries are
+        pushed ahead of the last ack, so a slow follower holds back its own stream and not
+        the leader's memory.
+        """
+        hello = await anext(request_iterator, None)
+        if hello is None:
+            return
+        address = hello.replica_address
+        loop = asyncio.get_running_loop()
+        follower = FollowerStream(loop, hello.applied_seq)
+        self.streams[address] = follower
+
+        async def read_acks():
+            async for ack in request_iterator:
+                with self.replication_progress:
+                    follower.acked = max(follower.acked, ack.applied_seq)
+                    self.replication_progress.notify_all()
+                follower.changed.set()
+
+        reader = asyncio.ensure_future(read_acks())
+        reader.add_done_callback(lambda _: follower.changed.set())
+        sent = hello.applied_seq
+        try:
+            while not reader.done():
+                request = chat_pb2.SyncDataRequest(replica_address=address, after_seq=sent, stream_snapshot=True)
+                response = await loop.run_in_executor(self.sync_executor, self.sync_data, request)
+                if response.status != "success":
+                    # no longer the leader; the follower reconnects to whoever is
+                    return
+                if response.snapshot_required:
+                    # the follower fetches it with SnapshotStream and reconnects after
+                    yield response
+                    return
+                if response.snapshot:
+                    sent = response.last_seq
+                elif response.entries:
+                    sent = response.entries[-1].seq
+                if response.snapshot or response.entries:
+                    yield response
+                if sent >= response.last_seq:
+                    # caught up: wait for Broadcast_Sync to announce more
+                    await follower.wait_for(lambda: follower.head > sent or reader.done())
+                await follower.wait_for(lambda: sent - follower.acked < self.replication_window or reader.done())
+        finally:
+            reader.cancel()
+            with self.replication_progress:
+                follower.closed = True
+                if self.streams.get(address) is follower:
+                    del self.streams[address]
+                self.replication_progress.notify_all()
+
+    def SnapshotStream(self, request, context):
+        """
+        Streams a backup of the database in chunks: the snapshot `request.snapshot_id` from
+        `request.offset` on if it is still kept, or a new one from the start. Runs on the
+        stream workers, and reads one chunk of the file at a time.
+        """
+        if not self.is_leader:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Not the leader")
+            return
+        snapshot = self.snapshots.get(request.snapshot_id) if request.snapshot_id else None
+        offset = request.offset if snapshot is not None and 0 <= request.offset <= snapshot.size else 0
+        if snapshot is None:
+            snapshot = self.take_snapshot()
+            print(f"Streaming a snapshot of {snapshot.size} bytes to replica: {request.replica_address}")
+        # a follower that had every byte already still gets an empty last chunk, with the state
+        for chunk_offset, data in snapshot.chunks(offset, SNAPSHOT_CHUNK_BYTES) if offset < snapshot.size else [(offset, b"")]:
+            chunk = chat_pb2.SnapshotChunk(snapshot_id=snapshot.id, offset=chunk_offset, data=data,
+                                           total_bytes=snapshot.size, last_seq=snapshot.last_seq)
+            if chunk_offset + len(data) == snapshot.size:
+                chunk.sessions.extend(snapshot.sessions)
+                chunk.online_usernames.extend(snapshot.online_usernames)
+            yield chunk
+
+    def take_snapshot(self):
+        if self.storage.log_head() == 0:
+            # a snapshot at seq 0 can't be told apart from no log at all, which asks for a snapshot
+            self.storage.log("snapshot")
+
+        def state():
+            sessions = [chat_pb2.SessionData(token_digest=digest, username=username, expires_at=expires_at)
+                        for digest, username, expires_at in self.tokens.snapshot()]
+            return sessions, list(self.online_users)
+
+        return self.snapshots.create(self.storage, state)
+
+    async def SyncData(self, request, context):
+        """
+        The log entries a follower is missing, after `request.after_seq`. A new follower, or
+        one the log can't catch up, gets a full snapshot instead.
+
+        Runs on the event loop and does the reading on `sync_executor`, not on the worker
+        pool: the writes waiting for this follower to catch up may hold every worker.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.sync_executor, self.sync_data, request)
+
+    def sync_data(self, request):
         if not self.is_leader:
             return chat_pb2.SyncDataResponse(status="error")
 
@@ -120,40 +417,178 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             print(self.replica_addresses)
             self.replicas.append(chat_pb2_grpc.ChatServiceStub(grpc.insecure_channel(replica_address)))
 
+        tmp_replica_addresses = self.replica_addresses.copy()
+        if replica_address in tmp_replica_addresses:
+            tmp_replica_addresses.remove(replica_address)
+
+        # read before the snapshot: anything written meanwhile is in both, and replaying it is harmless
+        last_seq = self.storage.log_head()
+        if request.after_seq and self.storage.log_covers(request.after_seq):
+            entries = [chat_pb2.LogEntry(**entry) for entry in self.storage.read_log(request.after_seq)]
+            return chat_pb2.SyncDataResponse(status="success", replica_addresses=tmp_replica_addresses,
+                                             entries=entries, last_seq=last_seq)
+
+        if request.stream_snapshot:
+            return chat_pb2.SyncDataResponse(status="success", replica_addresses=tmp_replica_addresses,
+                                             last_seq=last_seq, snapshot_required=True)
+
         all_messages = self.storage.get_all_messages()
         all_users = self.storage.get_all_users()
 
         message_data = [chat_pb2.MessageData(**msg) for msg in all_messages]
         user_data = [chat_pb2.UserData(username=user['username'], password_hash=user['password_hash']) for user in all_users]
         online_usernames = list(self.online_users.keys())
+        sessions = [chat_pb2.SessionData(token_digest=digest, username=username, expires_at=expires_at)
+                    for digest, username, expires_at in self.tokens.snapshot()]
 
-        tmp_replica_addresses = self.replica_addresses.copy()
-        if replica_address in tmp_replica_addresses:
-            tmp_replica_addresses.remove(replica_address)
-
-        print(f"Syncing data to replica: {replica_address}")
+        print(f"Sending a snapshot to replica: {replica_address}")
         return chat_pb2.SyncDataResponse(
             status="success",
             replica_addresses=tmp_replica_addresses,
             messages=message_data,
             users=user_data,
-            online_usernames=online_usernames
+            online_usernames=online_usernames,
+            sessions=sessions,
+            last_seq=last_seq,
+            snapshot=True
         )
 
     def FollowerSync(self, request, context):
-        sync_request = chat_pb2.SyncDataRequest(replica_address=f"{self.ip}:{self.port}")
-        response = self.leader_stub.SyncData(sync_request)
-
-        if response.status == "success":
-            self.storage.store_synced_data(response.messages, response.users)
-            self.online_users = {username: queue.Queue() for username in response.online_usernames}
-            for replica_address in response.replica_addresses:
-                if replica_address not in self.replica_addresses:
-                    self.replica_addresses.append(replica_address)
-                    self.replicas.append(chat_pb2_grpc.ChatServiceStub(grpc.insecure_channel(replica_address)))
+        response = self.pull_from_leader()
         print(f"Synced with leader on port {self.leader_address.split(':')[-1]}")
         return chat_pb2.Response(status=response.status, message="Synced")
 
+    def pull_from_leader(self):
+        """Asks the leader for what this follower is missing until it has caught up. Returns the last SyncData response."""
+        with self.sync_lock:
+            while True:
+                sync_request = chat_pb2.SyncDataRequest(replica_address=f"{self.ip}:{self.port}", after_seq=self.last_applied,
+                                                        stream_snapshot=True)
+                response = self.leader_stub.SyncData(sync_request)
+                if response.status != "success":
+                    return response
+                self.apply_sync_response(response)
+                if response.snapshot_required:
+                    # then replay the log from the snapshot's last seq
+                    self.install_snapshot()
+                    continue
+                # a log longer than one batch takes several rounds
+                if not response.entries or self.last_applied >= response.last_seq:
+                    return response
+
+    def apply_sync_response(self, response):
+        """Applies a snapshot or log batch from the leader, and learns of the replicas it lists. Call with sync_lock held."""
+        if response.snapshot:
+            self.load_snapshot(response)
+        elif response.entries:
+            self.apply_entries(response.entries)
+        for replica_address in response.replica_addresses:
+            if replica_address not in self.replica_addresses:
+                self.replica_addresses.append(replica_address)
+                self.replicas.append(chat_pb2_grpc.ChatServiceStub(grpc.insecure_channel(replica_address)))
+
+    def install_snapshot(self):
+        """
+        Downloads a snapshot from the leader with SnapshotStream into a part file next to the
+        database, then restores the database from it. A part file left by a download that
+        broke off is resumed where it stopped. Call with sync_lock held.
+        """
+        snapshot_id, offset = partial_download(self.db_name)
+        request = chat_pb2.SnapshotRequest(replica_address=f"{self.ip}:{self.port}", snapshot_id=snapshot_id, offset=offset)
+        part, last = None, None
+        try:
+            for chunk in self.leader_stub.SnapshotStream(request):
+                if part is None:
+                    if chunk.snapshot_id != snapshot_id:
+                        # the leader no longer has the snapshot being resumed, and sent a new one
+                        discard_downloads(self.db_name)
+                    part = open(part_path(self.db_name, chunk.snapshot_id), "r+b" if chunk.offset else "wb")
+                part.seek(chunk.offset)
+                part.write(chunk.data)
+                last = chunk
+        finally:
+            if part is not None:
+                part.close()
+        if last is None or last.offset + len(last.data) != last.total_bytes:
+            raise SnapshotIncomplete(f"{last.offset + len(last.data) if last else offset} bytes received")
+
+        path = part_path(self.db_name, last.snapshot_id)
+        self.storage.restore(path)
+        os.remove(path)
+        self.load_state(last.online_usernames, last.sessions, last.last_seq)
+        print(f"Restored a snapshot of {last.total_bytes} bytes up to log entry {last.last_seq}")
+
+    def start_following(self):
+        if self.following is None or not self.following.is_alive():
+            self.following = threading.Thread(target=self.follow_leader, daemon=True)
+            self.following.start()
+
+    def follow_leader(self):
+        """
+        Keeps a ReplicationStream open to the leader for as long as this node is a follower,
+        applying each batch the leader pushes and acknowledging it. A stream that fails is
+        reopened to whichever node is leader by then. Until it is, the leader falls back to
+        FollowerSync for this node.
+        """
+        while not self.is_leader:
+            acks = queue.Queue()
+            try:
+                # catch up first, from a snapshot if need be, so that the stream starts from the log
+                self.pull_from_leader()
+                acks.put(chat_pb2.ReplicationAck(replica_address=f"{self.ip}:{self.port}", applied_seq=self.last_applied))
+                for response in self.leader_stub.ReplicationStream(iter(acks.get, None)):
+                    if response.snapshot_required:
+                        # taken care of by pull_from_leader once the stream is reopened
+                        break
+                    with self.sync_lock:
+                        self.apply_sync_response(response)
+                    acks.put(chat_pb2.ReplicationAck(applied_seq=self.last_applied))
+            except grpc.RpcError as e:
+                print(f"Replication stream from the leader ended: {e.code()}")
+            except SnapshotIncomplete as e:
+                print(f"Snapshot from the leader broke off, to be resumed: {e}")
+            finally:
+                # ends the request stream
+                acks.put(None)
+            time.sleep(STREAM_RETRY_INTERVAL)
+
+    def load_snapshot(self, response):
+        self.storage.load_snapshot(response.messages, response.users, response.last_seq)
+        self.load_state(response.online_usernames, response.sessions, response.last_seq)
+
+    def load_state(self, online_usernames, sessions, last_seq):
+        """Takes on the leader's presence and sessions as of a snapshot at log entry `last_seq`."""
+        # keep the mailboxes of listeners already connected here
+        current = self.online_users
+        self.online_users = {username: current[username] if username in current else Mailbox(self.mailbox_size)
+                             for username in online_usernames}
+        self.tokens.replace((session.token_digest, session.username, session.expires_at) for session in sessions)
+        self.last_applied = last_seq
+
+    def apply_entries(self, entries):
+        """Replays log entries from the leader: the database's share in storage, sessions and presence here."""
+        self.storage.apply_log(entries)
+        for entry in entries:
+            if entry.seq <= self.last_applied:
+                continue
+            args = json.loads(entry.args)
+            if entry.op == "login":
+                username, digest, expires_at = args
+                self.tokens.add(digest, username, expires_at)
+                with self.online_lock:
+                    self.online_users.setdefault(username, Mailbox(self.mailbox_size))
+            elif entry.op == "logout":
+                username, digest = args
+                self.unsubscribe(username)
+                if digest:
+                    self.tokens.discard(digest)
+            elif entry.op == "offline":
+                self.unsubscribe(args[0])
+            elif entry.op == "delete_account":
+                self.tokens.revoke_user(args[0])
+                self.unsubscribe(args[0])
+            self.last_applied = entry.seq
+
     def Monitor(self):
         hb_request = chat_pb2.HeartbeatRequest()
 
@@ -170,6 +605,7 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
                 # Remove failed replicas
                 for idx in sorted(to_remove, reverse=True):
                     del self.replica_addresses[idx]
+                    self.lagging.discard(self.replicas[idx])
                     del self.replicas[idx]
                 
             else:
@@ -194,6 +630,7 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
                 # Remove failed replicas
                 for idx in sorted(to_remove, reverse=True):
                     del self.replica_addresses[idx]
+                    self.lagging.discard(self.replicas[idx])
                     del self.replicas[idx]
             if to_remove:
                 print(f"Replica addresses: {self.replica_addresses}")   
@@ -217,6 +654,8 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
 
     def AnnounceNewLeader(self):
         self.is_leader = True
+        # carries on the log from the last entry applied here
+        self.storage.log_writes = True
         print(f"I am the new leader on port {self.port}")
         for addr in self.replica_addresses:
             try:
@@ -235,6 +674,8 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         self.leader_channel = grpc.insecure_channel(self.leader_address)
         self.leader_stub = chat_pb2_grpc.ChatServiceStub(self.leader_channel)
         self.is_leader = False
+        self.storage.log_writes = False
+        self.start_following()
         return chat_pb2.Response(status="success", message="Leader updated.")
 
     def Heartbeat(self, request, context):
@@ -244,55 +685,109 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         if self.is_leader and self.replicas:
             for replica in self.replicas:
                 try:
-                    return replica.ListAccounts(request)
+                    return replica.ListAccounts(request, metadata=self.forwarded_metadata(context))
                 except grpc.RpcError as e:
                     print(f"Replica failed for ListAccounts: {e}")
                     continue
             return chat_pb2.ListAccountsResponse(status="error", usernames=[])
         else:
-            response = self.storage.list_accounts(page_num=request.page_num)
+            response = self.storage.list_accounts(page_num=request.page_num, page_size=request.page_size, cursor=request.cursor)
             return chat_pb2.ListAccountsResponse(
-                status="success",
-                usernames=response.get("usernames", [])
+                status=response.get("status", "success"),
+                usernames=response.get("usernames", []),
+                next_cursor=response.get("next_cursor", "")
             )
         
 
-    def ReadMessages(self, request, context):
-        if self.is_leader and self.replicas:
-            for replica in self.replicas:
-                try:
-                    return replica.ReadMessages(request)
-                except grpc.RpcError as e:
-                    print(f"Replica failed for ReadMessages: {e}")
-                    continue
-            return chat_pb2.ReadMessagesResponse(status="error", messages=[])
-        else:
-            limit = max(0, min(request.limit, 10))
-            if limit == 0:
-                return chat_pb2.ReadMessagesResponse(status="success", messages=[])
-
-            messages = self.storage.read_messages(request.username, limit)
-            return chat_pb2.ReadMessagesResponse(
-                status=messages["status"],
-                messages=[
-                    chat_pb2.Message(id=msg["id"], sender=msg["sender"], message=msg["message"])
-                    for msg in messages.get("messages", [])
-                ]
-            )
+    def SearchAccounts(self, request, context):
+        # answered from this node's in-memory index, so there is nothing to gain from forwarding it
+        response = self.storage.search_accounts(request.query, limit=request.limit, substring=request.substring)
+        return chat_pb2.ListAccountsResponse(
+            status=response.get("status", "success"),
+            usernames=response.get("usernames", [])
+        )
 
-    def ListenForMessages(self, request, context):
-        if request.username not in self.online_users:
-            context.abort(grpc.StatusCode.NOT_FOUND, "User not logged in")
-        q = self.online_users[request.username]
-        while True:
-            try:
-                message = q.get(timeout=10)
+    def ReadMessages(self, request, context):
+        # not forwarded to a replica: marking the messages read is a write, and only the
+        # leader's writes reach the log
+        limit = max(0, min(request.limit, 10))
+        if limit == 0:
+            return chat_pb2.ReadMessagesResponse(status="success", messages=[])
+
+        messages = self.storage.read_messages(request.username, limit)
+        response = chat_pb2.ReadMessagesResponse(
+            status=messages["status"],
+            messages=[
+                chat_pb2.Message(id=msg["id"], sender=msg["sender"], message=msg["message"])
+                for msg in messages.get("messages", [])
+            ]
+        )
+        if messages["status"] == "success" and not self.replicate():
+            # the messages are still returned: they are marked read here either way
+            response.status, response.message = "error", self.unreplicated("Messages marked read")
+        return response
+
+    def StreamHistory(self, request, context):
+        """
+        Streams the messages sent to the user, oldest first, in chunks. gRPC asks for the next
+        chunk only once the last one has been sent, so a slow reader holds back the walk over
+        the table instead of letting chunks pile up in memory.
+        """
+        try:
+            after_id, before_id = history_bounds(request.after_id, request.before_id, request.since_ms, request.until_ms, request.resume_token)
+        except ValueError:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Invalid resume token")
+            return
+        chunk_size = min(max(request.chunk_size or DEFAULT_HISTORY_BATCH, 1), MAX_HISTORY_BATCH)
+
+        messages, size = [], 0
+        for row in self.storage.iter_history(request.username, after_id, before_id, chunk_size):
+            message = chat_pb2.Message(id=row["id"], sender=row["sender"], message=row["message"])
+            messages.append(message)
+            size += message.ByteSize()
+            if len(messages) == chunk_size or size >= HISTORY_CHUNK_BYTES:
+                yield chat_pb2.HistoryChunk(messages=messages, resume_token=encode_cursor(str(message.id)))
+                messages, size = [], 0
+        if messages:
+            yield chat_pb2.HistoryChunk(messages=messages, resume_token=encode_cursor(str(messages[-1].id)))
+
+    async def ListenForMessages(self, request, context):
+        # a coroutine on the event loop: a waiting listener doesn't hold a worker thread
+        mailbox = self.online_users.get(request.username)
+        if mailbox is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, "User not logged in")
+            return
+        # gRPC cancels this coroutine when the client goes away, which ends up in the finally
+        message = None
+        try:
+            while True:
+                message = await mailbox.get()
                 yield message
-            except queue.Empty:
-                continue
-            except grpc.RpcError:
-                self.online_users.pop(request.username, None)
-                break
+                # the next message is only asked for once this one has been written
+                message = None
+        except MailboxClosed:
+            pass
+        finally:
+            undelivered = [message] if message is not None else []
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # finalized after the loop stopped, so there is nothing left to block
+                self.listener_gone(request.username, mailbox, undelivered)
+            else:
+                # unsubscribing writes to the database, which isn't done on the event loop
+                await loop.run_in_executor(None, self.listener_gone, request.username, mailbox, undelivered)
+
+    def listener_gone(self, username, mailbox, undelivered):
+        """Takes the user offline when their ListenForMessages stream ends, if it was still theirs."""
+        if self.unsubscribe(username, mailbox, undelivered):
+            # left for the next sync to carry: a broadcast would hold up the stream's end
+            self.storage.log("offline", username)
+
+    def forwarded_metadata(self, context):
+        """Metadata for a call forwarded to a replica, so its interceptor accepts the client's token."""
+        token = token_from_context(context)
+        return [(TOKEN_METADATA_KEY, token)] if token else None
 
     def GetReplicaAddresses(self, request, context):
         return chat_pb2.ReplicaListResponse(replica_addresses=self.replica_addresses)
@@ -305,35 +800,70 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
 
     def DeleteMessage(self, request, context):
         response = self.storage.delete_message(request.username, request.recipient)
-        if self.is_leader:
-            self.Broadcast_Sync()
+        if response["status"] == "success" and not self.replicate():
+            return chat_pb2.Response(status="error", message=self.unreplicated("Message deleted"))
         return chat_pb2.Response(status=response["status"], message=response["message"])
 
     def DeleteAccount(self, request, context):
         response = self.storage.delete_account(request.username, request.password)
         if response["status"] == "success":
-            self.online_users.pop(request.username, None)
-        if self.is_leader:
-            self.Broadcast_Sync()
+            self.unsubscribe(request.username)
+            self.tokens.revoke_user(request.username)
+            if not self.replicate():
+                return chat_pb2.Response(status="error", message=self.unreplicated("Account deleted"))
         return chat_pb2.Response(status=response["status"], message=response["message"])
 
-def serve(is_leader=False, leader_address=None, replica_addresses=None, port=50051):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def create_server(service, config=None):
+    """
+    A grpc.aio server for `service`, set up from a ServerConfig; call it from a running event
+    loop. Unary handlers run on `config.workers` threads, StreamHistory on its own
+    `config.stream_workers`, and ListenForMessages on the loop itself.
+    """
+    config = config or ServerConfig()
+    interceptors = [AsyncTokenAuthInterceptor(service.tokens)]
+    if config.stream_workers:
+        interceptors.append(StreamExecutorInterceptor(futures.ThreadPoolExecutor(max_workers=config.stream_workers)))
+    server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=config.workers),
+                             interceptors=interceptors,
+                             options=config.options(),
+                             maximum_concurrent_rpcs=config.max_concurrent_rpcs)
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(service, server)
+    return server
+
+async def run_server(service, address, config=None):
+    server = create_server(service, config)
+    server.add_insecure_port(address)
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+
+def serve(is_leader=False, leader_address=None, replica_addresses=None, port=50051,
+          hash_workers=2, hash_queue=4, credential_ttl=300, session_ttl=3600, mailbox_size=DEFAULT_MAILBOX_SIZE,
+          config=None, sync_quorum="all", sync_timeout=2.0, max_batch=DEFAULT_MAX_BATCH, batch_window=DEFAULT_WINDOW,
+          replication_window=DEFAULT_REPLICATION_WINDOW):
+    # keep hash_queue below config.workers, so logins can never take up every gRPC worker
+    hasher = PasswordHasher(workers=hash_workers, max_pending=hash_queue, cache_ttl=credential_ttl)
     chat_service = ChatService(
         port=port,
         is_leader=is_leader,
         leader_address=leader_address,
-        replica_addresses=replica_addresses
+        replica_addresses=replica_addresses,
+        hasher=hasher,
+        tokens=SessionTokens(ttl=session_ttl),
+        mailbox_size=mailbox_size,
+        sync_quorum=sync_quorum,
+        sync_timeout=sync_timeout,
+        max_batch=max_batch,
+        batch_window=batch_window,
+        replication_window=replication_window
     )
-    chat_pb2_grpc.add_ChatServiceServicer_to_server(chat_service, server)
-    server.add_insecure_port(f"0.0.0.0:{port}")
     print(f"Starting {'leader' if is_leader else 'follower'} server on port {port}...")
-    server.start()
     try:
-        while True:
-            time.sleep(86400)
+        asyncio.run(run_server(chat_service, f"0.0.0.0:{port}", config))
     except KeyboardInterrupt:
-        server.stop(0)
+        pass
 
 if __name__ == "__main__":
     import argparse
@@ -342,11 +872,38 @@ if __name__ == "__main__":
     parser.add_argument('--port', type=int, default=50051)
     parser.add_argument('--replicas', nargs='*', default=[])
     parser.add_argument('--leader_address', type=str, default='0.0.0.0:50051')
+    parser.add_argument('--hash-workers', type=int, default=2, help="Threads running bcrypt")
+    parser.add_argument('--hash-queue', type=int, default=4, help="Logins allowed to wait for bcrypt before new ones are refused")
+    parser.add_argument('--credential-ttl', type=int, default=300, help="Seconds a verified login is remembered; 0 disables")
+    parser.add_argument('--session-ttl', type=int, default=3600, help="Seconds an unused session token stays valid")
+    parser.add_argument('--mailbox-size', type=int, default=DEFAULT_MAILBOX_SIZE, help="Messages queued for an online user before the rest are left unread")
+    parser.add_argument('--sync-quorum', choices=SYNC_QUORUMS, default="all",
+                        help="Replicas that must have a write before the client is answered: 1, a majority of the cluster, or all")
+    parser.add_argument('--sync-timeout', type=float, default=2.0, help="Seconds a write waits for its quorum")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help="Messages stored and replicated together at most")
+    parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_WINDOW * 1000,
+                        help="Milliseconds a batch waits to fill up, only while the server is busy")
+    parser.add_argument('--replication-window', type=int, default=DEFAULT_REPLICATION_WINDOW,
+                        help="Log entries pushed to a follower before the leader waits for its ack")
+    add_server_arguments(parser)
     args = parser.parse_args()
+    if args.hash_queue >= args.workers:
+        parser.error("--hash-queue must be below --workers, or waiting logins can hold every worker")
 
     serve(
         is_leader=args.leader,
         leader_address=args.leader_address,
         replica_addresses=args.replicas,
-        port=args.port
+        port=args.port,
+        hash_workers=args.hash_workers,
+        hash_queue=args.hash_queue,
+        credential_ttl=args.credential_ttl,
+        session_ttl=args.session_ttl,
+        mailbox_size=args.mailbox_size,
+        config=ServerConfig.from_args(args),
+        sync_quorum=args.sync_quorum,
+        sync_timeout=args.sync_timeout,
+        max_batch=args.max_batch,
+        batch_window=args.batch_window_ms / 1000,
+        replication_window=args.replication_window
     )
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+Settings for the gRPC server: thread pools, the concurrency limit, keepalive and message
+sizes. serve() and load_test.py both build their servers from a ServerConfig, and
+add_server_arguments() puts every field on the command line.
+"""
+import asyncio
+import inspect
+import grpc
+
+DEFAULT_MAX_MESSAGE_BYTES = 4 * 1024 * 1024  # gRPC's own default receive limit
+
+
+class ServerConfig:
+    """
+    workers: threads running unary calls.
+    stream_workers: threads running the streaming calls that are plain generators
+        (StreamHistory), so long downloads can't take up the unary workers. 0 runs them
+        on `workers` as well. ListenForMessages runs on the event loop either way.
+    max_concurrent_rpcs: calls in progress, open listeners included, beyond which new
+        calls fail with RESOURCE_EXHAUSTED. None means no limit.
+    keepalive_time: seconds of silence on a connection before the server pings it. A
+        peer that doesn't answer within keepalive_timeout seconds is dropped, which
+        also ends its listener. None keeps gRPC's default of two hours.
+    max_message_bytes: largest message the server sends or accepts.
+    reuse_port: let several processes listen on the same port (SO_REUSEPORT).
+    """
+    def __init__(self, workers=10, stream_workers=4, max_concurrent_rpcs=None, keepalive_time=None,
+                 keepalive_timeout=20, max_message_bytes=DEFAULT_MAX_MESSAGE_BYTES, reuse_port=False):
+        self.workers = workers
+        self.stream_workers = stream_workers
+        self.max_concurrent_rpcs = max_concurrent_rpcs or None
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.max_message_bytes = max_message_bytes
+        self.reuse_port = reuse_port
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(workers=args.workers, stream_workers=args.stream_workers, max_concurrent_rpcs=args.max_concurrent_rpcs,
+                   keepalive_time=args.keepalive_time, keepalive_timeout=args.keepalive_timeout,
+                   max_message_bytes=args.max_message_bytes)
+
+    def options(self):
+        """gRPC channel arguments for grpc.aio.server()."""
+        options = [
+            ("grpc.max_send_message_length", self.max_message_bytes),
+            ("grpc.max_receive_message_length", self.max_message_bytes),
+        ]
+        if self.keepalive_time:
+            options += [
+                ("grpc.keepalive_time_ms", int(self.keepalive_time * 1000)),
+                ("grpc.keepalive_timeout_ms", int(self.keepalive_timeout * 1000)),
+                # listeners sit on streams with no traffic, which is when pings matter
+                ("grpc.keepalive_permit_without_calls", 1),
+            ]
+        if self.reuse_port:
+            options.append(("grpc.so_reuseport", 1))
+        return options
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--workers', type=int, default=10, help="Threads running unary calls")
+    parser.add_argument('--stream-workers', type=int, default=4, help="Threads running StreamHistory; 0 shares --workers")
+    parser.add_argument('--max-concurrent-rpcs', type=int, default=0,
+                        help="Calls in progress, listeners included, before new ones are refused; 0 means no limit")
+    parser.add_argument('--keepalive-time', type=float, default=None, help="Seconds of silence before the server pings a client")
+    parser.add_argument('--keepalive-timeout', type=float, default=20, help="Seconds to wait for a ping answer before dropping the client")
+    parser.add_argument('--max-message-bytes', type=int, default=DEFAULT_MAX_MESSAGE_BYTES, help="Largest message sent or accepted")
+
+
+class _Abort(Exception):
+    pass
+
+
+class _ThreadContext:
+    """A grpc.aio servicer context as a plain handler running on another thread expects it."""
+    def __init__(self, context):
+        self._context = context
+
+    def abort(self, code, details=""):
+        # the aio abort is a coroutine; carry it back to the event loop instead
+        raise _Abort(code, details)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+_DONE = object()
+
+
+class StreamExecutorInterceptor(grpc.aio.ServerInterceptor):
+    """
+    Runs streaming handlers that are plain generators on `executor`. Each response is
+    produced on one of its threads and sent from the event loop. Unary and coroutine
+    handlers are left as they are.
+    """
+    def __init__(self, executor):
+        self.executor = executor
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or not handler.unary_stream or inspect.isasyncgenfunction(handler.unary_stream):
+            return handler
+        executor = self.executor
+
+        async def unary_stream(request, context):
+            loop = asyncio.get_running_loop()
+            try:
+                responses = await loop.run_in_executor(executor, handler.unary_stream, request, _ThreadContext(context))
+                responses = iter(responses)
+                while True:
+                    response = await loop.run_in_executor(executor, next, responses, _DONE)
+                    if response is _DONE:
+                        return
+                    yield response
+            except _Abort as abort:
+                await context.abort(*abort.args)
+
+        return grpc.unary_stream_rpc_method_handler(
+            unary_stream, handler.request_deserializer, handler.response_serializer)
@@ -0,0 +1,102 @@
+"""
+Snapshots for followers that can't catch up from the replication log.
+
+A snapshot used to travel inline in one SyncData response. That response had to fit
+in gRPC's message size limit and was built in memory on the leader and again on the
+follower. Now the leader writes a consistent copy of its database to a file with
+SQLite's backup API (Storage.backup) and streams the file in chunks with
+SnapshotStream. The follower appends the chunks to a part file next to its own
+database, restores from it once complete (Storage.restore), and then replays the log
+from the snapshot's last seq. Neither side holds more than a chunk in memory.
+
+The transfer is resumable. The leader keeps its last few snapshot files. A follower
+whose stream broke, or that was restarted, asks for the same snapshot again from the
+size of its part file. If the leader has dropped the snapshot in the meantime, it
+starts a new one and the follower starts its part file over.
+"""
+import glob
+import os
+import secrets
+import threading
+
+SNAPSHOT_CHUNK_BYTES = 256 * 1024  # well inside gRPC's 4 MiB default message limit
+KEPT_SNAPSHOTS = 2
+
+
+class SnapshotIncomplete(Exception):
+    """The snapshot stream ended before the whole file arrived."""
+
+
+class Snapshot:
+    """
+    A backup file on the leader. `last_seq` is the newest log entry it includes, and
+    `sessions` and `online_usernames` the state outside the database when it was taken.
+    """
+    def __init__(self, snapshot_id, path, last_seq, sessions, online_usernames):
+        self.id = snapshot_id
+        self.path = path
+        self.last_seq = last_seq
+        self.sessions = sessions
+        self.online_usernames = online_usernames
+        self.size = os.path.getsize(path)
+
+    def chunks(self, offset=0, chunk_bytes=SNAPSHOT_CHUNK_BYTES):
+        """(offset, data) for each chunk of the file from `offset` on."""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                data = f.read(chunk_bytes)
+                if not data:
+                    return
+                yield offset, data
+                offset += len(data)
+
+
+class SnapshotStore:
+    """The leader's snapshot files, kept beside `db_name` so an interrupted transfer can resume."""
+    def __init__(self, db_name, keep=KEPT_SNAPSHOTS):
+        self.prefix = db_name
+        self.keep = keep
+        self.snapshots = {}  # id -> Snapshot, oldest first
+        self.lock = threading.Lock()
+        # left behind by an earlier run; nobody can resume them against a new log
+        for path in glob.glob(f"{glob.escape(self.prefix)}.*.snapshot"):
+            os.remove(path)
+
+    def create(self, storage, state):
+        """
+        Backs up `storage` to a new snapshot file. `state()` returns the sessions and online
+        usernames to send with it, and is called after the backup, so that replaying the
+        log from the snapshot's last seq brings them up to date.
+        """
+        snapshot_id = secrets.token_hex(8)
+        path = f"{self.prefix}.{snapshot_id}.snapshot"
+        last_seq = storage.backup(path)
+        snapshot = Snapshot(snapshot_id, path, last_seq, *state())
+        with self.lock:
+            self.snapshots[snapshot_id] = snapshot
+            while len(self.snapshots) > self.keep:
+                # a transfer still reading the file keeps it open until it finishes
+                os.remove(self.snapshots.pop(next(iter(self.snapshots))).path)
+        return snapshot
+
+    def get(self, snapshot_id):
+        with self.lock:
+            return self.snapshots.get(snapshot_id)
+
+
+def part_path(db_name, snapshot_id):
+    """Where a follower downloads snapshot `snapshot_id` to."""
+    return f"{db_name}.{snapshot_id}.part"
+
+
+def partial_download(db_name):
+    """(snapshot id, bytes so far) of a download left unfinished, or ("", 0)."""
+    for path in glob.glob(f"{glob.escape(db_name)}.*.part"):
+        return path[len(db_name) + 1:-len(".part")], os.path.getsize(path)
+    return "", 0
+
+
+def discard_downloads(db_name):
+    for path in glob.glob(f"{glob.escape(db_name)}.*.part"):
+        os.remove(path)
@@ -1,13 +1,110 @@
+import base64
+import json
 import sqlite3
-import bcrypt
-import time
 import threading
+from auth import Overloaded, PasswordHasher
+from idgen import IdGenerator, first_id
+from accounts import AccountIndex
+
+# Numbered schema migrations; PRAGMA user_version records how many have been applied.
+# Append new ones to the end, never edit or reorder the existing ones.
+MIGRATIONS = [
+    # 1: initial schema
+    (
+        "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password_hash BLOB)",
+        "CREATE TABLE IF NOT EXISTS messages (id INT PRIMARY KEY, sender TEXT, recipient TEXT, message TEXT, status TEXT)",
+    ),
+    # 2: indexes for reading unread messages, and for deleting by sender or recipient
+    (
+        "CREATE INDEX IF NOT EXISTS messages_recipient_status ON messages (recipient, status, id)",
+        "CREATE INDEX IF NOT EXISTS messages_sender_recipient ON messages (sender, recipient, id)",
+    ),
+    # 3: index for walking a user's message history in id order, whatever the status
+    (
+        "CREATE INDEX IF NOT EXISTS messages_recipient_id ON messages (recipient, id)",
+    ),
+    # 4: append-only log of the leader's writes, which followers replay in `seq` order
+    (
+        "CREATE TABLE IF NOT EXISTS replication_log (seq INTEGER PRIMARY KEY, op TEXT NOT NULL, args TEXT NOT NULL)",
+    ),
+]
+
+
+# page size used when a request doesn't give one, and the largest page a request may ask for
+DEFAULT_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 100
+DEFAULT_SEARCH_LIMIT = 20
+
+
+def encode_cursor(username):
+    """Opaque continuation token for the accounts after `username`."""
+    return base64.urlsafe_b64encode(username.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """The username a cursor continues after. Raises ValueError for a malformed cursor."""
+    return base64.urlsafe_b64decode(cursor.encode()).decode()
+
+
+# messages per history batch when a request doesn't say, and the most one batch may hold
+DEFAULT_HISTORY_BATCH = 500
+MAX_HISTORY_BATCH = 5000
+# larger than any message id
+MAX_MESSAGE_ID = (1 << 63) - 1
+# most replication log entries handed out per read_log() call
+MAX_LOG_BATCH = 1000
+
+
+def history_bounds(after_id=0, before_id=0, since_ms=0, until_ms=0, cursor=None):
+    """
+    Exclusive (after, before) message id bounds for a history request. Ids start with their
+    timestamp, so a time range is just another id range. A cursor from an earlier page or
+    chunk resumes after the last message it covered. 0 means unbounded throughout.
+    Raises ValueError for a malformed cursor.
+    """
+    after = max(after_id, first_id(since_ms) - 1 if since_ms else 0)
+    before = min(before_id or MAX_MESSAGE_ID, first_id(until_ms) if until_ms else MAX_MESSAGE_ID)
+    if cursor:
+        after = max(after, int(decode_cursor(cursor)))
+    return after, before
+
+
+def migrate(conn):
+    """Apply the pending migrations, each in its own transaction. Returns the schema version."""
+    while True:
+        with conn:
+            # the write lock makes concurrent servers on one database take turns
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return version
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
 
 class Storage:
-    def __init__(self, db_name):
+    # the newest `limit` unread messages sent to a user by someone else
+    UNREAD_MESSAGES = """
+        FROM messages
+        WHERE recipient=?
+        AND status='unread'
+        AND sender != ?
+        ORDER BY id DESC LIMIT ?
+    """
+
+    def __init__(self, db_name, ids=None, hasher=None):
         self.db_name = db_name
+        # message ids come from memory, not from the database
+        self.ids = ids if ids is not None else IdGenerator()
+        # bcrypt runs on the hasher's own threads, not on the caller's
+        self.hasher = hasher if hasher is not None else PasswordHasher()
         self.local = threading.local()
+        # whether writes are appended to replication_log; only the leader's are
+        self.log_writes = False
         self.initialize_database()
+        # kept in step with the users table by register, delete_account and syncing
+        self.accounts = AccountIndex(row[0] for row in self.execute_query("SELECT username FROM users"))
 
     def get_connection(self):
         """Ensures each thread gets its own SQLite connection."""
@@ -17,12 +114,9 @@ class Storage:
         return self.local.conn
 
     def initialize_database(self):
-        """Creates tables if they do not exist."""
+        """Creates the tables, or upgrades an existing database to the current schema."""
         conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password_hash BLOB)")
-        cursor.execute("CREATE TABLE IF NOT EXISTS messages (id INT PRIMARY KEY, sender TEXT, recipient TEXT, message TEXT, status TEXT)")
-        conn.commit()
+        migrate(conn)
         conn.close()
 
     def execute_query(self, query, params=(), commit=False):
@@ -38,72 +132,130 @@ class Storage:
         """Handles user login or registration."""
         cursor = self.execute_query("SELECT password_hash FROM users WHERE username=?", (username,))
         user = cursor.fetchone()
-        if user:
-            if bcrypt.checkpw(password.encode(), user[0]):
-                return {"status": "success"}
-            return {"status": "error", "message": "Invalid credentials"}
+        try:
+            if user:
+                if self.hasher.check(username, password, user[0]):
+                    return {"status": "success"}
+                return {"status": "error", "message": "Invalid credentials"}
+            password_hash = self.hasher.hash(password)
+        except Overloaded:
+            return {"status": "error", "message": "Server busy, please try again"}
+        conn = self.get_connection()
+        with conn:
+            conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
+            self.append_log(conn, "add_user", username, base64.b64encode(password_hash).decode())
+        self.accounts.add(username)
+        return {"status": "success"}
+
+    def list_accounts(self, page_num=1, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        Lists users with pagination. A `cursor` from the previous page seeks straight to the
+        next one on the username index; `page_num` alone has to skip over every earlier page.
+        """
+        page_size = min(max(page_size or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except ValueError:
+                return {"status": "error", "message": "Invalid cursor"}
+            rows = self.execute_query("SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?", (after, page_size))
         else:
-            password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-            self.execute_query("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash), commit=True)
-            return {"status": "success"}
-
-    def list_accounts(self, page_num):
-        """Lists users with pagination."""
-        num_per_page = 5
-        offset = (page_num - 1) * num_per_page
-        cursor = self.execute_query("SELECT username FROM users ORDER BY username LIMIT ? OFFSET ?", (num_per_page, offset))
+            offset = (max(page_num, 1) - 1) * page_size
+            rows = self.execute_query("SELECT username FROM users ORDER BY username LIMIT ? OFFSET ?", (page_size, offset))
+        usernames = [row[0] for row in rows.fetchall()]
         return {
             'status': 'success',
-            'usernames': [row[0] for row in cursor.fetchall()]
+            'usernames': usernames,
+            # empty once the last page has been returned
+            'next_cursor': encode_cursor(usernames[-1]) if len(usernames) == page_size else ""
+        }
+
+    def search_accounts(self, query, limit=DEFAULT_SEARCH_LIMIT, substring=False):
+        """
+        Usernames starting with `query`, or containing it with `substring`, in order.
+        Answered from the in-memory index without touching the database.
+        """
+        limit = min(max(limit or DEFAULT_SEARCH_LIMIT, 1), MAX_PAGE_SIZE)
+        matches = self.accounts.substring(query, limit) if substring else self.accounts.prefix(query, limit)
+        return {
+            'status': 'success',
+            'usernames': matches
         }
 
     def send_message(self, sender, recipient, message, status='unread', message_id=None):
         """Stores a message in the database."""
-        cursor = self.execute_query("SELECT username FROM users WHERE username=?", (recipient,))
-        if not cursor.fetchone():
-            return {"status": "error", "message": "Recipient does not exist"}
-
         if message_id is None:
-            message_id = int(time.time() * 1000)  # More granularity
+            message_id = self.ids.next_id()
+        return self.send_messages([(message_id, sender, recipient, message, status)])[0]
 
-        self.execute_query(
-            "INSERT OR IGNORE INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)",
-            (message_id, sender, recipient, message, status),
-            commit=True
-        )
-        return {"status": "success"}
+    def send_messages(self, rows):
+        """
+        Stores a batch of (id, sender, recipient, message, status) rows in one transaction.
+        Returns a result per row; a row whose recipient doesn't exist is skipped.
+        """
+        conn = self.get_connection()
+        results = []
+        with conn:
+            for row in rows:
+                if not conn.execute("SELECT 1 FROM users WHERE username=?", (row[2],)).fetchone():
+                    results.append({"status": "error", "message": "Recipient does not exist"})
+                    continue
+                conn.execute("INSERT OR IGNORE INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)", row)
+                self.append_log(conn, "add_message", *row)
+                results.append({"status": "success"})
+        return results
 
+    def mark_unread(self, message_ids):
+        """Returns pushed messages that never reached the recipient to their unread queue."""
+        conn = self.get_connection()
+        with conn:
+            conn.executemany("UPDATE messages SET status='unread' WHERE id=?", [(message_id,) for message_id in message_ids])
+            self.append_log(conn, "set_status", "unread", list(message_ids))
 
     def read_messages(self, username, limit=10):
         """Retrieves unread messages for a user."""
-        cursor = self.execute_query("""
-            SELECT id, sender, recipient, message 
-            FROM messages 
-            WHERE recipient=? 
-            AND status='unread' 
-            AND sender != ? 
-            ORDER BY id DESC LIMIT ?
-        """, (username, username, limit))
-        
-        messages = [{"id": row["id"], "sender": row["sender"], "message": row["message"]} for row in cursor.fetchall()]
+        conn = self.get_connection()
+        with conn:
+            # select and mark as read in one transaction that holds the write lock from the start,
+            # so two concurrent readers can't both get the same messages
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute("SELECT id, sender, recipient, message " + self.UNREAD_MESSAGES, (username, username, limit))
+            messages = [{"id": row["id"], "sender": row["sender"], "message": row["message"]} for row in cursor.fetchall()]
+            if messages:
+                conn.execute("UPDATE messages SET status='read' WHERE id IN (SELECT id " + self.UNREAD_MESSAGES + ")", (username, username, limit))
+                self.append_log(conn, "set_status", "read", [message["id"] for message in messages])
 
         if messages:
-            for message in messages:
-                self.execute_query("UPDATE messages SET status='read' WHERE id=?", (message["id"],), commit=True)
-
             return {"status": "success", "messages": messages}
         else:
             messages = [{"id": -1, "sender": "System", "message": "No unread messages from other users"}]
             return {"status": "error", "messages": messages}
 
+    def iter_history(self, username, after_id=0, before_id=MAX_MESSAGE_ID, batch_size=DEFAULT_HISTORY_BATCH):
+        """
+        Yields the messages sent to `username` with after_id < id < before_id, oldest first,
+        whatever their status. Rows are fetched `batch_size` at a time, each batch with its own
+        query that seeks past the last id, so memory stays bounded however long the history is.
+        """
+        while True:
+            rows = self.execute_query("SELECT id, sender, message, status FROM messages WHERE recipient=? AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                                      (username, after_id, before_id, batch_size)).fetchall()
+            for row in rows:
+                yield {"id": row[0], "sender": row[1], "message": row[2], "status": row[3]}
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
     def delete_message(self, username, recipient):
         """Deletes the most recent message if the sender is the current user."""
         try:
             sql = " SELECT id FROM messages WHERE recipient=? AND sender=? ORDER BY id DESC LIMIT 1"
             cursor = self.execute_query(sql, (recipient, username))
             message_id = cursor.fetchone()[0]
-            self.execute_query("DELETE FROM messages WHERE id=? AND sender=? AND recipient=?", 
-                               (int(message_id), username, recipient), commit=True)
+            conn = self.get_connection()
+            with conn:
+                conn.execute("DELETE FROM messages WHERE id=? AND sender=? AND recipient=?", (int(message_id), username, recipient))
+                self.append_log(conn, "delete_message", int(message_id))
             return {"status": "success", 'message': "Message deleted successfully"}
         except sqlite3.IntegrityError:
             return {"status": "error", "message": "Message not found or you are not the sender"}
@@ -114,14 +266,19 @@ class Storage:
         try:
             cursor = self.execute_query("SELECT password_hash FROM users WHERE username=?", (username,))
             user = cursor.fetchone()
-            if not user or not bcrypt.checkpw(password.encode(), user[0]):
+            if not user or not self.hasher.check(username, password, user[0]):
                 return {"status": "error", "message": "Invalid credentials"}
 
             # Delete the user and their messages
-            self.execute_query("DELETE FROM users WHERE username=?", (username,), commit=True)
-            self.execute_query("DELETE FROM messages WHERE recipient=?", (username,), commit=True)
+            conn = self.get_connection()
+            with conn:
+                self.remove_account(conn, username)
+                self.append_log(conn, "delete_account", username)
+            self.accounts.remove(username)
 
             return {"status": "success", 'message': "Account deleted successfully"}
+        except Overloaded:
+            return {"status": "error", "message": "Server busy, please try again"}
         except Exception as e:
             return {"status": "error", "message": str(e)}
         
@@ -144,4 +301,128 @@ class Storage:
         cursor.executemany("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)",
                            [(user.username, user.password_hash) for user in users])
         conn.commit()
+        for user in users:
+            self.accounts.add(user.username)
         return {"status": "success", 'message': "Data stored successfully"}
+
+    def load_snapshot(self, messages, users, last_seq):
+        """
+        Replaces every user and message with a full copy of the leader's, taken at log entry
+        `last_seq`. The local log is reset to a single snapshot entry at that seq, so later
+        entries from the leader carry on from there.
+        """
+        conn = self.get_connection()
+        with conn:
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM users")
+            conn.execute("DELETE FROM replication_log")
+            conn.executemany("INSERT INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)",
+                             [(msg.id, msg.sender, msg.recipient, msg.message, msg.status) for msg in messages])
+            conn.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?)",
+                             [(user.username, user.password_hash) for user in users])
+            if last_seq:
+                conn.execute("INSERT INTO replication_log (seq, op, args) VALUES (?, 'snapshot', '[]')", (last_seq,))
+        self.accounts = AccountIndex(user.username for user in users)
+
+    def backup(self, path):
+        """
+        Writes a consistent copy of the whole database, log included, to a new file at `path`
+        with SQLite's online backup API. Returns the seq of the newest log entry in the copy.
+        """
+        target = sqlite3.connect(path)
+        try:
+            # one step, under a single read lock, so no write lands halfway through
+            self.get_connection().backup(target)
+            return target.execute("SELECT COALESCE(MAX(seq), 0) FROM replication_log").fetchone()[0]
+        finally:
+            target.close()
+
+    def restore(self, path):
+        """
+        Replaces the whole database, log included, with the backup at `path`, in a single
+        step that other connections see all at once. Returns the new log head.
+        """
+        source = sqlite3.connect(path)
+        try:
+            source.backup(self.get_connection())
+        finally:
+            source.close()
+        self.accounts = AccountIndex(row[0] for row in self.execute_query("SELECT username FROM users"))
+        return self.log_head()
+
+    def remove_account(self, conn, username):
+        """Deletes a user and the messages sent to them, inside the caller's transaction on `conn`."""
+        conn.execute("DELETE FROM users WHERE username=?", (username,))
+        conn.execute("DELETE FROM messages WHERE recipient=?", (username,))
+
+    def append_log(self, conn, op, *args):
+        """Adds a write to the replication log, inside the caller's transaction on `conn`, if logging is on."""
+        if self.log_writes:
+            conn.execute("INSERT INTO replication_log (op, args) VALUES (?, ?)", (op, json.dumps(args)))
+
+    def log(self, op, *args):
+        """Logs a change kept outside the database, such as a new session, for the followers to replay."""
+        conn = self.get_connection()
+        with conn:
+            self.append_log(conn, op, *args)
+
+    def log_head(self):
+        """Seq of the newest log entry, or 0 for an empty log."""
+        return self.execute_query("SELECT COALESCE(MAX(seq), 0) FROM replication_log").fetchone()[0]
+
+    def log_covers(self, after_seq):
+        """
+        Whether the log still holds every entry after `after_seq`, so a follower that has
+        applied everything up to there can catch up from it.
+        """
+        head = self.log_head()
+        first = self.execute_query("SELECT seq, op FROM replication_log ORDER BY seq LIMIT 1").fetchone()
+        if first is None:
+            return after_seq == head
+        # a snapshot entry stands for everything up to and including its own seq
+        floor = first[0] if first[1] == "snapshot" else first[0] - 1
+        return floor <= after_seq <= head
+
+    def read_log(self, after_seq, limit=MAX_LOG_BATCH):
+        """The oldest `limit` log entries after `after_seq`."""
+        rows = self.execute_query("SELECT seq, op, args FROM replication_log WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit))
+        return [{"seq": row[0], "op": row[1], "args": row[2]} for row in rows.fetchall()]
+
+    def apply_log(self, entries):
+        """
+        Replays entries from the leader's log, oldest first, and copies them into this log
+        under the same seq, all in one transaction. Entries at or below the local head were
+        applied already and are skipped. Entries with nothing to change in the database,
+        such as sessions, are only copied. Returns the new head.
+        """
+        conn = self.get_connection()
+        head = self.log_head()
+        accounts = []  # (op, username) in log order, for the index once the transaction is in
+        with conn:
+            for entry in entries:
+                if entry.seq <= head:
+                    continue
+                args = json.loads(entry.args)
+                if entry.op == "add_user":
+                    username, password_hash = args
+                    conn.execute("INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)",
+                                 (username, base64.b64decode(password_hash)))
+                    accounts.append((entry.op, username))
+                elif entry.op == "add_message":
+                    conn.execute("INSERT OR IGNORE INTO messages (id, sender, recipient, message, status) VALUES (?, ?, ?, ?, ?)", args)
+                elif entry.op == "set_status":
+                    status, message_ids = args
+                    conn.executemany("UPDATE messages SET status=? WHERE id=?", [(status, message_id) for message_id in message_ids])
+                elif entry.op == "delete_message":
+                    conn.execute("DELETE FROM messages WHERE id=?", args)
+                elif entry.op == "delete_account":
+                    self.remove_account(conn, args[0])
+                    accounts.append((entry.op, args[0]))
+                conn.execute("INSERT INTO replication_log (seq, op, args) VALUES (?, ?, ?)", (entry.seq, entry.op, entry.args))
+                head = entry.seq
+        for op, username in accounts:
+            if op == "add_user":
+                self.accounts.add(username)
+            else:
+                self.accounts.remove(username)
+        return head
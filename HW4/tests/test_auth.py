@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import unittest
+from unittest.mock import patch
+from auth import CredentialCache, Overloaded, PasswordHasher
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher(workers=1, max_pending=1, cache_ttl=60)
+
+    def tearDown(self):
+        self.hasher.shutdown()
+
+    def test_hash_and_check(self):
+        password_hash = self.hasher.hash("secret")
+        self.assertTrue(self.hasher.check("alice", "secret", password_hash))
+        self.assertFalse(self.hasher.check("alice", "wrong", password_hash))
+
+    def test_cached_login_skips_bcrypt(self):
+        password_hash = self.hasher.hash("secret")
+        self.hasher.check("alice", "secret", password_hash)
+        with patch("auth.bcrypt.checkpw") as checkpw:
+            self.assertTrue(self.hasher.check("alice", "secret", password_hash))
+            checkpw.assert_not_called()
+
+    def test_cache_entry_stops_matching_when_hash_changes(self):
+        cache = CredentialCache(ttl=60)
+        cache.put("alice", "secret", b"old-hash")
+        self.assertFalse(cache.get("alice", "secret", b"new-hash"))
+
+    def test_overloaded_when_queue_full(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hashpw(password, salt):
+            started.set()
+            release.wait(5)
+            return b"hash"
+
+        with patch("auth.bcrypt.hashpw", side_effect=slow_hashpw):
+            worker = threading.Thread(target=self.hasher.hash, args=("secret",))
+            worker.start()
+            started.wait(5)
+            with self.assertRaises(Overloaded):
+                self.hasher.hash("other")
+            release.set()
+            worker.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
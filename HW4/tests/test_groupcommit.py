@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import unittest
+from groupcommit import GroupCommit
+
+
+class Recorder:
+    """Commit and replicate functions that record their calls, and can be held up."""
+    def __init__(self):
+        self.batches = []
+        self.rounds = 0
+        self.commit_gate = threading.Event()
+        self.commit_gate.set()
+        self.fail = None
+
+    def commit(self, items):
+        self.commit_gate.wait(5)
+        if self.fail is not None:
+            raise self.fail
+        self.batches.append(items)
+        return [item * 10 for item in items]
+
+    def replicate(self):
+        self.rounds += 1
+        return True
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        self.writes = GroupCommit(self.recorder.commit, self.recorder.replicate, max_batch=4, window=0.01)
+
+    def test_lone_write_is_committed_and_replicated(self):
+        write = self.writes.submit(1)
+        self.assertEqual(write.committed.result(5), 10)
+        self.assertTrue(write.replicated.result(5))
+        self.assertEqual(self.recorder.batches, [[1]])
+        self.assertEqual(self.recorder.rounds, 1)
+
+    def test_queued_writes_share_a_batch(self):
+        # hold up the first commit so that the rest queue up behind it
+        self.recorder.commit_gate.clear()
+        first = self.writes.submit(0)
+        writes = [self.writes.submit(i) for i in range(1, 7)]
+        self.recorder.commit_gate.set()
+        self.assertEqual([write.committed.result(5) for write in [first] + writes], [i * 10 for i in range(7)])
+        for write in [first] + writes:
+            write.replicated.result(5)
+        # every write in order, at most max_batch at a time, and fewer rounds than writes
+        self.assertEqual([item for batch in self.recorder.batches for item in batch], list(range(7)))
+        self.assertTrue(all(len(batch) <= 4 for batch in self.recorder.batches))
+        self.assertLess(len(self.recorder.batches), 7)
+        self.assertLessEqual(self.recorder.rounds, len(self.recorder.batches))
+
+    def test_failed_commit_fails_its_writes(self):
+        self.recorder.fail = RuntimeError("disk full")
+        write = self.writes.submit(1)
+        with self.assertRaises(RuntimeError):
+            write.committed.result(5)
+        with self.assertRaises(RuntimeError):
+            write.replicated.result(5)
+        # the pipeline carries on with the next batch
+        self.recorder.fail = None
+        self.assertEqual(self.writes.submit(2).committed.result(5), 20)
+
+    def test_sync_waits_for_a_replication_round(self):
+        self.assertTrue(self.writes.sync().result(5))
+        self.assertEqual(self.recorder.rounds, 1)
+        self.assertEqual(self.recorder.batches, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
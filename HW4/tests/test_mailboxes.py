@@ -0,0 +1,52 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import queue
+import threading
+import unittest
+from mailboxes import Mailbox
+
+
+class TestMailbox(unittest.TestCase):
+    def test_get_nowait(self):
+        mailbox = Mailbox()
+        mailbox.put("a")
+        mailbox.put("b")
+        self.assertEqual(len(mailbox), 2)
+        self.assertEqual(mailbox.get_nowait(), "a")
+        self.assertEqual(mailbox.get_nowait(), "b")
+        with self.assertRaises(queue.Empty):
+            mailbox.get_nowait()
+
+    def test_put_from_another_thread_wakes_the_listener(self):
+        mailbox = Mailbox()
+
+        async def listen():
+            received = asyncio.ensure_future(mailbox.get())
+            await asyncio.sleep(0.05)
+            self.assertFalse(received.done())
+            threading.Thread(target=mailbox.put, args=("hello",)).start()
+            return await asyncio.wait_for(received, 5)
+
+        self.assertEqual(asyncio.run(listen()), "hello")
+        self.assertIsNone(mailbox.waiter)
+
+    def test_cancelled_listener_is_forgotten(self):
+        mailbox = Mailbox()
+
+        async def listen():
+            received = asyncio.ensure_future(mailbox.get())
+            await asyncio.sleep(0.05)
+            received.cancel()
+            await asyncio.sleep(0)
+
+        asyncio.run(listen())
+        self.assertIsNone(mailbox.waiter)
+        mailbox.put("later")
+        self.assertEqual(mailbox.get_nowait(), "later")
+
+
+if __name__ == "__main__":
+    unittest.main()
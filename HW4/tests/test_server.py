@@ -2,12 +2,26 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import asyncio
+import glob
+import inspect
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 import chat_pb2
 import chat_pb2_grpc
-from server import ChatService,get_local_ip
+import server
+import storage
+import idgen
+from server import ChatService, create_server, get_local_ip
+from mailboxes import Mailbox
+from serverconfig import ServerConfig
+from tokens import TokenClientInterceptor, token_digest
 from storage import Storage
+from snapshots import KEPT_SNAPSHOTS
 import queue
 import grpc
 
@@ -18,6 +32,8 @@ class TestChatService(unittest.TestCase):
         self.addCleanup(patcher.stop)
 
         self.mock_storage = self.MockStorage.return_value
+        self.mock_storage.log_head.return_value = 0
+        self.mock_storage.send_messages.side_effect = lambda rows: [{"status": "success"} for _ in rows]
         self.chat_service = ChatService(
             port=50052,
             is_leader=True,
@@ -45,19 +61,23 @@ class TestChatService(unittest.TestCase):
         self.assertNotIn("bob", self.chat_service.online_users)
 
     def test_send_message_success(self):
-        self.chat_service.online_users = {"bob": queue.Queue()}
-        self.mock_storage.send_message.return_value = {"status": "success"}
-
+        self.chat_service.online_users = {"bob": Mailbox()}
         request = chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hello!")
-        response = self.chat_service.SendMessage(request, None)
+        response = asyncio.run(self.chat_service.SendMessage(request, None))
 
         self.assertEqual(response.status, "success")
         self.assertIn("delivered", response.message)
 
+    def test_send_message_pushes_and_stores_the_same_id(self):
+        self.chat_service.online_users = {"bob": Mailbox()}
+        asyncio.run(self.chat_service.SendMessage(chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hello!"), None))
+        pushed = self.chat_service.online_users["bob"].get_nowait()
+        self.assertEqual(self.mock_storage.send_messages.call_args.args[0][0][0], pushed.id)
+
     def test_send_message_fails_if_not_leader(self):
         self.chat_service.is_leader = False
         request = chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hey!")
-        response = self.chat_service.SendMessage(request, None)
+        response = asyncio.run(self.chat_service.SendMessage(request, None))
 
         self.assertEqual(response.status, "error")
         self.assertIn("Not the leader", response.message)
@@ -104,7 +124,7 @@ class TestChatService(unittest.TestCase):
         self.chat_service.online_users = {"alice": MagicMock()}
         request = chat_pb2.SyncDataRequest(replica_address="127.0.0.1:50053")
 
-        response = self.chat_service.SyncData(request, None)
+        response = asyncio.run(self.chat_service.SyncData(request, None))
         self.assertEqual(response.status, "success")
         self.assertEqual(len(response.messages), 1)
         self.assertEqual(len(response.users), 1)
@@ -117,7 +137,7 @@ class TestChatService(unittest.TestCase):
         self.assertEqual(response.status, "success")
 
     def test_logout(self):
-        self.chat_service.online_users = {"alice": queue.Queue()}
+        self.chat_service.online_users = {"alice": Mailbox()}
         request = chat_pb2.LogoutRequest(username="alice")
         response = self.chat_service.Logout(request, None)
         self.assertEqual(response.status, "success")
@@ -156,16 +176,50 @@ class TestChatService(unittest.TestCase):
 
 
     def test_listen_for_messages_yields_message(self):
-        q = queue.Queue()
+        mailbox = Mailbox()
         msg = chat_pb2.Message(id=1, sender="bob", message="hi")
-        q.put(msg)
-        self.chat_service.online_users["alice"] = q
+        mailbox.put(msg)
+        self.chat_service.online_users["alice"] = mailbox
 
         request = chat_pb2.ListenForMessagesRequest(username="alice")
         context = MagicMock()
 
         generator = self.chat_service.ListenForMessages(request, context)
-        self.assertEqual(next(generator), msg)
+        self.assertEqual(asyncio.run(anext(generator)), msg)
+
+    def test_listeners_do_not_hold_workers(self):
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        async def start():
+            server = create_server(self.chat_service, ServerConfig(workers=2))
+            port = server.add_insecure_port("127.0.0.1:0")
+            await server.start()
+            return server, port
+
+        server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+        streams = []
+        try:
+            for i in range(20):
+                name = f"listener{i}"
+                self.chat_service.online_users[name] = Mailbox()
+                token = self.chat_service.tokens.issue(name)
+                stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(channel, TokenClientInterceptor(lambda token=token: token)))
+                streams.append(stub.ListenForMessages(chat_pb2.ListenForMessagesRequest(username=name)))
+
+            sender = self.chat_service.tokens.issue("alice")
+            stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(channel, TokenClientInterceptor(lambda: sender)))
+            for i in range(20):
+                request = chat_pb2.SendMessageRequest(username="alice", recipient=f"listener{i}", message=f"hello {i}")
+                self.assertEqual(stub.SendMessage(request, timeout=5).status, "success")
+            self.assertEqual([next(stream).message for stream in streams], [f"hello {i}" for i in range(20)])
+        finally:
+            for stream in streams:
+                stream.cancel()
+            channel.close()
+            asyncio.run_coroutine_threadsafe(server.stop(0), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
 
     def test_get_replica_addresses(self):
         self.chat_service.replica_addresses = ["127.0.0.1:50053", "127.0.0.1:50054"]
@@ -185,30 +239,228 @@ class TestChatService(unittest.TestCase):
                 chat_pb2.UserData(username="alice", password_hash=b"hash")
             ],
             replica_addresses=[],
-            online_usernames=["alice"]
+            online_usernames=["alice", "bob"],
+            snapshot=True
         )
+        mailbox = Mailbox()
+        self.chat_service.online_users = {"alice": mailbox}
 
         response = self.chat_service.FollowerSync(chat_pb2.FollowerSyncDataRequest(leader_address="127.0.0.1:50051"), None)
         self.assertEqual(response.status, "success")
-        self.assertIn("alice", self.chat_service.online_users)
+        self.assertIn("bob", self.chat_service.online_users)
+        # a listener already connected here keeps its mailbox
+        self.assertIs(self.chat_service.online_users["alice"], mailbox)
+
+    def test_sessions_follow_the_leader(self):
+        self.mock_storage.login_register_user.return_value = {"status": "success"}
+        self.mock_storage.get_all_messages.return_value = []
+        self.mock_storage.get_all_users.return_value = []
+        token = self.chat_service.Login(chat_pb2.LoginRequest(username="alice", password="secret"), None).token
+        self.assertEqual(self.chat_service.tokens.lookup(token), "alice")
+
+        sync = asyncio.run(self.chat_service.SyncData(chat_pb2.SyncDataRequest(replica_address="127.0.0.1:50053"), None))
+        self.chat_service.is_leader = False
+        self.chat_service.leader_address = "127.0.0.1:50051"
+        self.chat_service.leader_stub = MagicMock()
+        self.chat_service.leader_stub.SyncData.return_value = sync
+        self.chat_service.tokens.revoke(token)
+        self.chat_service.FollowerSync(chat_pb2.FollowerSyncDataRequest(), None)
+        self.assertEqual(self.chat_service.tokens.lookup(token), "alice")
+
+    def test_forwarded_reads_carry_the_session_token(self):
+        replica = MagicMock()
+        replica.ListAccounts.return_value = chat_pb2.ListAccountsResponse(status="success")
+        self.chat_service.replicas = [replica]
+        context = MagicMock()
+        context.invocation_metadata.return_value = [("session-token", "abc")]
+
+        self.chat_service.ListAccounts(chat_pb2.ListAccountsRequest(page_num=1), context)
+        self.assertEqual(replica.ListAccounts.call_args.kwargs["metadata"], [("session-token", "abc")])
+
+    def test_stream_history_chunks_by_count_and_size(self):
+        rows = [{"id": i, "sender": "alice", "message": "x" * 1000, "status": "read"} for i in range(1, 101)]
+        self.mock_storage.iter_history.return_value = iter(rows)
+
+        request = chat_pb2.StreamHistoryRequest(username="bob", chunk_size=50)
+        chunks = list(self.chat_service.StreamHistory(request, None))
+        # 50 messages of ~1 KB would be over the byte budget, so chunks close early
+        self.assertTrue(all(chunk.ByteSize() <= server.HISTORY_CHUNK_BYTES + 1100 for chunk in chunks))
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual([msg.id for chunk in chunks for msg in chunk.messages], list(range(1, 101)))
+        self.assertEqual(storage.history_bounds(cursor=chunks[0].resume_token)[0], chunks[0].messages[-1].id)
+
+    def test_stream_history_translates_ranges(self):
+        self.mock_storage.iter_history.return_value = iter([])
+        request = chat_pb2.StreamHistoryRequest(username="bob", after_id=10, since_ms=1750000000000, until_ms=1750000001000)
+        list(self.chat_service.StreamHistory(request, None))
+        username, after_id, before_id, _ = self.mock_storage.iter_history.call_args.args
+        self.assertEqual(username, "bob")
+        self.assertEqual(after_id, idgen.first_id(1750000000000) - 1)
+        self.assertEqual(before_id, idgen.first_id(1750000001000))
 
     def test_send_message_stored_when_recipient_offline(self):
-        self.mock_storage.send_message.return_value = {"status": "success"}
         self.chat_service.online_users = {}
 
         request = chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hi")
-        response = self.chat_service.SendMessage(request, None)
+        response = asyncio.run(self.chat_service.SendMessage(request, None))
 
         self.assertEqual(response.status, "success")
         self.assertIn("stored", response.message)
 
-    @patch("server.grpc")
-    def test_broadcast_sync_handles_errors(self, mock_grpc):
+    def test_full_mailbox_leaves_the_message_unread(self):
+        self.chat_service.online_users = {"bob": Mailbox(maxsize=1)}
+
+        request = chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hi")
+        self.assertIn("delivered", asyncio.run(self.chat_service.SendMessage(request, None)).message)
+        self.assertIn("stored", asyncio.run(self.chat_service.SendMessage(request, None)).message)
+        message_id = self.mock_storage.send_messages.call_args.args[0][0][0]
+        self.mock_storage.mark_unread.assert_called_once_with([message_id])
+
+    def test_concurrent_messages_are_stored_in_batches(self):
+        self.chat_service.Broadcast_Sync = MagicMock(return_value=True)
+
+        async def send_all():
+            requests = [chat_pb2.SendMessageRequest(username="alice", recipient="bob", message=str(i)) for i in range(20)]
+            return await asyncio.gather(*(self.chat_service.SendMessage(request, None) for request in requests))
+        self.assertTrue(all(response.status == "success" for response in asyncio.run(send_all())))
+
+        batches = [call.args[0] for call in self.mock_storage.send_messages.call_args_list]
+        self.assertEqual(sorted(row[3] for batch in batches for row in batch), sorted(str(i) for i in range(20)))
+        self.assertLess(len(batches), 20)
+        self.assertLessEqual(self.chat_service.Broadcast_Sync.call_count, len(batches))
+
+    def test_disconnected_listener_is_cleaned_up(self):
+        mailbox = Mailbox()
+        self.chat_service.online_users = {"alice": mailbox}
+        for i in (1, 2, 3):
+            mailbox.put(chat_pb2.Message(id=i, sender="bob", message="hi"))
+
+        async def listen_then_disconnect():
+            listener = self.chat_service.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice"), MagicMock())
+            await anext(listener)
+            await anext(listener)
+            # message 2 was handed over but the stream never asked for the next one
+            await listener.aclose()
+
+        asyncio.run(listen_then_disconnect())
+        self.assertNotIn("alice", self.chat_service.online_users)
+        self.mock_storage.mark_unread.assert_called_once_with([2, 3])
+        with self.assertRaises(queue.Full):
+            mailbox.put(chat_pb2.Message(id=4))
+
+    def test_disconnect_writes_off_the_event_loop(self):
+        self.chat_service.online_users = {"alice": Mailbox()}
+        self.chat_service.online_users["alice"].put(chat_pb2.Message(id=1))
+        threads = []
+        self.mock_storage.mark_unread.side_effect = lambda ids: threads.append(threading.current_thread())
+        self.mock_storage.log.side_effect = lambda *args: threads.append(threading.current_thread())
+
+        async def listen_then_disconnect():
+            listener = self.chat_service.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice"), MagicMock())
+            await anext(listener)
+            await listener.aclose()
+
+        asyncio.run(listen_then_disconnect())
+        self.mock_storage.log.assert_called_once_with("offline", "alice")
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_logout_ends_the_stream(self):
+        self.chat_service.online_users = {"alice": Mailbox()}
+
+        async def listen_and_log_out():
+            listener = self.chat_service.ListenForMessages(chat_pb2.ListenForMessagesRequest(username="alice"), MagicMock())
+            waiting = asyncio.ensure_future(anext(listener))
+            await asyncio.sleep(0.05)
+            self.chat_service.Logout(chat_pb2.LogoutRequest(username="alice"), None)
+            with self.assertRaises(StopAsyncIteration):
+                await asyncio.wait_for(waiting, 5)
+
+        asyncio.run(listen_and_log_out())
+        self.mock_storage.mark_unread.assert_not_called()
+
+    def test_broadcast_sync_handles_errors(self):
         replica = MagicMock()
-        replica.FollowerSync.side_effect = mock_grpc.RpcError("sync error")
+        replica.FollowerSync.future.return_value = FinishedCall(grpc.RpcError("sync error"))
         self.chat_service.replicas = [replica]
 
-        self.chat_service.Broadcast_Sync()
+        self.assertFalse(self.chat_service.Broadcast_Sync())
+        self.assertIn(replica, self.chat_service.lagging)
+
+    def test_broadcast_sync_waits_only_for_the_quorum(self):
+        fast, slow = replica_answering(FinishedCall()), replica_answering(PendingCall())
+        self.chat_service.replicas = [fast, slow]
+        self.chat_service.sync_quorum = "majority"
+        self.chat_service.sync_timeout = 5
+
+        started = time.monotonic()
+        self.assertTrue(self.chat_service.Broadcast_Sync())
+        self.assertLess(time.monotonic() - started, 1)
+        # both were asked at once, neither after the other answered
+        slow.FollowerSync.future.assert_called_once()
+
+    def test_unresponsive_replica_costs_the_timeout_once(self):
+        hung = PendingCall()
+        self.chat_service.replicas = [replica_answering(FinishedCall()), replica_answering(hung)]
+        self.chat_service.sync_timeout = 0.2
+
+        started = time.monotonic()
+        self.assertFalse(self.chat_service.Broadcast_Sync())
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        hung.finish(grpc.RpcError("deadline exceeded"))
+
+        started = time.monotonic()
+        self.assertFalse(self.chat_service.Broadcast_Sync())
+        self.assertLess(time.monotonic() - started, 0.2)
+        # once it has caught up it counts again
+        self.chat_service.replicas[1] = replica_answering(FinishedCall())
+        self.chat_service.lagging.clear()
+        self.assertTrue(self.chat_service.Broadcast_Sync())
+
+    def test_send_message_reports_a_missed_quorum(self):
+        dead = replica_answering(FinishedCall(grpc.RpcError("connection refused")))
+        self.chat_service.replicas = [replica_answering(FinishedCall()), dead]
+        request = chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="hello!")
+        # the dead follower fails the first write, and is skipped as lagging for the second
+        for _ in range(2):
+            response = asyncio.run(self.chat_service.SendMessage(request, None))
+            self.assertEqual(response.status, "error")
+            self.assertIn("quorum", response.message)
+        self.assertIn(dead, self.chat_service.lagging)
+        self.assertEqual(self.mock_storage.send_messages.call_count, 2)
+
+        self.chat_service.sync_quorum = "1"
+        response = asyncio.run(self.chat_service.SendMessage(request, None))
+        self.assertEqual(response.status, "success")
+
+    def test_every_write_reports_a_missed_quorum(self):
+        self.chat_service.replicas = [replica_answering(FinishedCall()), replica_answering(FinishedCall(grpc.RpcError("connection refused")))]
+        self.mock_storage.login_register_user.return_value = {"status": "success"}
+        self.mock_storage.read_messages.return_value = {"status": "success", "messages": [{"id": 1, "sender": "bob", "message": "hi"}]}
+        self.mock_storage.delete_message.return_value = {"status": "success", "message": "Message deleted successfully"}
+        self.mock_storage.delete_account.return_value = {"status": "success", "message": "Account deleted successfully"}
+        writes = [
+            lambda: self.chat_service.Login(chat_pb2.LoginRequest(username="alice", password="secret"), None),
+            lambda: self.chat_service.Logout(chat_pb2.LogoutRequest(username="alice"), None),
+            lambda: self.chat_service.ReadMessages(chat_pb2.ReadMessagesRequest(username="alice", limit=1), None),
+            lambda: self.chat_service.DeleteMessage(chat_pb2.DeleteMessageRequest(username="alice", recipient="bob"), None),
+            lambda: self.chat_service.DeleteAccount(chat_pb2.DeleteAccountRequest(username="alice", password="secret"), None),
+        ]
+        for write in writes:
+            response = write()
+            self.assertEqual(response.status, "error")
+            self.assertIn("quorum", response.message)
+        # the messages were marked read all the same
+        self.assertEqual(len(writes[2]().messages), 1)
+
+        self.chat_service.sync_quorum = "1"
+        for write in writes:
+            self.assertEqual(write().status, "success")
+
+    def test_quorum_size(self):
+        self.assertEqual([server.quorum_size("1", n) for n in range(4)], [0, 1, 1, 1])
+        self.assertEqual([server.quorum_size("majority", n) for n in range(5)], [0, 1, 1, 2, 2])
+        self.assertEqual([server.quorum_size("all", n) for n in range(4)], [0, 1, 2, 3])
 
 
     @patch.object(ChatService, "AnnounceNewLeader")
@@ -229,15 +481,11 @@ class TestChatService(unittest.TestCase):
                 self.chat_service.initiate_election()
                 mock_announce.assert_called_once()
 
-    def test_read_messages_replica_failure(self):
+    def test_leader_reads_messages_itself(self):
         self.chat_service.is_leader = True
         
         mock_replica1 = MagicMock()
-        mock_replica1.ReadMessages.side_effect = grpc.RpcError("Replica 1 failed")
-        
         mock_replica2 = MagicMock()
-        mock_replica2.ReadMessages.side_effect = grpc.RpcError("Replica 2 failed")
-        
         self.chat_service.replicas = [mock_replica1, mock_replica2]
         
         self.mock_storage.read_messages.return_value = {
@@ -250,6 +498,49 @@ class TestChatService(unittest.TestCase):
         
         self.assertEqual(response.status, "error")
         self.assertEqual(len(response.messages), 0)
+        # marking messages read is a write, so it happens on the leader and reaches the log
+        mock_replica1.ReadMessages.assert_not_called()
+        mock_replica2.ReadMessages.assert_not_called()
+
+    def test_sync_data_sends_only_new_entries(self):
+        self.mock_storage.log_head.return_value = 7
+        self.mock_storage.log_covers.return_value = True
+        self.mock_storage.read_log.return_value = [{"seq": 6, "op": "delete_message", "args": "[1]"},
+                                                   {"seq": 7, "op": "add_message", "args": '[2, "a", "b", "hi", "unread"]'}]
+        response = asyncio.run(self.chat_service.SyncData(chat_pb2.SyncDataRequest(replica_address="127.0.0.1:50053", after_seq=5), None))
+        self.assertFalse(response.snapshot)
+        self.assertEqual([entry.seq for entry in response.entries], [6, 7])
+        self.assertEqual(response.last_seq, 7)
+        self.mock_storage.read_log.assert_called_once_with(5)
+        self.mock_storage.get_all_messages.assert_not_called()
+
+    def test_sync_data_falls_back_to_a_snapshot(self):
+        self.mock_storage.log_head.return_value = 7
+        self.mock_storage.log_covers.return_value = False
+        self.mock_storage.get_all_messages.return_value = []
+        self.mock_storage.get_all_users.return_value = []
+        response = asyncio.run(self.chat_service.SyncData(chat_pb2.SyncDataRequest(replica_address="127.0.0.1:50053", after_seq=3), None))
+        self.assertTrue(response.snapshot)
+        self.assertEqual(response.last_seq, 7)
+        self.mock_storage.read_log.assert_not_called()
+
+    def test_follower_replays_sessions_and_presence(self):
+        self.chat_service.is_leader = False
+        self.chat_service.leader_address = "127.0.0.1:50051"
+        self.chat_service.leader_stub = MagicMock()
+        t1, t2 = token_digest("t1"), token_digest("t2")
+        entries = [chat_pb2.LogEntry(seq=1, op="login", args=f'["alice", "{t1}", 9999999999]'),
+                   chat_pb2.LogEntry(seq=2, op="login", args=f'["bob", "{t2}", 9999999999]'),
+                   chat_pb2.LogEntry(seq=3, op="logout", args=f'["bob", "{t2}"]')]
+        self.chat_service.leader_stub.SyncData.return_value = chat_pb2.SyncDataResponse(status="success", entries=entries, last_seq=3)
+
+        self.chat_service.FollowerSync(chat_pb2.FollowerSyncDataRequest(), None)
+        self.mock_storage.apply_log.assert_called_once()
+        self.assertEqual(self.chat_service.tokens.lookup("t1"), "alice")
+        self.assertIsNone(self.chat_service.tokens.lookup("t2"))
+        self.assertEqual(list(self.chat_service.online_users), ["alice"])
+        self.assertEqual(self.chat_service.last_applied, 3)
+        self.assertEqual(self.chat_service.leader_stub.SyncData.call_args.args[0].after_seq, 0)
 
     def test_list_accounts_replica_failure(self):
         self.chat_service.is_leader = True
@@ -272,5 +563,248 @@ class TestChatService(unittest.TestCase):
         self.assertEqual(response.status, "error")
         self.assertEqual(len(response.usernames), 0)
 
+
+class FinishedCall:
+    """A FollowerSync future that has already completed, with `error` if given."""
+    def __init__(self, error=None):
+        self.error = error
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return chat_pb2.Response(status="success")
+
+    def add_done_callback(self, callback):
+        callback(self)
+
+
+class PendingCall(FinishedCall):
+    """A FollowerSync future that completes only when the test calls finish()."""
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def finish(self, error=None):
+        self.error = error
+        for callback in self.callbacks:
+            callback(self)
+
+
+def replica_answering(call):
+    replica = MagicMock()
+    replica.FollowerSync.future.return_value = call
+    return replica
+
+
+class Direct:
+    """A stub that calls another in-process ChatService's handlers directly."""
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        def call(request, **kwargs):
+            response = getattr(self.service, name)(request, None)
+            return asyncio.run(response) if inspect.iscoroutine(response) else response
+        call.future = lambda request, **kwargs: FinishedCall() if call(request).status == "success" else FinishedCall(grpc.RpcError())
+        return call
+
+
+class TestLogReplication(unittest.TestCase):
+    def setUp(self):
+        # each service keeps chat-<port>.db in the working directory
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+        self.leader = ChatService(port=50061, is_leader=True)
+        self.follower = ChatService(port=50062, is_leader=True)
+        self.follower.is_leader = False
+        self.follower.storage.log_writes = False
+        self.follower.leader_address = "127.0.0.1:50061"
+        self.follower.leader_stub = Direct(self.leader)
+        self.responses = []
+        sync_data = self.leader.sync_data
+        def recording_sync_data(request):
+            self.responses.append(sync_data(request))
+            return self.responses[-1]
+        self.leader.sync_data = recording_sync_data
+
+    def test_follower_catches_up_from_the_log(self):
+        alice = self.leader.Login(chat_pb2.LoginRequest(username="alice", password="pw"), None).token
+        self.leader.Login(chat_pb2.LoginRequest(username="bob", password="pw"), None)
+        # a new follower starts from a streamed snapshot, then the log after it
+        self.follower.pull_from_leader()
+        self.assertTrue(self.responses[0].snapshot_required)
+        self.assertFalse(any(response.snapshot for response in self.responses))
+        self.assertEqual(self.follower.storage.search_accounts("")["usernames"], ["alice", "bob"])
+        self.assertEqual(self.follower.tokens.lookup(alice), "alice")
+        bootstrap = len(self.responses)
+        self.leader.replicas = [Direct(self.follower)]
+
+        asyncio.run(self.leader.SendMessage(chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="one"), None))
+        asyncio.run(self.leader.SendMessage(chat_pb2.SendMessageRequest(username="alice", recipient="bob", message="two"), None))
+        self.leader.DeleteMessage(chat_pb2.DeleteMessageRequest(username="alice", recipient="bob"), None)
+        context = MagicMock()
+        context.invocation_metadata.return_value = [("session-token", alice)]
+        self.leader.Logout(chat_pb2.LogoutRequest(username="alice"), context)
+
+        # after the snapshot, every sync carried only the entries the follower was missing
+        self.assertTrue(all(not response.snapshot and len(response.entries) == 1 for response in self.responses[bootstrap:]))
+        self.assertEqual(self.follower.last_applied, self.leader.storage.log_head())
+        self.assertEqual([row["message"] for row in self.follower.storage.get_all_messages()], ["one"])
+        self.assertIsNone(self.follower.tokens.lookup(alice))
+        self.assertEqual(list(self.follower.online_users), ["bob"])
+        # sessions are logged and replicated by digest, never the token itself
+        for storage in (self.leader.storage, self.follower.storage):
+            entries = storage.read_log(0, 1000)
+            self.assertIn("login", [entry["op"] for entry in entries])
+            self.assertFalse(any(alice in entry["args"] for entry in entries))
+
+    def test_restarted_follower_asks_for_what_it_missed(self):
+        self.leader.Login(chat_pb2.LoginRequest(username="alice", password="pw"), None)
+        self.follower.pull_from_leader()
+        asyncio.run(self.leader.SendMessage(chat_pb2.SendMessageRequest(username="alice", recipient="alice", message="hi"), None))
+
+        self.follower.last_applied = self.follower.storage.log_head()
+        self.follower.pull_from_leader()
+        self.assertFalse(self.responses[-1].snapshot)
+        self.assertEqual(len(self.follower.storage.get_all_messages()), 1)
+
+    def interrupt_snapshots(self, after_chunks):
+        """Makes the follower's first SnapshotStream break off after `after_chunks` chunks. Returns the requests made."""
+        requests = []
+        def snapshot_stream(request, **kwargs):
+            requests.append(request)
+            for n, chunk in enumerate(self.leader.SnapshotStream(request, None)):
+                if len(requests) == 1 and n == after_chunks:
+                    raise grpc.RpcError("connection lost")
+                yield chunk
+        self.follower.leader_stub.SnapshotStream = snapshot_stream
+        return requests
+
+    @patch.object(server, "SNAPSHOT_CHUNK_BYTES", 16 * 1024)
+    def test_interrupted_snapshot_resumes(self):
+        self.leader.Login(chat_pb2.LoginRequest(username="alice", password="pw"), None)
+        self.leader.storage.send_messages([(i, "alice", "alice", "x" * 1000, "unread") for i in range(1, 201)])
+        requests = self.interrupt_snapshots(after_chunks=3)
+
+        with self.assertRaises(grpc.RpcError):
+            self.follower.pull_from_leader()
+        self.follower.pull_from_leader()
+        self.assertEqual(requests[1].snapshot_id, next(iter(self.leader.snapshots.snapshots)))
+        self.assertEqual(requests[1].offset, 3 * 16 * 1024)
+        self.assertEqual(len(self.follower.storage.get_all_messages()), 200)
+        self.assertEqual(self.follower.last_applied, self.leader.storage.log_head())
+        self.assertEqual(glob.glob("chat-50062.db.*.part"), [])
+
+    def test_snapshot_received_in_full_is_restored_on_resume(self):
+        self.leader.Login(chat_pb2.LoginRequest(username="alice", password="pw"), None)
+        snapshot = self.leader.take_snapshot()
+        shutil.copy(snapshot.path, f"chat-50062.db.{snapshot.id}.part")
+        requests = self.interrupt_snapshots(after_chunks=None)
+
+        self.follower.pull_from_leader()
+        self.assertEqual((requests[0].snapshot_id, requests[0].offset), (snapshot.id, snapshot.size))
+        self.assertEqual(self.follower.storage.search_accounts("")["usernames"], ["alice"])
+        self.assertEqual(list(self.follower.online_users), ["alice"])
+
+    @patch.object(server, "SNAPSHOT_CHUNK_BYTES", 1024)
+    def test_dropped_snapshot_starts_over(self):
+        self.leader.Login(chat_pb2.LoginRequest(username="alice", password="pw"), None)
+        requests = self.interrupt_snapshots(after_chunks=2)
+        with self.assertRaises(grpc.RpcError):
+            self.follower.pull_from_leader()
+        for _ in range(KEPT_SNAPSHOTS):
+            self.leader.take_snapshot()
+
+        self.follower.pull_from_leader()
+        self.assertNotEqual(requests[1].snapshot_id, "")
+        self.assertNotIn(requests[1].snapshot_id, self.leader.snapshots.snapshots)
+        self.assertEqual(self.follower.storage.search_accounts("")["usernames"], ["alice"])
+        self.assertEqual(glob.glob("chat-50062.db.*.part"), [])
+
+
+class TestReplicationStream(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.leader = ChatService(port=50071, is_leader=True)
+        self.leader.Login(chat_pb2.LoginRequest(username="alice", password="pw"), None)
+
+    def serve_leader(self):
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        async def start():
+            server = create_server(self.leader)
+            port = server.add_insecure_port("127.0.0.1:0")
+            await server.start()
+            return server, port
+
+        server, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        self.addCleanup(loop.call_soon_threadsafe, loop.stop)
+        self.addCleanup(lambda: asyncio.run_coroutine_threadsafe(server.stop(0), loop).result())
+        return port
+
+    def test_follower_is_pushed_each_write(self):
+        port = self.serve_leader()
+        follower = ChatService(port=50072, is_leader=True)
+        follower.is_leader = False
+        follower.storage.log_writes = False
+        follower.leader_stub = chat_pb2_grpc.ChatServiceStub(grpc.insecure_channel(f"127.0.0.1:{port}"))
+        # stops the stream when the test is done
+        self.addCleanup(setattr, follower, "is_leader", True)
+        follower.start_following()
+        deadline = time.monotonic() + 5
+        while not self.leader.streams:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+        # nothing answers FollowerSync at the follower's address, so the quorum can only come from the stream
+        request = chat_pb2.SendMessageRequest(username="alice", recipient="alice", message="pushed")
+        asyncio.run(self.leader.SendMessage(request, None))
+        self.assertEqual([row["message"] for row in follower.storage.get_all_messages()], ["pushed"])
+        self.assertEqual(follower.last_applied, self.leader.storage.log_head())
+        self.assertFalse(self.leader.lagging)
+
+    def test_unacknowledged_entries_hold_back_the_stream(self):
+        for name in ("bob", "carol", "dave"):
+            self.leader.Login(chat_pb2.LoginRequest(username=name, password="pw"), None)
+        self.leader.replication_window = 2
+        head = self.leader.storage.log_head()
+
+        async def follow():
+            acks = asyncio.Queue()
+            await acks.put(chat_pb2.ReplicationAck(replica_address="127.0.0.1:50079", applied_seq=1))
+
+            async def requests():
+                while True:
+                    yield await acks.get()
+
+            stream = self.leader.ReplicationStream(requests(), MagicMock())
+            first = await asyncio.wait_for(anext(stream), 5)
+            self.assertEqual([entry.seq for entry in first.entries], list(range(2, head + 1)))
+
+            # more of the log, but the first batch is still unacknowledged
+            self.leader.storage.log("logout", "bob", "")
+            self.leader.streams["127.0.0.1:50079"].advance(head + 1)
+            waiting = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0.2)
+            self.assertFalse(waiting.done())
+
+            await acks.put(chat_pb2.ReplicationAck(applied_seq=head))
+            second = await asyncio.wait_for(waiting, 5)
+            self.assertEqual([entry.seq for entry in second.entries], [head + 1])
+            await stream.aclose()
+            self.assertNotIn("127.0.0.1:50079", self.leader.streams)
+
+        asyncio.run(follow())
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import threading
+import unittest
+from argparse import ArgumentParser
+from concurrent import futures
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+from serverconfig import ServerConfig, StreamExecutorInterceptor, add_server_arguments
+
+
+class TestServerConfig(unittest.TestCase):
+    def test_options_from_the_command_line(self):
+        parser = ArgumentParser()
+        add_server_arguments(parser)
+        config = ServerConfig.from_args(parser.parse_args(["--workers", "32", "--keepalive-time", "30", "--max-message-bytes", "1024"]))
+        self.assertEqual(config.workers, 32)
+        self.assertIsNone(config.max_concurrent_rpcs)
+        options = dict(config.options())
+        self.assertEqual(options["grpc.keepalive_time_ms"], 30000)
+        self.assertEqual(options["grpc.max_receive_message_length"], 1024)
+        self.assertNotIn("grpc.keepalive_time_ms", dict(ServerConfig().options()))
+
+
+class HistoryService(chat_pb2_grpc.ChatServiceServicer):
+    def StreamHistory(self, request, context):
+        if request.resume_token == "bad":
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Invalid resume token")
+            return
+        for i in range(3):
+            yield chat_pb2.HistoryChunk(resume_token=threading.current_thread().name)
+
+
+class TestStreamExecutorInterceptor(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+        async def start():
+            executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="streams")
+            server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="unary"),
+                                     interceptors=[StreamExecutorInterceptor(executor)])
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(HistoryService(), server)
+            port = server.add_insecure_port("127.0.0.1:0")
+            await server.start()
+            return server, port
+
+        self.server, port = asyncio.run_coroutine_threadsafe(start(), self.loop).result()
+        self.channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+
+    def tearDown(self):
+        self.channel.close()
+        asyncio.run_coroutine_threadsafe(self.server.stop(0), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def test_plain_streams_run_on_the_stream_executor(self):
+        chunks = list(self.stub.StreamHistory(chat_pb2.StreamHistoryRequest(username="alice")))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(all(chunk.resume_token.startswith("streams") for chunk in chunks))
+
+    def test_abort_from_a_stream_thread_reaches_the_client(self):
+        with self.assertRaises(grpc.RpcError) as error:
+            list(self.stub.StreamHistory(chat_pb2.StreamHistoryRequest(username="alice", resume_token="bad")))
+        self.assertEqual(error.exception.code(), grpc.StatusCode.INVALID_ARGUMENT)
+        self.assertEqual(error.exception.details(), "Invalid resume token")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,12 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import unittest
+import unittest.mock
 import os
 import tempfile
-from storage import Storage
+import threading
+import sqlite3
+from storage import MIGRATIONS, Storage
 import bcrypt
 import time
 import chat_pb2  # Required for store_synced_data test
@@ -20,6 +23,59 @@ class TestStorage(unittest.TestCase):
         os.close(self.db_fd)
         os.remove(self.db_path)
 
+    def test_schema_is_at_latest_version(self):
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        self.assertTrue({"messages_recipient_status", "messages_sender_recipient"} <= indexes)
+        conn.close()
+
+    def test_list_accounts_with_cursor(self):
+        names = [f"user{i:02d}" for i in range(12)]
+        for name in reversed(names):
+            self.storage.execute_query("INSERT INTO users (username, password_hash) VALUES (?, 'x')", (name,), commit=True)
+
+        pages, cursor = [], None
+        while True:
+            result = self.storage.list_accounts(page_size=5, cursor=cursor)
+            pages.append(result["usernames"])
+            cursor = result["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(pages, [names[:5], names[5:10], names[10:]])
+        self.assertEqual(self.storage.list_accounts(2, page_size=5)["usernames"], names[5:10])
+        self.assertEqual(self.storage.list_accounts(cursor="not base64!")["status"], "error")
+
+    def test_search_accounts(self):
+        for name in ("alice", "alicia", "malice"):
+            self.storage.login_register_user(name, "secret")
+        self.assertEqual(self.storage.search_accounts("ali")["usernames"], ["alice", "alicia"])
+        self.storage.delete_account("alice", "secret")
+        self.assertEqual(self.storage.search_accounts("lice", substring=True)["usernames"], ["malice"])
+
+        # the index is loaded from the users table when the database is reopened
+        reopened = Storage(self.db_path)
+        self.assertEqual(reopened.search_accounts("", limit=10)["usernames"], ["alicia", "malice"])
+
+    def test_search_accounts_sees_synced_users(self):
+        self.storage.store_synced_data([], [chat_pb2.UserData(username="zoe", password_hash=b"hash")])
+        self.assertEqual(self.storage.search_accounts("zo")["usernames"], ["zoe"])
+
+    def test_iter_history_walks_in_batches(self):
+        self.storage.login_register_user("alice", "secret")
+        self.storage.login_register_user("bob", "secret")
+        for i in range(7):
+            self.storage.send_message("alice", "bob", f"m{i}")
+        self.storage.read_messages("bob", 3)
+
+        with unittest.mock.patch.object(self.storage, "execute_query", wraps=self.storage.execute_query) as query:
+            history = list(self.storage.iter_history("bob", batch_size=3))
+        self.assertEqual([msg["message"] for msg in history], [f"m{i}" for i in range(7)])
+        self.assertEqual(query.call_count, 3)
+
+        ids = [msg["id"] for msg in history]
+        self.assertEqual([msg["message"] for msg in self.storage.iter_history("bob", ids[1], ids[4])], ["m2", "m3"])
+
     def test_login_register_user(self):
         result = self.storage.login_register_user("alice", "secret")
         self.assertEqual(result["status"], "success")
@@ -39,6 +95,17 @@ class TestStorage(unittest.TestCase):
         result = self.storage.send_message("alice", "charlie", "hi?")
         self.assertEqual(result["status"], "error")
 
+    def test_send_messages_stores_a_batch(self):
+        self.storage.login_register_user("alice", "pw")
+        self.storage.login_register_user("bob", "pw")
+        self.storage.log_writes = True
+        results = self.storage.send_messages([(1, "alice", "bob", "one", "unread"),
+                                              (2, "alice", "charlie", "lost", "unread"),
+                                              (3, "bob", "alice", "two", "read")])
+        self.assertEqual([result["status"] for result in results], ["success", "error", "success"])
+        self.assertEqual([row["id"] for row in self.storage.get_all_messages()], [1, 3])
+        self.assertEqual([entry["op"] for entry in self.storage.read_log(0)], ["add_message", "add_message"])
+
     def test_read_messages(self):
         self.storage.login_register_user("alice", "pw")
         self.storage.login_register_user("bob", "pw")
@@ -51,6 +118,45 @@ class TestStorage(unittest.TestCase):
         result = self.storage.read_messages("alice", limit=1)
         self.assertEqual(result["status"], "error")
 
+    def test_mark_unread(self):
+        self.storage.login_register_user("alice", "pw")
+        self.storage.login_register_user("bob", "pw")
+        self.storage.send_message("bob", "alice", "pushed", status="read", message_id=1)
+        self.storage.send_message("bob", "alice", "seen", status="read", message_id=2)
+
+        self.storage.mark_unread([1])
+        result = self.storage.read_messages("alice", limit=10)
+        self.assertEqual([msg["message"] for msg in result["messages"]], ["pushed"])
+
+    def test_concurrent_readers_get_each_message_once(self):
+        self.storage.login_register_user("alice", "pw")
+        self.storage.login_register_user("bob", "pw")
+        for message_id in range(1, 51):
+            self.storage.send_message("bob", "alice", f"message {message_id}", message_id=message_id)
+
+        read_ids = []
+        def reader():
+            while True:
+                result = self.storage.read_messages("alice", limit=3)
+                if result["status"] != "success":
+                    break
+                read_ids.extend(message["id"] for message in result["messages"])
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(read_ids), list(range(1, 51)))
+
+    def test_messages_sent_in_the_same_millisecond_are_all_stored(self):
+        self.storage.login_register_user("alice", "pw")
+        self.storage.login_register_user("bob", "pw")
+        for i in range(20):
+            self.storage.send_message("bob", "alice", f"message {i}")
+        result = self.storage.read_messages("alice", limit=50)
+        self.assertEqual(len(result["messages"]), 20)
+
     def test_delete_message(self):
         self.storage.login_register_user("alice", "pw")
         self.storage.login_register_user("bob", "pw")
@@ -103,5 +209,84 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(len(self.storage.get_all_users()), 1)
         self.assertEqual(len(self.storage.get_all_messages()), 1)
 
+    def replica(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.close, fd)
+        return Storage(path)
+
+    def test_writes_are_logged_only_when_enabled(self):
+        self.storage.login_register_user("alice", "pw")
+        self.assertEqual(self.storage.log_head(), 0)
+
+        self.storage.log_writes = True
+        self.storage.login_register_user("bob", "pw")
+        self.storage.send_message("alice", "bob", "hi")
+        self.storage.read_messages("bob", 10)
+        self.storage.delete_message("alice", "bob")
+        self.storage.log("logout", "bob", "token")
+        entries = self.storage.read_log(0)
+        self.assertEqual([entry["op"] for entry in entries], ["add_user", "add_message", "set_status", "delete_message", "logout"])
+        self.assertEqual([entry["seq"] for entry in entries], [1, 2, 3, 4, 5])
+        self.assertEqual(self.storage.read_log(3), entries[3:])
+
+    def test_apply_log_replays_the_leader(self):
+        self.storage.log_writes = True
+        for name in ("alice", "bob", "carol"):
+            self.storage.login_register_user(name, "pw")
+        self.storage.send_message("alice", "bob", "one")
+        self.storage.send_message("alice", "bob", "two")
+        self.storage.send_message("bob", "carol", "three")
+        self.storage.read_messages("bob", 1)
+        self.storage.delete_message("alice", "bob")
+        self.storage.delete_account("carol", "pw")
+
+        replica = self.replica()
+        entries = [chat_pb2.LogEntry(**entry) for entry in self.storage.read_log(0)]
+        self.assertEqual(replica.apply_log(entries[:4]), 4)
+        # replaying entries already applied changes nothing
+        self.assertEqual(replica.apply_log(entries), self.storage.log_head())
+        self.assertEqual(replica.log_head(), self.storage.log_head())
+        self.assertEqual(sorted(map(tuple, replica.get_all_messages())), sorted(map(tuple, self.storage.get_all_messages())))
+        self.assertEqual(sorted(map(tuple, replica.get_all_users())), sorted(map(tuple, self.storage.get_all_users())))
+        self.assertEqual(replica.search_accounts("")["usernames"], ["alice", "bob"])
+        self.assertEqual(replica.login_register_user("bob", "pw")["status"], "success")
+
+    def test_backup_and_restore(self):
+        self.storage.log_writes = True
+        for name in ("alice", "bob"):
+            self.storage.login_register_user(name, "pw")
+        self.storage.send_message("alice", "bob", "hi")
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        self.addCleanup(os.remove, path)
+        self.assertEqual(self.storage.backup(path), 3)
+
+        replica = self.replica()
+        replica.login_register_user("stale", "pw")
+        self.assertEqual(replica.restore(path), 3)
+        self.assertEqual(replica.search_accounts("")["usernames"], ["alice", "bob"])
+        self.assertEqual(sorted(map(tuple, replica.get_all_messages())), sorted(map(tuple, self.storage.get_all_messages())))
+        # the log came along, so the replica carries on from the backup's last seq
+        self.assertTrue(replica.log_covers(3))
+        self.assertEqual(replica.read_log(0), self.storage.read_log(0))
+
+    def test_log_covers_after_a_snapshot(self):
+        self.assertTrue(self.storage.log_covers(0))
+        self.assertFalse(self.storage.log_covers(1))
+
+        self.storage.load_snapshot([], [chat_pb2.UserData(username="zoe", password_hash=b"hash")], 10)
+        self.assertEqual(self.storage.log_head(), 10)
+        self.assertEqual(self.storage.search_accounts("")["usernames"], ["zoe"])
+        self.storage.log_writes = True
+        self.storage.send_message("zoe", "zoe", "hi")
+        self.assertEqual(self.storage.log_head(), 11)
+        self.assertTrue(self.storage.log_covers(10))
+        self.assertTrue(self.storage.log_covers(11))
+        # entries up to 10 are only in the snapshot
+        self.assertFalse(self.storage.log_covers(9))
+        self.assertFalse(self.storage.log_covers(12))
+
 if __name__ == "__main__":
     unittest.main()
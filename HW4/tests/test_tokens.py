@@ -0,0 +1,175 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import threading
+import unittest
+from concurrent import futures
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+from tokens import AsyncTokenAuthInterceptor, SessionTokens, TokenAuthInterceptor, TokenClientInterceptor, token_digest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionTokens(unittest.TestCase):
+    def test_lookup_and_revoke(self):
+        tokens = SessionTokens(ttl=60)
+        alice = tokens.issue("alice")
+        other = tokens.issue("alice")
+        bob = tokens.issue("bob")
+        self.assertEqual(tokens.lookup(alice), "alice")
+        self.assertIsNone(tokens.lookup("made-up"))
+
+        tokens.revoke(alice)
+        self.assertIsNone(tokens.lookup(alice))
+        self.assertEqual(tokens.lookup(other), "alice")
+
+        tokens.revoke_user("alice")
+        self.assertIsNone(tokens.lookup(other))
+        self.assertEqual(tokens.lookup(bob), "bob")
+
+    def test_tokens_expire_unless_used(self):
+        clock = Clock()
+        tokens = SessionTokens(ttl=60, clock=clock)
+        used = tokens.issue("alice")
+        idle = tokens.issue("bob")
+        clock.now += 50
+        self.assertEqual(tokens.lookup(used), "alice")
+        clock.now += 50
+        self.assertEqual(tokens.lookup(used), "alice")
+        self.assertIsNone(tokens.lookup(idle))
+
+    def test_snapshot_and_replace(self):
+        tokens = SessionTokens(ttl=60)
+        token = tokens.issue("alice")
+        follower = SessionTokens(ttl=60)
+        follower.issue("stale")
+        follower.replace(tokens.snapshot())
+        self.assertEqual(follower.lookup(token), "alice")
+        self.assertEqual(list(follower.by_user), ["alice"])
+        # only the digest leaves the table, and it can't be used as a token
+        self.assertEqual(tokens.snapshot()[0][0], token_digest(token))
+        self.assertIsNone(follower.lookup(token_digest(token)))
+        follower.discard(token_digest(token))
+        self.assertIsNone(follower.lookup(token))
+
+
+class EchoService(chat_pb2_grpc.ChatServiceServicer):
+    def ReadMessages(self, request, context):
+        return chat_pb2.ReadMessagesResponse(status="success")
+
+    def Heartbeat(self, request, context):
+        return chat_pb2.Response(status="alive")
+
+
+class TestTokenAuthInterceptor(unittest.TestCase):
+    def setUp(self):
+        self.tokens = SessionTokens(ttl=60)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), interceptors=[TokenAuthInterceptor(self.tokens)])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(EchoService(), self.server)
+        port = self.server.add_insecure_port("127.0.0.1:0")
+        self.server.start()
+        self.channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(0)
+
+    def stub_with(self, token):
+        return chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(self.channel, TokenClientInterceptor(lambda: token)))
+
+    def read(self, token, username="alice"):
+        return self.stub_with(token).ReadMessages(chat_pb2.ReadMessagesRequest(username=username, limit=1))
+
+    def test_missing_token_is_rejected(self):
+        with self.assertRaises(grpc.RpcError) as error:
+            self.read(None)
+        self.assertEqual(error.exception.code(), grpc.StatusCode.UNAUTHENTICATED)
+
+    def test_valid_token_is_accepted(self):
+        self.assertEqual(self.read(self.tokens.issue("alice")).status, "success")
+
+    def test_token_for_another_user_is_rejected(self):
+        with self.assertRaises(grpc.RpcError) as error:
+            self.read(self.tokens.issue("mallory"))
+        self.assertEqual(error.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+
+    def test_replication_calls_need_no_token(self):
+        self.assertEqual(self.stub_with(None).Heartbeat(chat_pb2.HeartbeatRequest()).status, "alive")
+
+
+class AsyncEchoService(EchoService):
+    async def ListenForMessages(self, request, context):
+        yield chat_pb2.Message(id=1, sender="bob", message="hi")
+
+    async def SendMessage(self, request, context):
+        return chat_pb2.Response(status="success")
+
+
+class TestAsyncTokenAuthInterceptor(unittest.TestCase):
+    def setUp(self):
+        self.tokens = SessionTokens(ttl=60)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+        async def start():
+            server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor(max_workers=2),
+                                     interceptors=[AsyncTokenAuthInterceptor(self.tokens)])
+            chat_pb2_grpc.add_ChatServiceServicer_to_server(AsyncEchoService(), server)
+            port = server.add_insecure_port("127.0.0.1:0")
+            await server.start()
+            return server, port
+
+        self.server, port = asyncio.run_coroutine_threadsafe(start(), self.loop).result()
+        self.channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+
+    def tearDown(self):
+        self.channel.close()
+        asyncio.run_coroutine_threadsafe(self.server.stop(0), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def listen(self, token, username="alice"):
+        stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(self.channel, TokenClientInterceptor(lambda: token)))
+        return [message.message for message in stub.ListenForMessages(chat_pb2.ListenForMessagesRequest(username=username))]
+
+    def test_async_handler_is_checked(self):
+        self.assertEqual(self.listen(self.tokens.issue("alice")), ["hi"])
+        with self.assertRaises(grpc.RpcError) as error:
+            self.listen(None)
+        self.assertEqual(error.exception.code(), grpc.StatusCode.UNAUTHENTICATED)
+        with self.assertRaises(grpc.RpcError) as error:
+            self.listen(self.tokens.issue("mallory"))
+        self.assertEqual(error.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+
+    def test_coroutine_handler_is_checked(self):
+        def send(token, username="alice"):
+            stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(self.channel, TokenClientInterceptor(lambda: token)))
+            return stub.SendMessage(chat_pb2.SendMessageRequest(username=username, recipient="bob", message="hi"))
+        self.assertEqual(send(self.tokens.issue("alice")).status, "success")
+        with self.assertRaises(grpc.RpcError) as error:
+            send(None)
+        self.assertEqual(error.exception.code(), grpc.StatusCode.UNAUTHENTICATED)
+        with self.assertRaises(grpc.RpcError) as error:
+            send(self.tokens.issue("mallory"))
+        self.assertEqual(error.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+
+    def test_sync_handler_is_checked(self):
+        stub = chat_pb2_grpc.ChatServiceStub(grpc.intercept_channel(self.channel, TokenClientInterceptor(lambda: None)))
+        with self.assertRaises(grpc.RpcError) as error:
+            stub.ReadMessages(chat_pb2.ReadMessagesRequest(username="alice", limit=1))
+        self.assertEqual(error.exception.code(), grpc.StatusCode.UNAUTHENTICATED)
+        self.assertEqual(stub.Heartbeat(chat_pb2.HeartbeatRequest()).status, "alive")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+"""
+Session tokens for the chat service.
+
+Login issues a random token. The client sends it as `session-token` metadata on every
+call, and TokenAuthInterceptor looks it up in an in-memory table before the handler
+runs. An authenticated call costs one dictionary lookup instead of a bcrypt check, and
+a request's `username` field is only trusted if it matches the token's owner.
+
+The table keeps only a SHA-256 digest of each token, and sessions are shared with other
+processes and replicas by digest, so a copy of the table or of the replication log
+can't be used to log in.
+"""
+import collections
+import hashlib
+import inspect
+import secrets
+import threading
+import time
+import grpc
+
+TOKEN_METADATA_KEY = "session-token"
+
+# RPCs that act on behalf of a logged-in user
+PROTECTED_METHODS = frozenset({
+    "Logout", "ListAccounts", "SearchAccounts", "SendMessage", "ReadMessages",
+    "DeleteMessage", "DeleteAccount", "ListenForMessages", "StreamHistory",
+})
+
+
+def token_digest(token):
+    """What a session is stored and shared under instead of its token."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionTokens:
+    """
+    Thread-safe token -> username table, keyed by token digest. Each use of a token extends
+    its lifetime to `ttl` seconds from now; expired tokens are dropped as new ones are issued.
+    """
+    def __init__(self, ttl=3600, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        # token digest -> (username, expires_at), least recently used first
+        self.sessions = collections.OrderedDict()
+        # username -> token digests, for logging a user out everywhere
+        self.by_user = {}
+        self.lock = threading.Lock()
+
+    def issue(self, username):
+        token = secrets.token_urlsafe(32)
+        self.add(token_digest(token), username, self.clock() + self.ttl)
+        return token
+
+    def add(self, digest, username, expires_at):
+        """Adds a session by its token's digest, as issued here or by another process."""
+        with self.lock:
+            self._evict_expired()
+            self.sessions[digest] = (username, expires_at)
+            self.sessions.move_to_end(digest)
+            self.by_user.setdefault(username, set()).add(digest)
+
+    def lookup(self, token):
+        """The username a valid token belongs to, or None."""
+        digest = token_digest(token)
+        with self.lock:
+            entry = self.sessions.get(digest)
+            if entry is None:
+                return None
+            now = self.clock()
+            if entry[1] < now:
+                self._remove(digest)
+                return None
+            self.sessions[digest] = (entry[0], now + self.ttl)
+            self.sessions.move_to_end(digest)
+            return entry[0]
+
+    def revoke(self, token):
+        self.discard(token_digest(token))
+
+    def discard(self, digest):
+        """Ends the session with this token digest, if there is one."""
+        with self.lock:
+            if digest in self.sessions:
+                self._remove(digest)
+
+    def revoke_user(self, username):
+        with self.lock:
+            for digest in list(self.by_user.get(username, ())):
+                self._remove(digest)
+
+    def snapshot(self):
+        """All live sessions as (token digest, username, expires_at) tuples."""
+        with self.lock:
+            self._evict_expired()
+            return [(digest, username, expires_at) for digest, (username, expires_at) in self.sessions.items()]
+
+    def replace(self, sessions):
+        """Replace the whole table with (token digest, username, expires_at) tuples from snapshot()."""
+        with self.lock:
+            self.sessions.clear()
+            self.by_user.clear()
+            for digest, username, expires_at in sorted(sessions, key=lambda session: session[2]):
+                self.sessions[digest] = (username, expires_at)
+                self.by_user.setdefault(username, set()).add(digest)
+
+    def _remove(self, digest):
+        username, _ = self.sessions.pop(digest)
+        digests = self.by_user[username]
+        digests.discard(digest)
+        if not digests:
+            del self.by_user[username]
+
+    def _evict_expired(self):
+        now = self.clock()
+        while self.sessions:
+            digest, (_, expires_at) = next(iter(self.sessions.items()))
+            if expires_at >= now:
+                break
+            self._remove(digest)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+def token_from_context(context):
+    """The session token sent with a call, or None."""
+    if context is None:
+        return None
+    for key, value in context.invocation_metadata() or ():
+        if key == TOKEN_METADATA_KEY:
+            return value
+    return None
+
+
+def _rejection(username, request):
+    """(status code, details) to abort a protected call with, or None to let it through."""
+    if username is None:
+        return grpc.StatusCode.UNAUTHENTICATED, "Missing or expired session token"
+    if getattr(request, "username", username) != username:
+        return grpc.StatusCode.PERMISSION_DENIED, "Session token belongs to another user"
+    return None
+
+
+class TokenAuthInterceptor(grpc.ServerInterceptor):
+    """
+    Rejects calls to protected methods that don't carry a valid session token
+    (UNAUTHENTICATED), or whose request names another user (PERMISSION_DENIED).
+    """
+    def __init__(self, tokens, protected=PROTECTED_METHODS):
+        self.tokens = tokens
+        self.protected = protected
+
+    def intercept_service(self, continuation, handler_call_details):
+        return self.secure(continuation(handler_call_details), handler_call_details)
+
+    def secure(self, handler, handler_call_details):
+        """`handler` wrapped with the token check, or unchanged if the method is unprotected."""
+        if handler is None or handler_call_details.method.rsplit("/", 1)[-1] not in self.protected:
+            return handler
+        token = dict(handler_call_details.invocation_metadata or ()).get(TOKEN_METADATA_KEY)
+        username = self.tokens.lookup(token) if token else None
+
+        def check(request, context):
+            rejection = _rejection(username, request)
+            if rejection:
+                context.abort(*rejection)
+
+        if handler.unary_unary and inspect.iscoroutinefunction(handler.unary_unary):
+            async def unary_unary(request, context):
+                rejection = _rejection(username, request)
+                if rejection:
+                    await context.abort(*rejection)
+                return await handler.unary_unary(request, context)
+            return grpc.unary_unary_rpc_method_handler(
+                unary_unary, handler.request_deserializer, handler.response_serializer)
+        if handler.unary_unary:
+            def unary_unary(request, context):
+                check(request, context)
+                return handler.unary_unary(request, context)
+            return grpc.unary_unary_rpc_method_handler(
+                unary_unary, handler.request_deserializer, handler.response_serializer)
+        if handler.unary_stream and inspect.isasyncgenfunction(handler.unary_stream):
+            # grpc.aio runs async generators on the event loop, where abort has to be awaited
+            async def unary_stream(request, context):
+                rejection = _rejection(username, request)
+                if rejection:
+                    await context.abort(*rejection)
+                async for response in handler.unary_stream(request, context):
+                    yield response
+            return grpc.unary_stream_rpc_method_handler(
+                unary_stream, handler.request_deserializer, handler.response_serializer)
+        if handler.unary_stream:
+            def unary_stream(request, context):
+                check(request, context)
+                return handler.unary_stream(request, context)
+            return grpc.unary_stream_rpc_method_handler(
+                unary_stream, handler.request_deserializer, handler.response_serializer)
+        return handler
+
+
+class AsyncTokenAuthInterceptor(grpc.aio.ServerInterceptor):
+    """TokenAuthInterceptor for a grpc.aio server."""
+    def __init__(self, tokens, protected=PROTECTED_METHODS):
+        self.interceptor = TokenAuthInterceptor(tokens, protected)
+
+    async def intercept_service(self, continuation, handler_call_details):
+        return self.interceptor.secure(await continuation(handler_call_details), handler_call_details)
+
+
+class _CallDetails(collections.namedtuple("_CallDetails", ("method", "timeout", "metadata", "credentials", "wait_for_ready", "compression")),
+                   grpc.ClientCallDetails):
+    pass
+
+
+class TokenClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """Adds the current session token, from `get_token()`, to every outgoing call."""
+    def __init__(self, get_token):
+        self.get_token = get_token
+
+    def _with_token(self, details):
+        token = self.get_token()
+        if not token:
+            return details
+        metadata = list(details.metadata or ()) + [(TOKEN_METADATA_KEY, token)]
+        return _CallDetails(details.method, details.timeout, metadata, details.credentials,
+                            details.wait_for_ready, details.compression)
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return continuation(self._with_token(client_call_details), request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        return continuation(self._with_token(client_call_details), request)